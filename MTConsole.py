@@ -21,32 +21,115 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import serial
 import selectors
 import sys
 import argparse
 
+import addrcache
+import debuglog
+import devstate
 import keyboard
 import mtcmds
+import server
+import transport
 
 
 parser = argparse.ArgumentParser(description="MTAPI Console")
 parser.add_argument("-s", "--serial", default="/dev/ttyUSB0",
-                    help="Serial device to connect to "
-                    "(default: %(default)s)")
+                    help="Serial device to connect to, or tcp:[HOST:]PORT "
+                    "or unix:PATH for a serial bridge or simulator, or "
+                    "pty: for a new pseudo-terminal (default: %(default)s)")
 parser.add_argument("-b", "--baud", type=int, default="115200",
                     help="Baud rate (default: %(default)s)")
+parser.add_argument("--script", metavar="FILE",
+                    help="Run the console commands in FILE and exit")
+parser.add_argument("--wait", action="store_true",
+                    help="When running a script, wait for the response "
+                    "to each SREQ before sending the next command")
+parser.add_argument("--linger", type=float, default=0.5,
+                    help="Seconds to keep displaying input after a "
+                    "script finishes (default: %(default)s)")
+parser.add_argument("--raw", action="store_true",
+                    help="Treat lines typed as frames in hex, as for the "
+                    "'raw' command")
+parser.add_argument("--output", choices=mtcmds.DISPLAY_MODES,
+                    default="decode",
+                    help="How to display received packets "
+                    "(default: %(default)s)")
+parser.add_argument("--serve", action="append", default=[],
+                    metavar="ADDRESS",
+                    help="Share the device with other programs through "
+                    "sockets at ADDRESS, either unix:PATH or "
+                    "tcp:[HOST:]PORT (may be repeated)")
 args = parser.parse_args()
 
 
-sock = serial.Serial(args.serial, args.baud, timeout=0)
+try:
+    sock = transport.open_transport(args.serial, args.baud)
+except ImportError:
+    sys.exit("pyserial is needed to use serial ports")
+except (ValueError, OSError) as e:
+    sys.exit("Unable to connect to %s: %s" % (args.serial, e))
+if isinstance(sock, transport.PtyTransport):
+    print("Connect the device to", sock.name)
+if args.script is not None:
+    mtapi_rx = mtcmds.MTAPI(sock)
+    mtapi_rx.display = args.output
+    addresses = addrcache.AddressCache()
+    addresses.attach(mtapi_rx)
+    debug_log = debuglog.DebugLog()
+    debug_log.attach(mtapi_rx)
+    device = devstate.DeviceState()
+    device.attach(mtapi_rx)
+    keyhandler = keyboard.UIHandler(sock, mtapi_rx, interactive=False,
+                                    addresses=addresses,
+                                    debug_log=debug_log, device=device)
+    source_args = [args.script]
+    if args.wait:
+        source_args.append("wait")
+    try:
+        if keyhandler.do_source(source_args):
+            mtapi_rx.run_until(lambda: False, args.linger)
+    except EOFError as e:
+        sys.exit(str(e))
+    sys.exit(0)
+
 with selectors.DefaultSelector() as selector:
     mtapi_rx = mtcmds.MTAPI(sock)
-    keyhandler = keyboard.UIHandler(sock)
-    selector.register(sock, selectors.EVENT_READ, mtapi_rx)
+    mtapi_rx.display = args.output
+    addresses = addrcache.AddressCache()
+    addresses.attach(mtapi_rx)
+    debug_log = debuglog.DebugLog()
+    debug_log.attach(mtapi_rx)
+    device = devstate.DeviceState()
+    device.attach(mtapi_rx)
+    keyhandler = keyboard.UIHandler(sock, mtapi_rx, raw=args.raw,
+                                    addresses=addresses,
+                                    debug_log=debug_log, device=device)
+    selector.register(sock, selectors.EVENT_READ, mtapi_rx.work)
     selector.register(sys.stdin, selectors.EVENT_READ, keyhandler)
+    mt_server = server.MTServer(sock, mtapi_rx, selector)
+    for address in args.serve:
+        try:
+            mt_server.listen(address)
+        except (ValueError, OSError) as e:
+            sys.exit("Unable to serve %s: %s" % (address, e))
     running = True
+    closed = None
     while running:
-        events = selector.select()
-        for key, _ in events:
-            running = key.data() and running
+        timeouts = [t for t in (keyhandler.timeout(), mt_server.wait_time())
+                    if t is not None]
+        events = selector.select(min(timeouts) if timeouts else None)
+        try:
+            for key, _ in events:
+                running = key.data() and running
+        except EOFError as e:
+            # The device, bridge or simulator has gone away
+            closed = e
+            break
+        if running:
+            keyhandler.tick()
+            mt_server.tick()
+    mt_server.close()
+    if closed is not None:
+        sys.exit(str(closed))
@@ -0,0 +1,270 @@
+#! /usr/bin/env python3
+
+# addrcache.py
+#
+# Remembering which network address belongs to which IEEE address
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import OrderedDict
+import mtapi
+from mtapi import ParseError
+from template import FrameTemplate
+import pipeline
+
+
+# The most address pairs remembered by default
+ADDRESS_CACHE_SIZE = 1024
+
+# Network addresses that never belong to a single device
+NWK_ADDR_INVALID = 0xfff8
+
+# Replies that name a device by both its addresses, and the fields
+# holding them
+NWK_ADDR_RSP = ("AREQ", "ZDO", 0x80)
+IEEE_ADDR_RSP = ("AREQ", "ZDO", 0x81)
+END_DEVICE_ANNCE_IND = ("AREQ", "ZDO", 0xc1)
+GET_DEVICE_INFO_RSP = ("SRSP", "UTIL", 0x00)
+ANNOUNCEMENTS = {
+    NWK_ADDR_RSP: ("NwkAddr", "IEEEAddr"),
+    IEEE_ADDR_RSP: ("NwkAddr", "IEEEAddr"),
+    END_DEVICE_ANNCE_IND: ("NwkAddr", "IEEEAddr"),
+    GET_DEVICE_INFO_RSP: ("ShortAddr", "IEEEAddr")
+}
+
+# How long to wait for a device to answer a request for its address
+# across the network
+NETWORK_TIMEOUT = 5.0
+
+# The address manager lookups, whose replies only make sense with
+# the requests that prompted them
+EXT_ADDR_LOOKUP = ("SREQ", "UTIL", 0x40)
+NWK_ADDR_LOOKUP = ("SREQ", "UTIL", 0x41)
+LOOKUPS = {
+    ("SRSP", "UTIL", 0x40): EXT_ADDR_LOOKUP,
+    ("SRSP", "UTIL", 0x41): NWK_ADDR_LOOKUP
+}
+
+
+def format_ieee(ieee):
+    "Return the IEEE address `ieee`, an integer, in the usual form."
+    return mtapi.field_parse_colon_sep(ieee.to_bytes(8, "little"))
+
+
+def parse_ieee(token):
+    """Return the IEEE address written as `token`, either as eight hex
+    bytes, colon-separated or run together, or as a number such as
+    0x00124b0001020304.  The bytes are tried first, so sixteen digits
+    are always taken as hex even if none of them are a to f.  Raises a
+    ValueError if it is neither."""
+    try:
+        data = mtapi.parse_hex_bytes(token)
+    except ParseError:
+        data = b''
+    if len(data) == 8:
+        return int.from_bytes(data, "big")
+    try:
+        value = int(token, 0)
+    except ValueError:
+        value = None
+    if value is None or not 0 <= value < 1 << 64:
+        raise ValueError("'%s' is not an IEEE address" % token)
+    return value
+
+
+class AddressCache:
+    """A bounded two-way map between the network and IEEE addresses of
+    devices, filled in from the replies and announcements that pass
+    through an MTAPI receiver.  Looking an address up in either
+    direction takes constant time and makes it the most recently used;
+    once the cache is full, the least recently used pair is forgotten
+    to make room for a new one."""
+    def __init__(self, size=ADDRESS_CACHE_SIZE):
+        self.size = size
+        self.by_ieee = OrderedDict()
+        self.by_nwk = {}
+        self.lookup = None
+
+    def attach(self, receiver):
+        """Start learning addresses from the packets received by the
+        MTAPI receiver `receiver`, and annotate the addresses it
+        displays with what is known."""
+        for key in list(ANNOUNCEMENTS) + list(LOOKUPS):
+            receiver.events.subscribe(self.handler, *key)
+        receiver.resolvers[mtapi.field_parse_nwk_addr] = self.describe_nwk
+        receiver.resolvers[mtapi.field_parse_ieee_addr] = \
+            self.describe_ieee
+
+    def detach(self, receiver):
+        "Stop learning from `receiver` and annotating addresses."
+        receiver.events.unsubscribe(self.handler)
+        receiver.resolvers.pop(mtapi.field_parse_nwk_addr, None)
+        receiver.resolvers.pop(mtapi.field_parse_ieee_addr, None)
+
+    def __len__(self):
+        return len(self.by_ieee)
+
+    def learn(self, nwk, ieee):
+        """Record that the device with IEEE address `ieee` has the
+        network address `nwk`, replacing anything known before about
+        either address."""
+        if nwk >= NWK_ADDR_INVALID:
+            return
+        old_nwk = self.by_ieee.pop(ieee, None)
+        if old_nwk is not None:
+            del self.by_nwk[old_nwk]
+        old_ieee = self.by_nwk.pop(nwk, None)
+        if old_ieee is not None:
+            del self.by_ieee[old_ieee]
+        self.by_ieee[ieee] = nwk
+        self.by_nwk[nwk] = ieee
+        while len(self.by_ieee) > self.size:
+            _, evicted = self.by_ieee.popitem(last=False)
+            del self.by_nwk[evicted]
+
+    def nwk_of(self, ieee):
+        "Return the network address of `ieee`, or None if not known."
+        nwk = self.by_ieee.get(ieee)
+        if nwk is not None:
+            self.by_ieee.move_to_end(ieee)
+        return nwk
+
+    def ieee_of(self, nwk):
+        "Return the IEEE address of `nwk`, or None if not known."
+        ieee = self.by_nwk.get(nwk)
+        if ieee is not None:
+            self.by_ieee.move_to_end(ieee)
+        return ieee
+
+    def describe_nwk(self, nwk):
+        "Return the IEEE address of `nwk` as text, or None."
+        ieee = self.by_nwk.get(nwk)
+        return None if ieee is None else format_ieee(ieee)
+
+    def describe_ieee(self, ieee):
+        "Return the network address of `ieee` as text, or None."
+        nwk = self.by_ieee.get(ieee)
+        return None if nwk is None else "%04x" % nwk
+
+    def sent(self, frame):
+        """Note the frame just sent to the device, so that the reply to
+        an address manager lookup can be matched with its question."""
+        key = (str(mtapi.MTAPIType(frame[2])),
+               str(mtapi.MTAPISubsystem(frame[2])), frame[3])
+        if key in (EXT_ADDR_LOOKUP, NWK_ADDR_LOOKUP):
+            self.lookup = (key, frame[4:-1])
+        else:
+            self.lookup = None
+
+    def handler(self, key, record):
+        "Learn from a packet received that pairs up two addresses."
+        if key in ANNOUNCEMENTS:
+            if record.get("Status", 0) != 0:
+                return
+            nwk_name, ieee_name = ANNOUNCEMENTS[key]
+            self.learn(record[nwk_name], record[ieee_name])
+        elif self.lookup is not None:
+            request, question = self.lookup
+            self.lookup = None
+            if LOOKUPS[key] != request:
+                return
+            if request == EXT_ADDR_LOOKUP:
+                if len(question) == 8:
+                    self.learn(record["NwkAddr"],
+                               int.from_bytes(question, "little"))
+            elif len(question) == 2:
+                ieee = record["ExtAddr"]
+                if ieee not in (0, (1 << 64) - 1):
+                    self.learn(int.from_bytes(question, "little"), ieee)
+
+
+class AddressResolver:
+    """Finds the other address of a device, asking as little of the
+    network as possible.  The cache is tried first; then the address
+    manager on the local device, which needs no radio traffic; and
+    only then is the device itself asked over the air with a ZDO
+    request.  Whatever is found is added to the cache."""
+    def __init__(self, sock, receiver, cache,
+                 network_timeout=NETWORK_TIMEOUT):
+        """Create a resolver writing to the serial comms socket `sock`,
+        reading replies through the MTAPI receiver `receiver` and
+        remembering the answers in the AddressCache `cache`."""
+        self.sock = sock
+        self.receiver = receiver
+        self.cache = cache
+        self.network_timeout = network_timeout
+
+    def ask(self, frame, reply=None, match=None, timeout=None):
+        """Send `frame` and wait for the request to complete as for a
+        pipeline.Request.  Returns the decoded reply, or None."""
+        result = []
+        def received(request, record):
+            result.append(record)
+        if timeout is None:
+            requests = pipeline.Pipeline(self.sock, self.receiver)
+        else:
+            requests = pipeline.Pipeline(self.sock, self.receiver,
+                                         timeout=timeout, retries=0)
+        requests.submit(pipeline.Request(frame, reply, match, received))
+        requests.run()
+        return result[0] if result else None
+
+    def nwk_of(self, ieee):
+        """Return the network address of the device `ieee` and where it
+        was found ("cache", "device" or "network"), or (None, None)."""
+        nwk = self.cache.nwk_of(ieee)
+        if nwk is not None:
+            return nwk, "cache"
+        template = FrameTemplate("UTIL", "SREQ",
+                                 "UTIL_ADDRMGR_EXT_ADDR_LOOKUP",
+                                 ["util_addrmgr_ext_addr_lookup", "{}"])
+        record = self.ask(template.frame(ExtAddr=ieee))
+        if record is not None and record["NwkAddr"] < NWK_ADDR_INVALID:
+            self.cache.learn(record["NwkAddr"], ieee)
+            return record["NwkAddr"], "device"
+        template = FrameTemplate("ZDO", "SREQ", "ZDO_NWK_ADDR_REQ",
+                                 ["zdo_nwk_addr_req", "{}", "0", "0"])
+        record = self.ask(template.frame(IEEEAddr=ieee), NWK_ADDR_RSP,
+                          lambda record: record["IEEEAddr"] == ieee,
+                          self.network_timeout)
+        if record is not None and record["Status"] == 0:
+            self.cache.learn(record["NwkAddr"], ieee)
+            return record["NwkAddr"], "network"
+        return None, None
+
+    def ieee_of(self, nwk):
+        """Return the IEEE address of the device `nwk` and where it was
+        found ("cache", "device" or "network"), or (None, None)."""
+        ieee = self.cache.ieee_of(nwk)
+        if ieee is not None:
+            return ieee, "cache"
+        template = FrameTemplate("UTIL", "SREQ",
+                                 "UTIL_ADDRMGR_NWK_ADDR_LOOKUP",
+                                 ["util_addrmgr_nwk_addr_lookup", "{}"])
+        record = self.ask(template.frame(NwkAddr=nwk))
+        if record is not None and \
+           record["ExtAddr"] not in (0, (1 << 64) - 1):
+            self.cache.learn(nwk, record["ExtAddr"])
+            return record["ExtAddr"], "device"
+        template = FrameTemplate("ZDO", "SREQ", "ZDO_IEEE_ADDR_REQ",
+                                 ["zdo_ieee_addr_req", "{}", "0", "0"])
+        record = self.ask(template.frame(ShortAddr=nwk), IEEE_ADDR_RSP,
+                          lambda record: record["NwkAddr"] == nwk,
+                          self.network_timeout)
+        if record is not None and record["Status"] == 0:
+            self.cache.learn(nwk, record["IEEEAddr"])
+            return record["IEEEAddr"], "network"
+        return None, None
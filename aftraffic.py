@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+
+# aftraffic.py
+#
+# Generating AF data traffic to measure the mesh's throughput
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import time
+from collections import Counter
+from mtapi import field_parse_status
+from template import FrameTemplate
+import pipeline
+import stats
+
+
+# The largest payloads AF_DATA_REQUEST and AF_DATA_REQUEST_EXT carry
+# in a single frame
+AF_DATA_MAX = 128
+AF_DATA_EXT_MAX = 230
+
+# Data requests outstanding at once.  Z-Stack only has room for a few
+# frames waiting for their APS acknowledgements.
+AF_TRAFFIC_WINDOW = 4
+
+# Seconds to wait for each AF_DATA_CONFIRM.  With an APS acknowledgement
+# requested the device may try several times before giving up.
+AF_CONFIRM_TIMEOUT = 10.0
+
+# Request an end-to-end (APS) acknowledgement, so that a confirmation
+# means the data was delivered
+AF_ACK_REQUEST = 0x10
+AF_DEFAULT_RADIUS = 30
+
+# Address mode for a 16-bit address in AF_DATA_REQUEST_EXT
+ADDR_MODE_16_BIT = 2
+
+AF_DATA_CONFIRM = ("AREQ", "AF", 0x80)
+
+
+def data_request(destination, endpoint, cluster, trans_id, data,
+                 slots=(), extended=False):
+    """Return a FrameTemplate for the request sending `data` from
+    `endpoint` to the same endpoint of the device with the network
+    address `destination`, with an APS acknowledgement requested.
+    AF_DATA_REQUEST is used if the data fits, unless `extended` is
+    True, and AF_DATA_REQUEST_EXT otherwise, which only carries the
+    data if that fits, the rest being stored in the device separately.
+    The fields named in `slots` are made slots; the destination can
+    only be one in an AF_DATA_REQUEST."""
+    record = dict(DstAddr=destination, DstEndpoint=endpoint,
+                  SrcEndpoint=endpoint, ClusterId=cluster,
+                  TransId=trans_id, Options=AF_ACK_REQUEST,
+                  Radius=AF_DEFAULT_RADIUS, Data=data)
+    if len(data) <= AF_DATA_MAX and not extended:
+        return FrameTemplate.from_record("AF", "SREQ", "AF_DATA_REQUEST",
+                                         record, slots)
+    record["DstAddrMode"] = ADDR_MODE_16_BIT
+    return FrameTemplate.from_record("AF", "SREQ", "AF_DATA_REQUEST_EXT",
+                                     record, slots)
+
+
+class AfTraffic:
+    """Sends `size` byte payloads to the devices with the network
+    addresses `destinations` in turn, and measures how they are
+    delivered.  Payloads that fit use AF_DATA_REQUEST and larger ones
+    AF_DATA_REQUEST_EXT.  Frames are sent at `rate` frames per second,
+    or as fast as the device confirms them if `rate` is None, with no
+    more than `window` waiting for their AF_DATA_CONFIRM at once.
+    Confirmations are matched to frames by their TransId.
+
+    The source endpoint must have been registered with AF_REGISTER."""
+    def __init__(self, sock, mtapi, destinations, size, rate=None,
+                 window=AF_TRAFFIC_WINDOW, endpoint=1, cluster=0,
+                 timeout=AF_CONFIRM_TIMEOUT):
+        """Create a traffic generator writing to the serial comms
+        socket `sock` and reading replies through the MTAPI receiver
+        `mtapi`.  Raises a ValueError if the parameters are out of
+        range."""
+        if not destinations:
+            raise ValueError("No destinations given")
+        if not 0 < size <= AF_DATA_EXT_MAX:
+            raise ValueError("Payload size must be from 1 to %d bytes" %
+                             AF_DATA_EXT_MAX)
+        if rate is not None and rate <= 0:
+            raise ValueError("Rate must be positive")
+        if not 0 < window < 256:
+            raise ValueError("Window must be from 1 to 255")
+        self.pipeline = pipeline.Pipeline(sock, mtapi, window=window,
+                                          timeout=timeout, retries=0,
+                                          rate=rate)
+        self.destinations = destinations
+        self.size = size
+        # One random payload is sent throughout, the templates for each
+        # destination only needing their TransId changed
+        self.payload = os.urandom(size)
+        self.templates = {}
+        self.endpoint = endpoint
+        self.cluster = cluster
+        self.trans_id = 0
+        self.confirmed = 0
+        self.statuses = Counter()
+        self.lost = 0
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def frame(self, destination, trans_id):
+        "Return the data request for one payload."
+        template = self.templates.get(destination)
+        if template is None:
+            template = self.templates[destination] = data_request(
+                destination, self.endpoint, self.cluster, 0,
+                self.payload, ("TransId",))
+        return template.frame(TransId=trans_id)
+
+    def submit(self, destination):
+        "Queue a payload for `destination`."
+        trans_id = self.trans_id
+        self.trans_id = (self.trans_id + 1) & 0xff
+        def match(record):
+            return record["TransId"] == trans_id
+        self.pipeline.submit(pipeline.Request(self.frame(destination,
+                                                         trans_id),
+                                              AF_DATA_CONFIRM, match,
+                                              self.received))
+
+    def received(self, request, record):
+        "Count the confirmation, or its absence, of a payload."
+        if record is None:
+            self.lost += 1
+            return
+        self.statuses[record["Status"]] += 1
+        if record["Status"] == 0:
+            self.confirmed += 1
+            self.latencies.append(time.monotonic() - request.sent_at)
+
+    def run(self, count):
+        "Send `count` payloads and wait for them all to be confirmed."
+        for i in range(count):
+            self.submit(self.destinations[i % len(self.destinations)])
+        start = time.monotonic()
+        self.pipeline.run()
+        self.elapsed = time.monotonic() - start
+
+    def throughput(self):
+        "Return the payload bytes per second delivered."
+        if self.elapsed <= 0:
+            return 0.0
+        return self.confirmed * self.size / self.elapsed
+
+    def report(self):
+        "Return the results as a list of lines of text."
+        sent = self.pipeline.sent
+        lines = ["Sent %d frames of %d bytes in %.2fs: %d delivered, "
+                 "%d failed, %d unconfirmed" %
+                 (sent, self.size, self.elapsed, self.confirmed,
+                  sum(self.statuses.values()) - self.confirmed,
+                  self.lost)]
+        for status, count in sorted(self.statuses.items()):
+            if status != 0:
+                lines.append("  %s: %d" %
+                             (field_parse_status(bytes((status,))),
+                              count))
+        summary = stats.summarise(self.latencies)
+        if summary:
+            lines.append("Confirm latency (ms): " +
+                         ", ".join("%s %.1f" % (name, 1000 * value)
+                                   for name, value in summary))
+        lines.append("Throughput: %.0f payload bytes/s delivered, "
+                     "%.1f frames/s" %
+                     (self.throughput(),
+                      self.confirmed / self.elapsed
+                      if self.elapsed > 0 else 0.0))
+        return lines
@@ -0,0 +1,197 @@
+#! /usr/bin/env python3
+
+# api.py
+#
+# A Python interface for automating the console from inside it
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sys
+import traceback
+from mtapi import ParseError, ParseField, ParseVariable
+from mtcmds import MTBuffer, MT_COMMANDS, MT_REQUESTS
+from tokenizer import tokenize
+
+
+# Seconds to wait for a response by default
+RESPONSE_TIMEOUT = 2.0
+
+
+def find_key(name, type_name="AREQ"):
+    """Return the (type, subsystem, command) key of the command called
+    `name` sent as `type_name`.  Raises an mtapi.ParseError if there is
+    no such command."""
+    name = name.upper()
+    for (table_type, subsystem_name), table in MT_COMMANDS.items():
+        if table_type != type_name:
+            continue
+        for cmd, command in table.items():
+            if command.name == name:
+                return (type_name, subsystem_name, cmd)
+    raise ParseError("Unable to find %s command %s" % (type_name, name))
+
+
+def build(name, **fields):
+    """Return the MTBuffer for the request called `name`, with the
+    values of its fields given as keyword arguments named after them.
+    Values may be integers, bytes (for fields holding byte strings) or
+    strings written as they would be typed at the console.  Raises an
+    mtapi.ParseError if a field is missing, unknown or out of range, or
+    cannot be given a value this way."""
+    name = name.upper()
+    if name not in MT_REQUESTS:
+        raise ParseError("Unable to find command " + name)
+    subsystem_name, type_name = MT_REQUESTS[name]
+    buf = MTBuffer(subsystem_name, type_name, name)
+    for field in buf.cmd.fields:
+        if isinstance(field, ParseVariable):
+            field_name = field.data_name
+        elif isinstance(field, ParseField):
+            field_name = field.name
+        else:
+            raise ParseError("Field %s of %s cannot be given a value" %
+                             (field.name, name))
+        if field_name not in fields:
+            raise ParseError("Missing field %s of %s" % (field_name, name))
+        value = fields.pop(field_name)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            if isinstance(field, ParseVariable):
+                value = bytes(value).hex()
+            elif len(value) != field.length:
+                raise ParseError("Field %s must be %d bytes long" %
+                                 (field_name, field.length))
+            else:
+                buf.extend(value)
+                continue
+        if isinstance(value, int) and isinstance(field, ParseField):
+            if not 0 <= value < 1 << (8 * field.length):
+                raise ParseError("Value %d out of range for field %s" %
+                                 (value, field_name))
+            buf.extend(value.to_bytes(field.length, "little"))
+            continue
+        if not isinstance(value, str) or not field.parse_token(value, buf):
+            raise ParseError("%r not recognised in field %s" %
+                             (value, field_name))
+    if fields:
+        raise ParseError("Unknown fields for %s: %s" %
+                         (name, ", ".join(sorted(fields))))
+    return buf
+
+
+class ScriptAPI:
+    """The interface Python scripts run by the console use to drive the
+    device.  Requests are built straight from the command definitions
+    and replies are handed back decoded, so scripts neither type
+    commands nor read the console's output.  Calls that wait for
+    something keep processing packets from the device meanwhile, so
+    listeners, event handlers and the display carry on as usual."""
+    def __init__(self, ui):
+        """Create the interface for scripts run by the UIHandler `ui`,
+        which must have an MTAPI receiver."""
+        self.ui = ui
+        self.mtapi = ui.mtapi
+        self.guarded = {}
+
+    def send(self, name, timeout=RESPONSE_TIMEOUT, **fields):
+        """Send the request called `name` with the field values given,
+        as for build().  For an SREQ, the decoded SRSP is returned, or
+        None if it does not arrive within `timeout` seconds; for an
+        AREQ, None is returned at once."""
+        frame = build(name, **fields).frame()
+        if MT_REQUESTS[name.upper()][1] != "SREQ":
+            self.ui.send(frame)
+            return None
+        key = find_key(name, "SRSP")
+        return self.wait_for(key, timeout, send=frame)
+
+    def wait_for(self, event, timeout=RESPONSE_TIMEOUT, match=None,
+                 send=None):
+        """Wait for the next packet that is the AREQ named `event`, or
+        that has the (type, subsystem, command) key `event`, and for
+        which `match` (if given) returns True when called with the
+        decoded packet.  If `send` is given, that frame is sent once
+        the wait has begun.  Returns the decoded packet, or None if
+        none arrives within `timeout` seconds."""
+        key = find_key(event) if isinstance(event, str) else event
+        result = []
+        def handler(key, record):
+            if not result and (match is None or match(record)):
+                result.append(record)
+        self.mtapi.events.subscribe(handler, *key)
+        try:
+            if send is not None:
+                self.ui.send(send)
+            self.mtapi.run_until(lambda: bool(result), timeout)
+        finally:
+            self.mtapi.events.unsubscribe(handler)
+        return result[0] if result else None
+
+    def on(self, event, handler, type_name="AREQ"):
+        """Call `handler` with the key and decoded contents of every
+        `type_name` packet whose command name matches `event`, which may
+        be a pattern such as "ZDO_*_IND", until off() is called or the
+        script finishes.  A handler that returns True stops the packet
+        being displayed.
+
+        The handler is called from deep inside the receiver, so an
+        exception it raises would stop the console.  Instead, the
+        traceback is displayed and the handler is called no more."""
+        guarded = self.guarded.get(handler)
+        if guarded is None:
+            def guarded(key, record):
+                if handler not in self.guarded:
+                    # Dropped while this packet was being passed round
+                    return False
+                try:
+                    return handler(key, record)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+                    self.off(handler)
+                    return False
+            self.guarded[handler] = guarded
+        self.mtapi.events.subscribe(guarded, type_name, None, event)
+
+    def off(self, handler):
+        "Stop calling `handler` for packets."
+        guarded = self.guarded.pop(handler, None)
+        if guarded is not None:
+            self.mtapi.events.unsubscribe(guarded)
+
+    def close(self):
+        """Stop calling every handler registered with on(), once the
+        script has finished and can no longer call off() itself."""
+        for handler in list(self.guarded):
+            self.off(handler)
+
+    def sleep(self, seconds):
+        "Process packets from the device for `seconds` seconds."
+        self.mtapi.run_until(lambda: False, seconds)
+
+    def command(self, line):
+        """Run `line` as if it had been typed at the console.  Returns
+        False if the command asks the console to exit."""
+        return self.ui.execute(tokenize(line))
+
+    @property
+    def device(self):
+        "The devstate.DeviceState following the device, or None."
+        return self.ui.device
+
+    @property
+    def frames(self):
+        """The framestore.FrameStore keeping the packets received since
+        "capture on", or None."""
+        return self.ui.frame_store
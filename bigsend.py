@@ -0,0 +1,294 @@
+#! /usr/bin/env python3
+
+# bigsend.py
+#
+# Sending and receiving AF messages too big for a single frame
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+from collections import deque
+from mtapi import ParseError
+from mtcmds import MT_COMMANDS
+from aftraffic import (AF_DATA_EXT_MAX, AF_CONFIRM_TIMEOUT, AF_DATA_CONFIRM,
+                       data_request)
+from template import FrameTemplate
+import pipeline
+
+
+# The largest message the device will stage, given the two-byte
+# Index and Len fields
+BIGSEND_MAX = 0xffff
+
+# The most data one AF_DATA_STORE request or AF_DATA_RETRIEVE response
+# carries, being what fits in a frame after the other fields
+STORE_MAX = 247
+RETRIEVE_MAX = 248
+
+# Seconds to wait for each AF_DATA_RETRIEVE response
+RETRIEVE_TIMEOUT = 1.0
+
+INCOMING_MSG_EXT = ("AREQ", "AF", 0x82)
+RETRIEVE_SRSP = ("SRSP", "AF", 0x12)
+
+
+class BigSend:
+    """Sends `data` in a single AF message from `endpoint` to the same
+    endpoint of the device with the network address `destination`.
+    Data that fits goes in the AF_DATA_REQUEST_EXT itself.  Otherwise
+    the request only announces the length, which makes the device set
+    aside a buffer for the message; the data is then written into the
+    buffer in AF_DATA_STORE segments, and a final empty AF_DATA_STORE
+    sends the message.  The segments follow each other as fast as the
+    device answers them.
+
+    If a segment fails, the transfer stops and fails, but the buffer
+    must still be given back: Z-Stack only frees it when the empty
+    AF_DATA_STORE sends the message, and until then refuses to stage
+    another.  So the empty AF_DATA_STORE is sent anyway, sending
+    whatever had been stored, and `released` is set.
+
+    The source endpoint must have been registered with AF_REGISTER."""
+    def __init__(self, sock, mtapi, destination, data, endpoint=1,
+                 cluster=0, trans_id=0, timeout=AF_CONFIRM_TIMEOUT):
+        """Create a transfer writing to the serial comms socket `sock`
+        and reading replies through the MTAPI receiver `mtapi`.  Raises
+        a ValueError if there is too much data."""
+        if len(data) > BIGSEND_MAX:
+            raise ValueError("Cannot send more than %d bytes" %
+                             BIGSEND_MAX)
+        self.pipeline = pipeline.Pipeline(sock, mtapi, window=1,
+                                          timeout=timeout)
+        self.destination = destination
+        self.data = memoryview(data)
+        self.endpoint = endpoint
+        self.cluster = cluster
+        self.trans_id = trans_id
+        # The bytes the device has taken, and those sent to it so far
+        self.stored = 0
+        self.queued = 0
+        self.segments = 0
+        self.status = None
+        self.elapsed = 0.0
+        # True while the device holds a buffer for the message that
+        # only the final AF_DATA_STORE will free
+        self.staged = False
+        self.released = False
+
+    def request_frame(self):
+        """Return the AF_DATA_REQUEST_EXT frame, carrying the data only
+        if it fits."""
+        return data_request(self.destination, self.endpoint,
+                            self.cluster, self.trans_id, self.data,
+                            extended=True).frame()
+
+    def store_frame(self, index, length):
+        """Return the AF_DATA_STORE frame for the `length` bytes of data
+        from `index`; an empty one sends the message."""
+        return FrameTemplate.from_record(
+            "AF", "SREQ", "AF_DATA_STORE",
+            dict(Index=index, Data=self.data[index:index+length])).frame()
+
+    def run(self):
+        """Send the message and wait for its AF_DATA_CONFIRM.  Returns
+        the confirmation's Status, or None if the device did not take
+        the message or never confirmed it."""
+        self.stored = 0
+        self.queued = 0
+        self.status = None
+        self.staged = False
+        self.released = False
+        if len(self.data) <= AF_DATA_EXT_MAX:
+            self.submit(self.request_frame(), confirm=True)
+        else:
+            self.submit(self.request_frame())
+        start = time.monotonic()
+        self.pipeline.run()
+        self.elapsed = time.monotonic() - start
+        return self.status
+
+    def submit(self, frame, confirm=False):
+        """Queue `frame`, waiting for the AF_DATA_CONFIRM of the message
+        if `confirm` is True or just its SRSP otherwise."""
+        if not confirm:
+            self.pipeline.submit(pipeline.Request(frame,
+                                                  callback=self.received))
+            return
+        trans_id = self.trans_id
+        def match(record):
+            return record["TransId"] == trans_id
+        self.pipeline.submit(pipeline.Request(frame, AF_DATA_CONFIRM,
+                                              match, self.received))
+
+    def received(self, request, record):
+        """Queue the next segment once the device has taken the previous
+        one, or record the outcome of the message."""
+        if record is None:
+            if self.staged:
+                self.release()
+            return
+        if request.reply == AF_DATA_CONFIRM:
+            self.status = record["Status"]
+            return
+        # The request or a segment has been taken, so the device has a
+        # buffer for the message
+        self.staged = True
+        self.stored = self.queued
+        if self.stored == len(self.data):
+            # Sending the message frees the buffer, or if it fails
+            # there is no other way to
+            self.staged = False
+            self.submit(self.store_frame(self.stored, 0), confirm=True)
+            return
+        length = min(len(self.data) - self.stored, STORE_MAX)
+        self.segments += 1
+        self.submit(self.store_frame(self.stored, length))
+        self.queued += length
+
+    def release(self):
+        """Free the device's buffer for a message whose data could not
+        all be stored, which can only be done by sending it."""
+        self.staged = False
+        self.released = True
+        self.pipeline.submit(pipeline.Request(
+            self.store_frame(self.queued, 0)))
+
+
+class Message:
+    "An incoming message being retrieved from the device."
+    def __init__(self, record):
+        self.record = record
+        self.data = bytearray(record["Length"])
+        self.view = memoryview(self.data)
+        self.failed = False
+
+
+class Reassembler:
+    """Fetches the data of AF_INCOMING_MSG_EXT messages too long to be
+    included in the frame, which the device keeps until told to free
+    it.  The data is read with AF_DATA_RETRIEVE requests, each response
+    being copied straight into a buffer allocated for the whole message
+    when it arrived, and then the message is freed with an empty
+    retrieve.  `handler` is called with the decoded AF_INCOMING_MSG_EXT
+    record and the data of every message, whether it needed retrieving
+    or not; a message whose retrieval failed is dropped.
+
+    Like the statistics poller, the reassembler does not block:
+    `tick()` must be called whenever `wait_time()` says there is work
+    to do.  The responses to the retrieves are not displayed."""
+    def __init__(self, sock, mtapi, handler, timeout=RETRIEVE_TIMEOUT):
+        """Create a reassembler sending requests to the serial comms
+        socket `sock` and reading packets through the MTAPI receiver
+        `mtapi`."""
+        self.sock = sock
+        self.mtapi = mtapi
+        self.handler = handler
+        self.timeout = timeout
+        self.template = FrameTemplate(
+            "AF", "SREQ", "AF_DATA_RETRIEVE",
+            ["af_data_retrieve", "{}", "{}", "{}"])
+        self.queue = deque()
+        self.current = None
+        self.deadline = None
+        self.received = 0
+        self.retrieved = 0
+        self.failed = 0
+
+    def start(self):
+        "Start watching for messages."
+        self.mtapi.add_listener(self.listener)
+
+    def stop(self):
+        """Stop watching for messages.  Any that have not been retrieved
+        are left on the device."""
+        self.mtapi.remove_listener(self.listener)
+        self.queue.clear()
+        self.current = None
+
+    def listener(self, type_name, subsystem_name, cmd, data):
+        """Pass on complete messages, queue the retrieval of those whose
+        data was left out, and take in the data retrieved."""
+        key = (type_name, subsystem_name, cmd)
+        if key == INCOMING_MSG_EXT:
+            try:
+                record = MT_COMMANDS[key[:2]][cmd].decode(data)
+            except ParseError:
+                return False
+            if record["Data"] is not None:
+                self.received += 1
+                self.handler(record, record["Data"])
+                return False
+            message = Message(record)
+            for index in range(0, len(message.data), RETRIEVE_MAX):
+                self.queue.append(
+                    (message, index,
+                     min(len(message.data) - index, RETRIEVE_MAX)))
+            # An empty retrieve frees the message
+            self.queue.append((message, len(message.data), 0))
+            return False
+        if key != RETRIEVE_SRSP or self.current is None:
+            return False
+        message, index, length = self.current
+        self.current = None
+        if length == 0:
+            if not message.failed:
+                self.received += 1
+                self.retrieved += 1
+                self.handler(message.record, message.data)
+        elif len(data) < 2 or data[0] != 0 or data[1] != length or \
+             len(data) < length + 2:
+            self.abandon(message)
+        else:
+            message.view[index:index+length] = \
+                memoryview(data)[2:length+2]
+        return True
+
+    def abandon(self, message):
+        """Give up on `message`, only leaving the request that frees it
+        in the queue."""
+        message.failed = True
+        self.failed += 1
+        self.queue = deque(item for item in self.queue
+                           if item[0] is not message or item[2] == 0)
+
+    def wait_time(self):
+        """Return the seconds until `tick()` next has anything to do, or
+        None if there is nothing to retrieve."""
+        if self.current is not None:
+            return max(self.deadline - time.monotonic(), 0)
+        if self.queue:
+            return 0
+        return None
+
+    def tick(self):
+        """Give up on a request that has not been answered in time, and
+        send the next request if none is outstanding."""
+        now = time.monotonic()
+        if self.current is not None:
+            if self.deadline > now:
+                return
+            message, _, length = self.current
+            self.current = None
+            if length != 0:
+                self.abandon(message)
+        if not self.queue:
+            return
+        self.current = self.queue.popleft()
+        message, index, length = self.current
+        self.deadline = now + self.timeout
+        self.sock.write(self.template.frame(
+            Timestamp=message.record["Timestamp"], Index=index,
+            Length=length))
@@ -0,0 +1,196 @@
+#! /usr/bin/env python3
+
+# crawl.py
+#
+# Mapping the network by walking the neighbour tables of its routers
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+from mtapi import field_parse_colon_sep
+from template import FrameTemplate
+import pipeline
+
+
+# Names of the values of the neighbour table bitfields
+DEVICE_TYPES = ("Coordinator", "Router", "End Device", "Unknown")
+RX_ON_WHEN_IDLE = ("Off", "On", "Unknown")
+RELATIONSHIPS = ("Parent", "Child", "Sibling", "None", "Previous Child")
+
+
+def lookup_name(names, value):
+    "Return the name for `value` from the tuple `names`, if it has one."
+    if value < len(names):
+        return names[value]
+    return "Reserved(%d)" % value
+
+
+def format_ieee(address):
+    "Format the integer IEEE `address` in the usual colon-separated way."
+    return field_parse_colon_sep(address.to_bytes(8, "little"))
+
+
+def format_nwk(address):
+    """Format the network `address` of a node whose IEEE address is not
+    known, in a way that cannot be mistaken for an IEEE address."""
+    return "nwk:%04x" % address
+
+
+class Crawler:
+    """Breadth first walk of a network, reading the neighbour table of
+    each router with ZDO_MGMT_LQI_REQ.  Requests for many routers are
+    kept in flight at once through a Pipeline, and neighbour tables too
+    long for one response are read a page at a time from the StartIndex
+    of the next entry.  Nodes are identified by IEEE address, so a
+    router is only read once however many of its neighbours list it.
+    End devices have no neighbour tables of interest and are not read.
+    """
+    def __init__(self, sock, mtapi, window=pipeline.DEFAULT_WINDOW,
+                 timeout=pipeline.DEFAULT_TIMEOUT,
+                 retries=pipeline.DEFAULT_RETRIES):
+        """Create a crawler that sends requests to the serial comms
+        socket `sock` and reads the replies through the MTAPI receiver
+        `mtapi`, with up to `window` requests in flight."""
+        self.pipeline = pipeline.Pipeline(sock, mtapi, window,
+                                          timeout, retries)
+        self.template = FrameTemplate("ZDO", "SREQ", "ZDO_MGMT_LQI_REQ",
+                                      ["zdo_mgmt_lqi_req", "{}", "{}"])
+        self.reply = pipeline.command_key("AREQ", "ZDO",
+                                          "ZDO_MGMT_LQI_RSP")
+        self.nodes = {}
+        self.addresses = {}
+        self.links = []
+        self.queried = set()
+        self.read = set()
+        self.unreachable = set()
+
+    def crawl(self, root=0x0000):
+        """Walk the network outwards from the node with network address
+        `root`, by default the coordinator.  Returns when every router
+        found has been read or given up on."""
+        self.visit(root)
+        self.pipeline.run()
+
+    def visit(self, nwk, ieee=None):
+        """Read the neighbour table of the router at network address
+        `nwk`, unless it (or the node with IEEE address `ieee`) has
+        already been read."""
+        if nwk in self.queried or ieee in self.read:
+            return
+        self.queried.add(nwk)
+        if ieee is not None:
+            self.read.add(ieee)
+        self.request(nwk, 0)
+
+    def request(self, nwk, start):
+        """Queue the request for the page of the neighbour table of
+        `nwk` starting at entry `start`."""
+        def match(record):
+            return (record["SrcAddr"] == nwk and
+                    (record["Status"] != 0 or record["StartIndex"] == start))
+        def received(request, record):
+            self.received(nwk, record)
+        frame = self.template.frame(DstAddr=nwk, StartIndex=start)
+        self.pipeline.submit(pipeline.Request(frame, self.reply,
+                                              match, received))
+
+    def received(self, nwk, record):
+        """Record a page of the neighbour table of `nwk`, queueing
+        requests for the next page and for any new routers in it.
+        `record` is the decoded ZDO_MGMT_LQI_RSP, or None if there was
+        no reply."""
+        if record is None or record["Status"] != 0:
+            self.unreachable.add(nwk)
+            return
+        entries = record["NeighbourLqiList"]
+        for entry in entries:
+            ieee = entry["ExtAddr"]
+            address = entry["NwkAddr"]
+            self.nodes[ieee] = {
+                "ieee": format_ieee(ieee),
+                "nwk": "0x%04x" % address,
+                "device_type": lookup_name(DEVICE_TYPES,
+                                           entry["DeviceType"]),
+                "rx_on_when_idle": lookup_name(RX_ON_WHEN_IDLE,
+                                               entry["RxOnWhenIdle"]),
+                "depth": entry["Depth"] }
+            self.addresses[address] = ieee
+            self.links.append((nwk, ieee, entry["LQI"],
+                               lookup_name(RELATIONSHIPS,
+                                           entry["Relationship"])))
+            if address in self.queried:
+                self.read.add(ieee)
+            elif entry["DeviceType"] in (0, 1):
+                self.visit(address, ieee)
+        next_start = record["StartIndex"] + len(entries)
+        if entries and next_start < record["NeighbourTableEntries"]:
+            self.request(nwk, next_start)
+
+    def node_id(self, nwk):
+        """Return the identifier used in the output for the node with
+        network address `nwk`: its IEEE address if known."""
+        if nwk in self.addresses:
+            return format_ieee(self.addresses[nwk])
+        return format_nwk(nwk)
+
+    def graph(self):
+        """Return the neighbour graph as a dictionary of "nodes" and
+        "links" lists, suitable for writing out as JSON."""
+        nodes = []
+        for ieee, node in self.nodes.items():
+            node = dict(node)
+            node["id"] = node["ieee"]
+            node["reachable"] = int(node["nwk"], 16) not in self.unreachable
+            nodes.append(node)
+        # Nodes that were read but never listed by a neighbour
+        for nwk in sorted(self.queried):
+            if nwk not in self.addresses:
+                nodes.append({ "id": format_nwk(nwk),
+                               "nwk": "0x%04x" % nwk,
+                               "reachable": nwk not in self.unreachable })
+        links = [{ "source": self.node_id(nwk),
+                   "target": format_ieee(ieee),
+                   "lqi": lqi,
+                   "relationship": relationship }
+                 for nwk, ieee, lqi, relationship in self.links]
+        return { "nodes": nodes, "links": links }
+
+    def dot(self):
+        "Return the neighbour graph in the Graphviz DOT language."
+        graph = self.graph()
+        lines = ["digraph network {"]
+        for node in graph["nodes"]:
+            label = node["nwk"]
+            if "device_type" in node:
+                label += "\\n" + node["device_type"]
+            style = "" if node["reachable"] else ", style=dashed"
+            lines.append('  "%s" [label="%s"%s];' %
+                         (node["id"], label, style))
+        for link in graph["links"]:
+            lines.append('  "%s" -> "%s" [label="%d"];' %
+                         (link["source"], link["target"], link["lqi"]))
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """Write the neighbour graph to the file `path`, in DOT if the
+        name ends ".dot" and as JSON otherwise."""
+        with open(path, "w") as output:
+            if path.endswith(".dot"):
+                output.write(self.dot())
+            else:
+                json.dump(self.graph(), output, indent=2)
+                output.write("\n")
@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+
+# debuglog.py
+#
+# Keeping a history of the device's DEBUG_MSG strings
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+from collections import deque
+
+
+# The most messages remembered by default
+DEBUG_LOG_SIZE = 1000
+
+# Messages displayed per second once the burst allowance is used up
+DEBUG_RATE = 10.0
+DEBUG_BURST = 20
+
+# The key of DEBUG_MSG packets
+DEBUG_MSG_KEY = ("AREQ", "DEBUG", 0x00)
+
+
+def message_text(raw):
+    """Return the DEBUG_MSG string `raw` as text.  Firmware often
+    includes the C string's terminating NUL, which is dropped."""
+    return raw.rstrip(b'\0').decode("utf-8", "backslashreplace")
+
+
+class LogEntry:
+    """A message in the log, with the times it was first and last
+    received and the number of times it was received in a row."""
+    __slots__ = ("first", "last", "raw", "count")
+
+    def __init__(self, when, raw):
+        self.first = when
+        self.last = when
+        self.raw = raw
+        self.count = 1
+
+    def __str__(self):
+        line = "%s.%03d %s" % (time.strftime("%H:%M:%S",
+                                             time.localtime(self.first)),
+                               int(self.first * 1000) % 1000,
+                               message_text(self.raw))
+        if self.count > 1:
+            line += " (x%d)" % self.count
+        return line
+
+
+class DebugLog:
+    """Collects the strings the device sends in DEBUG_MSG packets,
+    instead of letting them be displayed as hex bytes with the other
+    packets.  The most recent `size` messages are kept, a message that
+    is the same as the one before only adding to its repeat count.
+    Messages are held as the bytes received and only turned into text
+    when they are shown, so a chatty device costs little while nobody
+    is looking.
+
+    If `echo` is True, messages are also displayed as they arrive,
+    unless the receiver's display is off.  Repeats are not displayed,
+    just counted, and no more than `rate` messages a second (after an
+    initial `burst`) are displayed; the number skipped is reported
+    when display resumes."""
+    def __init__(self, size=DEBUG_LOG_SIZE, rate=DEBUG_RATE,
+                 burst=DEBUG_BURST, echo=True):
+        self.entries = deque(maxlen=size)
+        self.rate = rate
+        self.burst = burst
+        self.echo = echo
+        self.receiver = None
+        self.tokens = burst
+        self.refilled = time.monotonic()
+        self.suppressed = 0
+        self.received = 0
+
+    def attach(self, receiver):
+        "Start collecting the messages received by `receiver`."
+        self.receiver = receiver
+        receiver.events.subscribe(self.handler, *DEBUG_MSG_KEY)
+
+    def detach(self, receiver):
+        "Stop collecting messages from `receiver`."
+        receiver.events.unsubscribe(self.handler)
+        self.receiver = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        "Forget every message."
+        self.entries.clear()
+
+    def history(self, count=None):
+        "Return the last `count` entries, or all of them, oldest first."
+        if count is None or count >= len(self.entries):
+            return list(self.entries)
+        return list(self.entries)[len(self.entries)-count:]
+
+    def handler(self, key, record):
+        "Log a DEBUG_MSG packet, which is then not displayed as usual."
+        self.add(record["String"])
+        return True
+
+    def add(self, raw, when=None):
+        "Log the message `raw`, the bytes of the string received."
+        if when is None:
+            when = time.time()
+        self.received += 1
+        if self.entries and self.entries[-1].raw == raw:
+            entry = self.entries[-1]
+            entry.last = when
+            entry.count += 1
+            return
+        if self.entries and self.entries[-1].count > 1:
+            self.display("(last message repeated %d times)" %
+                         self.entries[-1].count, limited=False)
+        self.entries.append(LogEntry(when, raw))
+        if self.echoing():
+            self.display(message_text(raw))
+
+    def echoing(self):
+        "Return True if messages are to be displayed as they arrive."
+        return self.echo and (self.receiver is None or
+                              self.receiver.display != "none")
+
+    def allow(self):
+        """Return True if the rate limit allows another message to be
+        displayed now, using up its allowance."""
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.refilled) * self.rate,
+                          self.burst)
+        self.refilled = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def display(self, text, limited=True):
+        """Write `text` out as a debug message, subject to the rate limit
+        if `limited` is True."""
+        if not self.echoing():
+            return
+        if limited and not self.allow():
+            self.suppressed += 1
+            return
+        if self.suppressed:
+            print("DEBUG: (%d messages not shown)" % self.suppressed)
+            self.suppressed = 0
+        print("DEBUG:", text)
@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+
+# devstate.py
+#
+# Tracking the state of the attached device from what it reports
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+from mtapi import (field_parse_device_state, field_parse_reset_reason,
+                   field_parse_device_type)
+from addrcache import format_ieee
+
+
+# The names Z-Stack gives the device states (devStates_t)
+DEVICE_STATE_NAMES = {
+    "DEV_HOLD": 0x00,
+    "DEV_INIT": 0x01,
+    "DEV_NWK_DISC": 0x02,
+    "DEV_NWK_JOINING": 0x03,
+    "DEV_NWK_REJOIN": 0x04,
+    "DEV_END_DEVICE_UNAUTH": 0x05,
+    "DEV_END_DEVICE": 0x06,
+    "DEV_ROUTER": 0x07,
+    "DEV_COORD_STARTING": 0x08,
+    "DEV_ZB_COORD": 0x09,
+    "DEV_NWK_ORPHAN": 0x0a
+}
+
+# The packets the device's state is learnt from
+STATE_CHANGE_IND = ("AREQ", "ZDO", 0xc0)
+JOIN_CNF = ("AREQ", "ZDO", 0xc6)
+LEAVE_IND = ("AREQ", "ZDO", 0xc9)
+RESET_IND = ("AREQ", "SYS", 0x80)
+GET_DEVICE_INFO_RSP = ("SRSP", "UTIL", 0x00)
+UPDATES = (STATE_CHANGE_IND, JOIN_CNF, LEAVE_IND, RESET_IND,
+           GET_DEVICE_INFO_RSP)
+
+
+def parse_state(token):
+    """Return the device state given by `token`, either one of Z-Stack's
+    names such as "DEV_ZB_COORD" (with or without the "DEV_") or a
+    number.  Raises a ValueError if it is neither."""
+    name = token.upper()
+    if not name.startswith("DEV_"):
+        name = "DEV_" + name
+    if name in DEVICE_STATE_NAMES:
+        return DEVICE_STATE_NAMES[name]
+    try:
+        state = int(token, 0)
+    except ValueError:
+        raise ValueError("Unknown device state '%s'" % token) from None
+    if not 0 <= state <= 0xff:
+        raise ValueError("Device state %s out of range" % token)
+    return state
+
+
+def state_name(state):
+    "Return the device state `state` as text."
+    return field_parse_device_state(bytes((state,)))
+
+
+class DeviceState:
+    """A model of the attached device's state, kept up to date from the
+    indications and responses it sends rather than by asking it.  Each
+    piece of information is None until the device has reported it.
+    A reset forgets everything that depends on the device's network
+    state, since the device will report it again as it restarts."""
+    def __init__(self):
+        self.state = None
+        self.changed_at = None
+        self.ieee = None
+        self.nwk = None
+        self.device_type = None
+        self.parent = None
+        self.reset_reason = None
+        self.version = None
+        self.resets = 0
+        self.last_leave = None
+        self.updates = 0
+
+    def attach(self, receiver):
+        "Start following the packets received by `receiver`."
+        for key in UPDATES:
+            receiver.events.subscribe(self.handler, *key)
+
+    def detach(self, receiver):
+        "Stop following the packets received by `receiver`."
+        receiver.events.unsubscribe(self.handler)
+
+    def set_state(self, state):
+        "Record that the device has entered `state`."
+        if state != self.state:
+            self.state = state
+            self.changed_at = time.monotonic()
+
+    def handler(self, key, record):
+        """Update the model from a packet that describes the device.
+        The packets are still displayed as usual."""
+        self.updates += 1
+        if key == STATE_CHANGE_IND:
+            self.set_state(record["State"])
+        elif key == RESET_IND:
+            self.resets += 1
+            self.reset_reason = record["Reason"]
+            self.version = (record["TransportRev"], record["ProductId"],
+                            record["MajorRel"], record["MinorRel"],
+                            record["HwRev"])
+            self.state = None
+            self.changed_at = time.monotonic()
+            self.nwk = None
+            self.parent = None
+        elif key == GET_DEVICE_INFO_RSP:
+            if record["Status"] == 0:
+                self.ieee = record["IEEEAddr"]
+                self.nwk = record["ShortAddr"]
+                self.device_type = record["DeviceType"]
+                self.set_state(record["DeviceState"])
+        elif key == JOIN_CNF:
+            if record["Status"] == 0:
+                self.nwk = record["DeviceAddr"]
+                self.parent = record["ParentAddr"]
+        elif key == LEAVE_IND:
+            self.last_leave = (record["SrcAddr"], record["ExtAddr"],
+                               record["Rejoin"])
+            if record["ExtAddr"] == self.ieee or \
+               (self.ieee is None and record["SrcAddr"] == self.nwk):
+                self.nwk = None
+                self.parent = None
+        return False
+
+    def report(self):
+        "Return what is known about the device as a list of lines of text."
+        if self.updates == 0:
+            return ["Nothing heard from the device yet"]
+        lines = []
+        if self.state is None:
+            lines.append("State: unknown")
+        else:
+            lines.append("State: %s for %.1fs" %
+                         (state_name(self.state),
+                          time.monotonic() - self.changed_at))
+        if self.device_type is not None:
+            device_type = bytes((self.device_type,))
+            lines.append("Device type: " +
+                         field_parse_device_type(device_type))
+        if self.ieee is not None:
+            lines.append("IEEE address: " + format_ieee(self.ieee))
+        if self.nwk is not None:
+            lines.append("Network address: %04x" % self.nwk)
+        if self.parent is not None:
+            lines.append("Parent: %04x" % self.parent)
+        if self.reset_reason is not None:
+            lines.append("Resets: %d, last %s" %
+                         (self.resets, field_parse_reset_reason(
+                             bytes((self.reset_reason,)))))
+        if self.version is not None:
+            lines.append("Version: transport %d, product %d, "
+                         "release %d.%d, hardware %d" % self.version)
+        if self.last_leave is not None:
+            lines.append("Last leave: %04x (%s)%s" %
+                         (self.last_leave[0],
+                          format_ieee(self.last_leave[1]),
+                          ", rejoining" if self.last_leave[2] else ""))
+        return lines
+
+    def wait_for(self, receiver, state, timeout=None):
+        """Process packets from `receiver` until the device reports that
+        it is in `state`, for up to `timeout` seconds if that is not
+        None.  Returns True if the state was reached."""
+        return receiver.run_until(lambda: self.state == state, timeout)
@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+# events.py
+#
+# Publishing decoded MTAPI packets to the parts of the program that want them
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from fnmatch import fnmatchcase
+from collections import namedtuple
+from mtapi import ParseError
+
+
+# A handler's interest in packets.  Each of `type_name`,
+# `subsystem_name` and `command` is None to match anything; `command`
+# may also be a command number or a pattern for the command name in
+# the style of the fnmatch module, such as "ZDO_*_RSP".
+Subscription = namedtuple("Subscription",
+                          "handler, type_name, subsystem_name, command")
+
+
+class EventBus:
+    """Passes the packets received to the handlers that have asked for
+    them, decoded into dictionaries of field values.  Handlers are
+    called as `handler(key, record)`, where `key` is the (type,
+    subsystem, command) key of the packet as MTAPI listeners receive
+    it, and a handler that returns True has dealt with the packet so
+    that it is not displayed.
+
+    The handlers for every command in `commands` (a table laid out
+    like mtcmds.MT_COMMANDS) are worked out whenever a subscription is
+    made or dropped, so dispatching a packet takes a single lookup.
+    A packet nobody has subscribed to is not decoded at all, and one
+    that is wanted is decoded once however many handlers receive it.
+    """
+    def __init__(self, commands):
+        self.commands = commands
+        self.subscriptions = []
+        self.table = {}
+        self.errors = 0
+
+    def subscribe(self, handler, type_name=None, subsystem_name=None,
+                  command=None):
+        """Call `handler` with every packet matching the pattern given,
+        after any handlers already subscribed."""
+        self.subscriptions.append(Subscription(handler, type_name,
+                                               subsystem_name, command))
+        self.rebuild()
+
+    def unsubscribe(self, handler):
+        "Stop calling `handler` for any packets at all."
+        self.subscriptions = [s for s in self.subscriptions
+                              if s.handler != handler]
+        self.rebuild()
+
+    def matches(self, subscription, key, name):
+        """Return True if the packet with key `key` and command name
+        `name` is one `subscription` asks for."""
+        type_name, subsystem_name, cmd = key
+        if subscription.type_name not in (None, type_name):
+            return False
+        if subscription.subsystem_name not in (None, subsystem_name):
+            return False
+        if subscription.command is None:
+            return True
+        if isinstance(subscription.command, int):
+            return subscription.command == cmd
+        return fnmatchcase(name, subscription.command.upper())
+
+    def rebuild(self):
+        "Work out the handlers of every known command again."
+        self.table = {}
+        for (type_name, subsystem_name), table in self.commands.items():
+            for cmd, command in table.items():
+                key = (type_name, subsystem_name, cmd)
+                handlers = tuple(s.handler for s in self.subscriptions
+                                 if self.matches(s, key, command.name))
+                if handlers:
+                    self.table[key] = (command, handlers)
+
+    def handlers(self, key):
+        "Return the handlers subscribed to packets with key `key`."
+        entry = self.table.get(key)
+        return () if entry is None else entry[1]
+
+    def publish(self, type_name, subsystem_name, cmd, data):
+        """Decode the packet and pass it to its subscribers, if it has
+        any.  Returns True if one of them dealt with it.  Packets that
+        cannot be decoded are counted and not passed on."""
+        key = (type_name, subsystem_name, cmd)
+        entry = self.table.get(key)
+        if entry is None:
+            return False
+        command, handlers = entry
+        try:
+            record = command.decode(data)
+        except ParseError:
+            self.errors += 1
+            return False
+        handled = False
+        for handler in handlers:
+            if handler(key, record):
+                handled = True
+        return handled
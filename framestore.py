@@ -0,0 +1,413 @@
+#! /usr/bin/env python3
+
+# framestore.py
+#
+# Keeping long captures of packets in columns that can be queried
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+from array import array
+from collections.abc import Container
+from fnmatch import fnmatchcase
+from functools import partial
+from mtapi import MTAPIType, MTAPISubsystem, ParseError, ParseField
+from mtapi import fixed_length
+from mtcmds import MT_COMMANDS, find_command
+
+
+# The most frames held by default
+FRAME_CAPACITY = 1000000
+
+# The most bytes of frame bodies held by default
+ARENA_SIZE = 32 * 1024 * 1024
+
+# The fields decoded into columns of their own by default
+DEFAULT_COLUMNS = ("SrcAddr", "ClusterId", "LinkQuality")
+
+# The value held in a decoded column for a frame without that field
+MISSING = -1
+
+# The longest body a frame can carry
+MAX_BODY = 255
+
+
+def command_keys(pattern, commands=MT_COMMANDS):
+    """Return the set of Cmd0 << 8 | Cmd1 keys of the commands in
+    `commands` (a table laid out like mtcmds.MT_COMMANDS) whose names
+    match `pattern`, in the style of the fnmatch module.  Requests and
+    their responses have the same name, so both are matched."""
+    pattern = pattern.upper()
+    keys = set()
+    for (type_name, subsystem_name), table in commands.items():
+        cmd0 = (MTAPIType.to_number(type_name) |
+                MTAPISubsystem.to_number(subsystem_name))
+        for cmd1, command in table.items():
+            if fnmatchcase(command.name, pattern):
+                keys.add(cmd0 << 8 | cmd1)
+    return keys
+
+
+def column_layout(command, names):
+    """Return where `command` keeps the integer fields called `names`:
+    a list of (name, offset, length) triples for those at the same
+    offset in every packet, and a list of the names of those that can
+    only be found by decoding the packet."""
+    fixed = []
+    decoded = []
+    offset = 0
+    for field in command.fields:
+        if offset is not None and field.name in names and \
+           isinstance(field, ParseField) and field.length < 8:
+            fixed.append((field.name, offset, field.length))
+        elif field.name in names:
+            decoded.append(field.name)
+        if offset is not None:
+            length = fixed_length([field])
+            offset = None if length is None else offset + length
+    return fixed, decoded
+
+
+class Group:
+    """The frames in a group made by FrameStore.group(): the number of
+    them, and the total, smallest and largest of the values summarised.
+    """
+    __slots__ = ("count", "total", "minimum", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        "Count a frame with the value `value`."
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def mean(self):
+        "Return the mean of the values, or None if there are none."
+        return self.total / self.count if self.count else None
+
+
+class FrameStore:
+    """Holds the packets received over a long capture, for counting and
+    comparing afterwards rather than searching through the console's
+    output.  Each frame's details are kept in arrays, one per column,
+    rather than in an object of its own: the time it was received, its
+    Cmd0 and Cmd1 bytes (as the one number Cmd0 << 8 | Cmd1, so a
+    command is found with one comparison), the device it came from,
+    and where its body is in the arena, a single bytearray holding the
+    bodies of all the frames.  The fields named in `columns` are also
+    decoded into columns of their own as frames arrive, holding
+    MISSING for frames without them; where a command keeps a field at
+    the same offset in every packet, it is read from there without
+    decoding the rest of the packet.
+
+    Memory is bounded: at most `capacity` frames and `arena_size` bytes
+    of bodies are held, the oldest frames being forgotten to make room
+    for new ones.  Frames are identified by their number, counting
+    from zero for the first frame added, which stays the same as
+    others are added and forgotten."""
+    def __init__(self, capacity=FRAME_CAPACITY, arena_size=ARENA_SIZE,
+                 columns=DEFAULT_COLUMNS):
+        if capacity <= 0:
+            raise ValueError("The store must hold at least one frame")
+        # A body that goes back to the start of the arena may leave up
+        # to MAX_BODY bytes unused at the end
+        if arena_size < 2 * MAX_BODY:
+            raise ValueError("The arena must hold at least %d bytes" %
+                             (2 * MAX_BODY))
+        self.capacity = capacity
+        self.arena_size = arena_size
+        self.devices = []
+        self.attached = {}
+        self.layouts = {}
+        self.columns = {}
+        for name in columns:
+            self.columns[name] = array("q")
+        self.clear()
+
+    def clear(self):
+        "Forget every frame."
+        self.times = array("d")
+        self.commands = array("H")
+        self.device = array("B")
+        self.offsets = array("I")
+        self.lengths = array("B")
+        # The arena bytes each frame uses up, including any left unused
+        # at the end of the arena when its body went back to the start
+        self.spans = array("I")
+        for name in self.columns:
+            self.columns[name] = array("q")
+        self.arena = bytearray()
+        self.head = 0
+        self.free = self.arena_size
+        self.first = 0
+        self.added = 0
+
+    def __len__(self):
+        return self.added - self.first
+
+    def arrays(self):
+        """Return a dictionary of the arrays of the columns that can be
+        queried, indexed by the column name."""
+        arrays = dict(time=self.times, command=self.commands,
+                      device=self.device, length=self.lengths)
+        arrays.update(self.columns)
+        return arrays
+
+    def attach(self, receiver, device="device"):
+        """Start storing the frames received by `receiver`, the MTAPI
+        receiver for the device called `device`."""
+        if device not in self.devices:
+            if len(self.devices) > 0xff:
+                raise ValueError("Too many devices")
+            self.devices.append(device)
+        listener = partial(self.listener, receiver,
+                           self.devices.index(device))
+        self.attached[receiver] = listener
+        receiver.add_listener(listener)
+
+    def detach(self, receiver):
+        "Stop storing the frames received by `receiver`."
+        receiver.remove_listener(self.attached.pop(receiver))
+
+    def listener(self, receiver, device, type_name, subsystem_name, cmd,
+                 data):
+        """Store the frame received.  Storing it does not stop it being
+        displayed as usual."""
+        self.add(receiver.cmd0, cmd, data, device=device)
+        return False
+
+    def add(self, cmd0, cmd1, data, when=None, device=0):
+        """Store the frame with the header bytes `cmd0` and `cmd1` and
+        the body `data`, received at `when` (by default, now) from the
+        device numbered `device`.  Returns the frame's number."""
+        if when is None:
+            when = time.time()
+        length = len(data)
+        if length > MAX_BODY:
+            raise ValueError("Frame body too long")
+        # Bodies go at the end of the arena, or back at the start if
+        # there is no room there, and the oldest frames are forgotten
+        # until that end of the arena is free
+        offset = self.head
+        span = length
+        if offset + length > self.arena_size:
+            offset = 0
+            span = self.arena_size - self.head + length
+        while len(self) >= self.capacity or self.free < span:
+            self.free += self.spans[self.first % self.capacity]
+            self.first += 1
+        self.arena[offset:offset+length] = data
+        self.head = offset + length
+        self.free -= span
+
+        key = cmd0 << 8 | cmd1
+        values = self.extract(key, data)
+        slot = self.added % self.capacity
+        if slot == len(self.times):
+            self.times.append(when)
+            self.commands.append(key)
+            self.device.append(device)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.spans.append(span)
+            for name, column in self.columns.items():
+                column.append(values.get(name, MISSING))
+        else:
+            self.times[slot] = when
+            self.commands[slot] = key
+            self.device[slot] = device
+            self.offsets[slot] = offset
+            self.lengths[slot] = length
+            self.spans[slot] = span
+            for name, column in self.columns.items():
+                column[slot] = values.get(name, MISSING)
+        self.added += 1
+        return self.added - 1
+
+    def extract(self, key, data):
+        """Return a dictionary of the values of the decoded columns in
+        the body `data` of a frame with the command key `key`."""
+        layout = self.layouts.get(key)
+        if layout is None:
+            command = find_command(key >> 8, key & 0xff)
+            if command is None:
+                layout = ([], [])
+            else:
+                layout = column_layout(command, self.columns)
+            self.layouts[key] = layout
+        fixed, decoded = layout
+        values = {}
+        for name, offset, length in fixed:
+            if offset + length <= len(data):
+                values[name] = int.from_bytes(data[offset:offset+length],
+                                              "little")
+        if decoded:
+            command = find_command(key >> 8, key & 0xff)
+            try:
+                record = command.decode(data)
+            except ParseError:
+                record = {}
+            for name in decoded:
+                value = record.get(name)
+                if isinstance(value, int) and value < 1 << 63:
+                    values[name] = value
+        return values
+
+    def device_name(self, index):
+        """Return the name of the device numbered `index`, or the number
+        if frames from it were added without attaching to it."""
+        if index < len(self.devices):
+            return self.devices[index]
+        return index
+
+    def slot(self, number):
+        """Return where in the arrays the frame numbered `number` is.
+        Raises an IndexError if the store does not hold it."""
+        if not self.first <= number < self.added:
+            raise IndexError("Frame %d is not held" % number)
+        return number % self.capacity
+
+    def body(self, number):
+        "Return the body of the frame numbered `number`."
+        slot = self.slot(number)
+        offset = self.offsets[slot]
+        return bytes(self.arena[offset:offset+self.lengths[slot]])
+
+    def frame(self, number):
+        """Return the frame numbered `number` as a dictionary of its
+        time, Cmd0, Cmd1, command name (if the command is known),
+        device name and body, and the values of any decoded columns
+        it has."""
+        slot = self.slot(number)
+        key = self.commands[slot]
+        command = find_command(key >> 8, key & 0xff)
+        record = dict(time=self.times[slot], cmd0=key >> 8,
+                      cmd1=key & 0xff,
+                      name=None if command is None else command.name,
+                      device=self.device_name(self.device[slot]),
+                      body=self.body(number))
+        for name, column in self.columns.items():
+            if column[slot] != MISSING:
+                record[name] = column[slot]
+        return record
+
+    def scan(self, column, test):
+        """Return the numbers of the frames, oldest first, whose values
+        in the array `column` pass `test`.  Goes through the arrays a
+        slice at a time rather than frame by frame."""
+        start = self.first % self.capacity
+        end = start + len(self)
+        found = []
+        number = self.first
+        for piece in (column[start:min(end, self.capacity)],
+                      column[:max(end - self.capacity, 0)]):
+            found.extend(number + i for i, value in enumerate(piece)
+                         if test(value))
+            number += len(piece)
+        return found
+
+    def criteria(self, command=None, device=None, since=None, until=None,
+                 **columns):
+        """Turn the conditions given to select() into a list of (array,
+        test) pairs."""
+        criteria = []
+        if command is not None:
+            keys = command_keys(command) if isinstance(command, str) \
+                   else {command}
+            criteria.append((self.commands, keys.__contains__))
+        if device is not None:
+            if device not in self.devices:
+                raise ValueError("Unknown device %s" % device)
+            wanted = self.devices.index(device)
+            criteria.append((self.device, wanted.__eq__))
+        if since is not None:
+            criteria.append((self.times, lambda t: t >= since))
+        if until is not None:
+            criteria.append((self.times, lambda t: t < until))
+        arrays = self.arrays()
+        for name, value in columns.items():
+            if name not in arrays:
+                raise ValueError("Unknown column %s" % name)
+            if isinstance(value, Container):
+                criteria.append((arrays[name], value.__contains__))
+            else:
+                criteria.append((arrays[name],
+                                 lambda v, value=value: v == value))
+        return criteria
+
+    def select(self, command=None, device=None, since=None, until=None,
+               **columns):
+        """Return the numbers of the frames, oldest first, that are for
+        the command named `command` (a name or fnmatch pattern, such as
+        "ZDO_*_IND", or a Cmd0 << 8 | Cmd1 number), that came from the
+        device called `device`, that were received no earlier than
+        `since` and before `until`, and whose values in the columns
+        named by the other keyword arguments are the ones given.  A
+        value may be a number or a collection of them, such as a set or
+        a range.  Raises a ValueError for an unknown device or
+        column."""
+        criteria = self.criteria(command, device, since, until, **columns)
+        if not criteria:
+            return list(range(self.first, self.added))
+        column, test = criteria[0]
+        numbers = self.scan(column, test)
+        capacity = self.capacity
+        for column, test in criteria[1:]:
+            numbers = [n for n in numbers if test(column[n % capacity])]
+        return numbers
+
+    def group(self, key, value=None, numbers=None, **conditions):
+        """Split the frames up by their values in the column named
+        `key`, returning a dictionary of Groups indexed by those
+        values.  Each Group summarises the frames' values in the column
+        named `value`, or simply counts them if `value` is None.  The
+        frames are those numbered in `numbers`, or those that select()
+        picks with `conditions`.  Frames missing either value are left
+        out.  Raises a ValueError for an unknown column."""
+        arrays = self.arrays()
+        for name in (key, value):
+            if name is not None and name not in arrays:
+                raise ValueError("Unknown column %s" % name)
+        if numbers is None:
+            numbers = self.select(**conditions)
+        keys = arrays[key]
+        values = None if value is None else arrays[value]
+        groups = {}
+        capacity = self.capacity
+        for number in numbers:
+            slot = number % capacity
+            group_key = keys[slot]
+            if group_key == MISSING and key in self.columns:
+                continue
+            if values is None:
+                item = 1
+            else:
+                item = values[slot]
+                if item == MISSING and value in self.columns:
+                    continue
+            group = groups.get(group_key)
+            if group is None:
+                group = groups[group_key] = Group()
+            group.add(item)
+        return groups
@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+
+# fuzz.py
+#
+# Feeding mangled packets to the decoders to find the ones that break
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+import contextlib
+import io
+import random
+import sys
+import time
+from mtapi import MTAPIType, MTAPISubsystem, ParseError, calculate_fcs
+from mtcmds import MTAPI, MT_COMMANDS
+
+
+# The longest body a frame can carry
+MAX_BODY = 250
+
+# Byte values most likely to upset counts and lengths
+EXTREMES = (0x00, 0x01, 0x7f, 0x80, 0xfe, 0xff)
+
+# Random mutations tried for each command by default
+FUZZ_COUNT = 50
+
+# Seconds a single decode may take before the input is reported
+SLOW_DECODE = 0.005
+
+
+def mutations(body, rng, count=FUZZ_COUNT):
+    """Generate variations on the valid body `body`: every truncation
+    of it, with bytes added, with each byte replaced in turn by the
+    values in EXTREMES (which is how counts and lengths go wrong), and
+    then `count` random mixtures of those, using the random.Random
+    `rng`."""
+    for end in range(len(body)):
+        yield body[:end]
+    yield body + b'\x00'
+    yield body + bytes(rng.randrange(256) for _ in range(8))
+    for i in range(len(body)):
+        for value in EXTREMES:
+            yield body[:i] + bytes((value,)) + body[i+1:]
+    for _ in range(count):
+        data = bytearray(body)
+        for _ in range(rng.randint(1, 4)):
+            choice = rng.randrange(3)
+            i = rng.randint(0, len(data))
+            if choice == 0 and i < len(data):
+                data[i] = rng.choice(EXTREMES + (rng.randrange(256),))
+            elif choice == 1 and i < len(data):
+                del data[i]
+            else:
+                data.insert(i, rng.randrange(256))
+        yield bytes(data[:MAX_BODY])
+
+
+def seeds(command, rng):
+    """Return valid and nearly valid bodies of `command` to mutate: its
+    fields all zero or empty, and bodies of ones, which give every list
+    and repeated field one entry, and random bytes."""
+    return [command.encode({}), bytes((1,) * rng.randint(1, 40)),
+            bytes(rng.randrange(256) for _ in range(rng.randint(1, 40)))]
+
+
+class CommandReport:
+    """What became of the mutated bodies fed to a command.  `failures`
+    holds (body, exception) pairs for the bodies that raised something
+    other than an mtapi.ParseError, which are bugs, and `slow` the
+    (seconds, body) pairs of the bodies that took longer than
+    SLOW_DECODE to decode or parse."""
+    def __init__(self, command):
+        self.command = command
+        self.cases = 0
+        self.rejected = 0
+        self.failures = []
+        self.slow = []
+        self.slowest = 0.0
+
+    def __str__(self):
+        return ("%s: %d cases, %d rejected, %d failed, %d slow, "
+                "slowest %.3fms" %
+                (self.command.name, self.cases, self.rejected,
+                 len(self.failures), len(self.slow), self.slowest * 1000))
+
+
+def try_body(command, body, report, limit=SLOW_DECODE):
+    """Decode and parse (display) `body` as the body of `command`,
+    adding the outcome to `report`."""
+    report.cases += 1
+    for decoder in (command.decode, command):
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                decoder(body)
+        except ParseError:
+            report.rejected += 1
+        except Exception as e:
+            report.failures.append((body, e))
+        elapsed = time.perf_counter() - start
+        if elapsed > limit:
+            report.slow.append((elapsed, body))
+        report.slowest = max(report.slowest, elapsed)
+
+
+def fuzz_command(command, rng, count=FUZZ_COUNT, limit=SLOW_DECODE):
+    "Feed mutated bodies to `command`, returning a CommandReport."
+    report = CommandReport(command)
+    for seed in seeds(command, rng):
+        for body in mutations(seed, rng, count):
+            try_body(command, body, report, limit)
+    return report
+
+
+def fuzz_commands(seed=0, count=FUZZ_COUNT, limit=SLOW_DECODE,
+                  commands=MT_COMMANDS):
+    """Fuzz every command in `commands`, a table laid out like
+    MT_COMMANDS, with the random number seed `seed`.  Returns a list
+    of CommandReports."""
+    rng = random.Random(seed)
+    return [fuzz_command(command, rng, count, limit)
+            for table in commands.values()
+            for command in table.values()]
+
+
+def garbage_stream(rng, frames):
+    """Return a byte stream of `frames` frames for known commands, each
+    mutated or not at random, separated by occasional runs of junk."""
+    keys = [(key, cmd) for key, table in MT_COMMANDS.items()
+            for cmd in table]
+    stream = bytearray()
+    for _ in range(frames):
+        (type_name, subsystem_name), cmd = rng.choice(keys)
+        command = MT_COMMANDS[(type_name, subsystem_name)][cmd]
+        body = rng.choice(seeds(command, rng))
+        if rng.random() < 0.5:
+            body = next(mutations(body, rng, 1))
+        frame = bytearray((0xfe, len(body),
+                           MTAPIType.to_number(type_name) |
+                           MTAPISubsystem.to_number(subsystem_name),
+                           cmd))
+        frame += body
+        frame.append(calculate_fcs(frame[1:]))
+        if rng.random() < 0.1:
+            frame[rng.randrange(len(frame))] = rng.randrange(256)
+        stream += frame
+        if rng.random() < 0.1:
+            stream += bytes(rng.randrange(256)
+                            for _ in range(rng.randint(1, 16)))
+    return bytes(stream)
+
+
+def fuzz_stream(stream, display="decode"):
+    """Run the receiver over `stream` as if it had arrived from the
+    device, displaying packets as `display` says (but throwing the
+    output away).  Returns the number of packets received, the number
+    of them that were malformed and the seconds taken."""
+    source = io.BytesIO(stream)
+    receiver = MTAPI(source)
+    receiver.display = display
+    packets = []
+    receiver.add_listener(lambda *packet: packets.append(None))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while source.tell() < len(stream):
+            receiver.work()
+    return len(packets), receiver.malformed, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MTAPI Decoder Fuzzer")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random number seed (default: %(default)s)")
+    parser.add_argument("--count", type=int, default=FUZZ_COUNT,
+                        help="Random mutations of each body "
+                        "(default: %(default)s)")
+    parser.add_argument("--limit", type=float, default=SLOW_DECODE,
+                        help="Seconds a decode may take before it is "
+                        "reported (default: %(default)s)")
+    parser.add_argument("--frames", type=int, default=10000,
+                        help="Frames in the garbage stream fed to the "
+                        "receiver (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Report on every command")
+    args = parser.parse_args()
+
+    reports = fuzz_commands(args.seed, args.count, args.limit)
+    problems = 0
+    for report in reports:
+        if args.verbose or report.failures or report.slow:
+            print(report)
+        for body, e in report.failures:
+            problems += 1
+            print("  %s: %s: %s" % (type(e).__name__, e, body.hex(" ")))
+        for elapsed, body in report.slow:
+            problems += 1
+            print("  %.3fms: %s" % (elapsed * 1000, body.hex(" ")))
+    print("%d commands, %d cases, %d problems" %
+          (len(reports), sum(report.cases for report in reports),
+           problems))
+
+    stream = garbage_stream(random.Random(args.seed), args.frames)
+    for display in ("decode", "none"):
+        packets, malformed, elapsed = fuzz_stream(stream, display)
+        print("Stream displayed as %s: %d packets (%d malformed) "
+              "in %.3fs, %.0f packets/s" %
+              (display, packets, malformed, elapsed, packets / elapsed))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,10 +22,29 @@
 # limitations under the License.
 
 
+import os
 import sys
-import shlex
 import textwrap
-from mtcmds import MTBuffer
+import time
+import traceback
+from mtapi import ParseError, parse_hex_bytes, field_parse_status
+from mtcmds import MTBuffer, MT_REQUESTS, DISPLAY_MODES, find_command
+import script
+import api
+import template
+import crawl
+import pipeline
+import ramdump
+import nvdump
+import linktest
+import aftraffic
+import bigsend
+import devstate
+import addrcache
+import scan
+import zdiags
+import framestore
+from tokenizer import tokenize
 from collections import namedtuple
 
 
@@ -40,6 +59,15 @@ from collections import namedtuple
 TableEntry = namedtuple("TableEntry",
                         "subsystem, type, command, help_text")
 
+# Number of bytes of repeated frames to gather up before writing them
+REPEAT_BATCH = 4096
+
+# Number of debug messages shown by default
+DEBUG_HISTORY = 20
+
+# Seconds to wait for the device to reach a state by default
+WAIT_STATE_TIMEOUT = 30.0
+
 class UIHandler:
     """User Interface Handler class, (very) loosely based on cmd.Cmd.
     This version uses a command table rather than implying one from
@@ -59,6 +87,10 @@ class UIHandler:
     commands are not case sensitive, and all table keys should be
     lower case.
 
+    Any MTAPI request that is not in the command table can still be
+    sent by giving its full name, e.g. "af_data_request".  These names
+    cannot be abbreviated.
+
     (Why are we not using cmd.Cmd directly?  Because it's a pain when
     you are monitoring multiple inputs, and we are here.)"""
     COMMAND_TABLE = {
@@ -66,6 +98,230 @@ class UIHandler:
                             "Supply help on the commands"),
         "quit" : TableEntry(None, None, None,
                             "Exit the program"),
+        "source" : TableEntry(None, None, None,
+                              "Run the commands in a file: "
+                              "source FILE [wait]\n\n"
+                              "Each line of FILE is a console command."
+                              "  Blank lines and lines starting with"
+                              " '#' are ignored.  The whole file is"
+                              " parsed before anything is sent, so a"
+                              " mistake on any line stops the file"
+                              " running at all.  If 'wait' is given,"
+                              " the response to each SREQ is waited"
+                              " for before the next command is sent."),
+        "pyrun" : TableEntry(None, None, None,
+                             "Run a Python script: pyrun FILE [ARG ...]"
+                             "\n\n"
+                             "The script runs inside the console with"
+                             " 'mt', an api.ScriptAPI, to send requests"
+                             " by name with mt.send('SYS_PING'), wait"
+                             " for replies with mt.wait_for(), handle"
+                             " events with mt.on() and run console"
+                             " commands with mt.command().  The ARGs"
+                             " are in the list 'args'."),
+        "repeat" : TableEntry(None, None, None,
+                              "Send an MTAPI command many times: "
+                              "repeat COUNT COMMAND [FIELDS]\n\n"
+                              "Any field written as {} or {start} is"
+                              " a counter, which is incremented for each"
+                              " repetition from zero or from `start`."
+                              "  The command is only parsed once, so"
+                              " frames are sent as fast as the serial"
+                              " link allows."),
+        "raw" : TableEntry(None, None, None,
+                           "Send a frame given as hex bytes: "
+                           "raw fe LEN CMD0 CMD1 [DATA] [FCS] or "
+                           "raw COMMAND [DATA]\n\n"
+                           "The bytes may be split into tokens however"
+                           " is convenient.  A frame's Frame Check"
+                           " Sequence is added if it is left off, and"
+                           " checked if it is not.  Alternatively the"
+                           " body of a frame can be given after the"
+                           " name of the MTAPI command to send it in."),
+        "output" : TableEntry(None, None, None,
+                              "Show or set how received packets are"
+                              " displayed: output [decode|hex|none]\n\n"
+                              "'decode' shows every field of a packet,"
+                              " 'hex' just the bytes of the frame and"
+                              " 'none' nothing at all.  Skipping"
+                              " decoding keeps up with high data rates"
+                              " when only the bytes are of interest."),
+        "crawl" : TableEntry(None, None, None,
+                             "Map the network: crawl FILE [INFLIGHT]\n\n"
+                             "Reads the neighbour table of every router"
+                             " reachable from the coordinator, with up"
+                             " to INFLIGHT (default 8) requests"
+                             " outstanding at once, and writes the"
+                             " neighbour graph to FILE.  The graph is"
+                             " written in Graphviz DOT if FILE ends"
+                             " '.dot', and as JSON otherwise."),
+        "ramdump" : TableEntry(None, None, None,
+                               "Read device memory into a file: "
+                               "ramdump ADDR LEN FILE\n\n"
+                               "The LEN bytes from address ADDR are read"
+                               " with as few SYS_RAM_READ requests as"
+                               " possible and written to FILE.  Chunks"
+                               " that fail are retried; any that still"
+                               " fail are reported and left as zeroes"
+                               " in FILE."),
+        "nvdump" : TableEntry(None, None, None,
+                              "Save the device's NV items to a file: "
+                              "nvdump FILE [ID ...]\n\n"
+                              "Reads every known OSAL NV item, or just"
+                              " the item IDs given, and writes a"
+                              " snapshot of those present to FILE."),
+        "nvdiff" : TableEntry(None, None, None,
+                              "Compare two NV snapshots: "
+                              "nvdiff BEFORE AFTER\n\n"
+                              "Lists the items added, removed or"
+                              " changed between the snapshot files"
+                              " BEFORE and AFTER."),
+        "nvrestore" : TableEntry(None, None, None,
+                                 "Write an NV snapshot back to the"
+                                 " device: nvrestore FILE\n\n"
+                                 "The items in FILE are read from the"
+                                 " device first, and only the parts that"
+                                 " differ are written.  Items missing"
+                                 " from the device are created; items"
+                                 " whose length has changed are"
+                                 " reported and left alone."),
+        "linktest" : TableEntry(None, None, None,
+                                "Test the serial link: "
+                                "linktest COUNT SIZE [RATE]\n\n"
+                                "Sends COUNT UTIL_LOOPBACK frames with"
+                                " random payloads of SIZE bytes, as fast"
+                                " as they are echoed or RATE frames a"
+                                " second, and checks every echo.  Reports"
+                                " the errors, round trip times and"
+                                " throughput."),
+        "aftraffic" : TableEntry(None, None, None,
+                                 "Measure mesh throughput: "
+                                 "aftraffic COUNT SIZE RATE DEST"
+                                 " [DEST ...]\n\n"
+                                 "Sends COUNT payloads of SIZE random"
+                                 " bytes from endpoint 1 to endpoint 1"
+                                 " of the devices with the (hexadecimal)"
+                                 " network addresses DEST in turn, at"
+                                 " RATE frames a second or as fast as"
+                                 " they are confirmed if RATE is 0."
+                                 "  Only a few frames are outstanding at"
+                                 " once.  Reports the frames delivered,"
+                                 " the failure codes, the confirmation"
+                                 " latencies and the throughput."
+                                 "  Endpoint 1 must be registered first"
+                                 " with af_register."),
+        "bigsend" : TableEntry(None, None, None,
+                               "Send a file as one AF message: "
+                               "bigsend DEST FILE [CLUSTER]\n\n"
+                               "Sends the contents of FILE from endpoint"
+                               " 1 to endpoint 1 of the device with the"
+                               " (hexadecimal) network address DEST, on"
+                               " CLUSTER (default 0).  Files too big for"
+                               " one AF_DATA_REQUEST_EXT are written to"
+                               " the device in AF_DATA_STORE segments"
+                               " first.  Endpoint 1 must be registered"
+                               " first with af_register."),
+        "bigrecv" : TableEntry(None, None, None,
+                               "Save incoming AF messages: "
+                               "bigrecv DIR or bigrecv off\n\n"
+                               "Writes the data of every"
+                               " AF_INCOMING_MSG_EXT received to a file"
+                               " in DIR named after the source address"
+                               " and timestamp, fetching messages too"
+                               " long to fit in a frame with"
+                               " AF_DATA_RETRIEVE in the background."
+                               "  With no arguments, shows how many"
+                               " messages have been saved."),
+        "scan" : TableEntry(None, None, None,
+                            "Survey the channels: scan COUNT"
+                            " [ed|active|passive] [CHANNELS]"
+                            " [DURATION]\n\n"
+                            "Runs COUNT MAC_SCAN_REQ sweeps of the"
+                            " given type (default ed) back to back over"
+                            " CHANNELS, such as '11,15-20' (default"
+                            " all), spending about 2**DURATION + 1"
+                            " superframes (default 3) on each channel."
+                            "  Shows the minimum, mean and maximum"
+                            " energy on each channel and the number of"
+                            " beacons heard from each PAN."),
+        "nwkaddr-of" : TableEntry(None, None, None,
+                                  "Find a device's network address: "
+                                  "nwkaddr-of IEEE\n\n"
+                                  "The address is taken from the"
+                                  " address cache if it is there, then"
+                                  " from the local device's address"
+                                  " manager, and only then asked for"
+                                  " over the air with"
+                                  " ZDO_NWK_ADDR_REQ."),
+        "ieeeaddr-of" : TableEntry(None, None, None,
+                                   "Find a device's IEEE address: "
+                                   "ieeeaddr-of NWK\n\n"
+                                   "NWK is in hexadecimal.  The address"
+                                   " is taken from the address cache if"
+                                   " it is there, then from the local"
+                                   " device's address manager, and only"
+                                   " then asked for over the air with"
+                                   " ZDO_IEEE_ADDR_REQ."),
+        "zdiags" : TableEntry(None, None, None,
+                              "Poll diagnostic statistics: "
+                              "zdiags FILE INTERVAL [ATTR ...] or"
+                              " zdiags stop\n\n"
+                              "Reads the given ZDIAGS attributes (names"
+                              " or numbers), or every known attribute,"
+                              " every INTERVAL seconds in the background"
+                              " and writes each value and its rate of"
+                              " change per second to FILE as CSV.  With"
+                              " no arguments, shows how polling is"
+                              " going."),
+        "debuglog" : TableEntry(None, None, None,
+                                "Show the device's debug messages: "
+                                "debuglog [COUNT|on|off|clear]\n\n"
+                                "DEBUG_MSG strings are kept in a log of"
+                                " the most recent messages rather than"
+                                " displayed with the other packets."
+                                "  Shows the last COUNT (default 20)"
+                                " messages with the time each was first"
+                                " received and how many times it was"
+                                " repeated.  'on' and 'off' turn the"
+                                " display of messages as they arrive on"
+                                " and off; 'clear' empties the log."),
+        "capture" : TableEntry(None, None, None,
+                               "Keep the packets received for querying: "
+                               "capture [on [FRAMES]|off|clear|group KEY"
+                               " [VALUE [COMMAND]]]\n\n"
+                               "'on' starts keeping packets in a store of"
+                               " the most recent FRAMES (default"
+                               " 1000000) packets, with their SrcAddr,"
+                               " ClusterId and LinkQuality fields, and"
+                               " 'off' stops.  'group' counts the"
+                               " packets kept for each value of the"
+                               " column KEY, and gives the mean, least"
+                               " and greatest of column VALUE in each"
+                               " group, only counting COMMAND packets"
+                               " (a name or pattern such as ZDO_*_IND)"
+                               " if given: for example, capture group"
+                               " SrcAddr LinkQuality AF_INCOMING_MSG."
+                               "  KEY and VALUE may also be command,"
+                               " device, time or length.  With no"
+                               " arguments, shows how many packets are"
+                               " kept."),
+        "status" : TableEntry(None, None, None,
+                              "Show the device's state: status\n\n"
+                              "Answers at once from what the device has"
+                              " reported in ZDO_STATE_CHANGE_IND,"
+                              " SYS_RESET_IND, ZDO_JOIN_CNF and"
+                              " ZDO_LEAVE_IND packets and"
+                              " UTIL_GET_DEVICE_INFO responses, without"
+                              " asking it anything."),
+        "waitstate" : TableEntry(None, None, None,
+                                 "Wait for the device to reach a state: "
+                                 "waitstate STATE [TIMEOUT]\n\n"
+                                 "STATE is a Z-Stack device state such as"
+                                 " DEV_ZB_COORD or DEV_ROUTER, or its"
+                                 " number.  Returns as soon as the device"
+                                 " reports the state, or after TIMEOUT"
+                                 " seconds (default 30).  Useful in"
+                                 " scripts that start the network."),
         "ping" : TableEntry("SYS", "SREQ", "SYS_PING",
                             "Send a SYS_PING command to the serial port"),
         "version" : TableEntry("SYS", "SREQ", "SYS_VERSION",
@@ -75,68 +331,161 @@ class UIHandler:
                              "Request the CC2538 to reset itself")
     }
 
-    def __init__(self, sock):
+    def __init__(self, sock, mtapi=None, interactive=True, raw=False,
+                 addresses=None, debug_log=None, device=None):
         """Create the UI handler instance.  Requires a serial comms
         socket for communicating with the device under
-        investigation.  Otherwise interacts via stdin/stdout"""
+        investigation.  Otherwise interacts via stdin/stdout.  If the
+        MTAPI receiver `mtapi` is given, commands that need to wait
+        for responses from the device (such as "source") may use it.
+        If `interactive` is False, no banner or prompts are written.
+        If `raw` is True, lines typed are sent as by the "raw" command
+        unless they start with the full name of a special command such
+        as "quit".  `addresses` is the addrcache.AddressCache to consult
+        when looking up addresses, if there is one, `debug_log` the
+        debuglog.DebugLog collecting the device's debug messages and
+        `device` the devstate.DeviceState following the device."""
         self.sock = sock
-        print("MTAPI Console Program")
-        print()
+        self.mtapi = mtapi
+        self.addresses = addresses
+        self.debug_log = debug_log
+        self.device = device
+        self.interactive = interactive
+        self.raw = raw
+        self.sourcing = []
+        self.poller = None
+        self.reassembler = None
+        self.bigrecv_dir = None
+        self.frame_store = None
+        if interactive:
+            print("MTAPI Console Program")
+            print()
         self.prompt()
 
     def prompt(self):
         "Write the interactive prompt to stdout."
-        print("> ", end="", flush=True)
+        if self.interactive:
+            print("> ", end="", flush=True)
 
     def __call__(self):
         """Read a line of text from stdin and act on it.  This is a
         blocking read, so ensure that there is data to be read before
         calling, otherwise serial input may be lost."""
         inline = sys.stdin.readline()
-        tokens = shlex.split(inline)
-        if not tokens:
+        try:
+            tokens = tokenize(inline)
+        except ValueError as e:
+            print("Error:", e)
             self.prompt()
             return True
-        if tokens[0] == '?':
+        if self.raw and tokens:
+            entry = self.find_entry(tokens[0])
+            if entry is None or entry.subsystem is not None:
+                tokens = ["raw"] + tokens
+        result = self.execute(tokens)
+        if result:
+            self.prompt()
+        return result
+
+    def send(self, frame):
+        """Write `frame` to the device, letting the address cache see
+        what it is asking."""
+        self.sock.write(frame)
+        if self.addresses is not None:
+            self.addresses.sent(frame)
+
+    def timeout(self):
+        """Return the seconds until background work (such as polling
+        statistics) needs `tick()` to be called, or None if there is
+        none to do."""
+        waits = []
+        if self.poller is not None:
+            waits.append(self.poller.wait_time())
+        if self.reassembler is not None:
+            waits.append(self.reassembler.wait_time())
+        waits = [wait for wait in waits if wait is not None]
+        return min(waits) if waits else None
+
+    def tick(self):
+        "Carry out any background work that is due."
+        if self.poller is not None:
+            self.poller.tick()
+        if self.reassembler is not None:
+            self.reassembler.tick()
+
+    def lookup(self, token):
+        """Find the command table entry for the command name `token`,
+        which may be abbreviated to any unique prefix.  Returns a
+        (name, entry) pair, or None after printing a suitable error
+        message if the command is not recognised or is ambiguous."""
+        if token == '?':
             cmd = "help"
         else:
-            cmd = tokens[0].casefold()
+            cmd = token.casefold()
 
-        if cmd in UIHandler.COMMAND_TABLE:
-            entry = UIHandler.COMMAND_TABLE[cmd]
-        else:
-            # See if cmd is a unique substring of a command name
-            cmds = []
-            for name in UIHandler.COMMAND_TABLE.keys():
-                if name.startswith(cmd):
-                    cmds.append(name)
-            if not cmds:
-                print("Unrecognised command '%s'" % tokens[0])
-                self.prompt()
-                return True
-            elif len(cmds) == 1:
-                cmd = cmds[0]
-                entry = UIHandler.COMMAND_TABLE[cmd]
-            else:
-                print("Ambiguous command: do you mean",
-                      " ,".join(cmds[:-1]),
-                      "or", cmds[-1])
-                self.prompt()
-                return True
+        entry = self.find_entry(cmd)
+        if entry is not None:
+            return cmd, entry
 
-        if entry.subsystem is None:
-            # This is one of our specials, either help or quit
-            fn = getattr(self, "do_" + cmd)
-            result = fn(tokens[1:])
-            if result:
-                self.prompt()
-            return result
+        # See if cmd is a unique substring of a command name
+        cmds = []
+        for name in UIHandler.COMMAND_TABLE.keys():
+            if name.startswith(cmd):
+                cmds.append(name)
+        if not cmds:
+            print("Unrecognised command '%s'" % token)
+            return None
+        if len(cmds) > 1:
+            print("Ambiguous command: do you mean",
+                  " ,".join(cmds[:-1]),
+                  "or", cmds[-1])
+            return None
+        return cmds[0], UIHandler.COMMAND_TABLE[cmds[0]]
+
+    def find_entry(self, name):
+        """Find the command table entry for the command `name`, which
+        must be given in full.  As well as the commands in the table,
+        any MTAPI request may be given by its full name, such as
+        "af_data_request".  Returns None if there is no such command.
+        """
+        name = name.casefold()
+        if name in UIHandler.COMMAND_TABLE:
+            return UIHandler.COMMAND_TABLE[name]
+        command = name.upper()
+        if command in MT_REQUESTS:
+            subsystem, mtype = MT_REQUESTS[command]
+            return TableEntry(subsystem, mtype, command,
+                              "Send an MTAPI %s %s" % (subsystem, mtype))
+        return None
+
+    def compile(self, cmd, entry, tokens):
+        """Assemble the MTAPI packet for the command table `entry`
+        called `cmd` from the token list.  Returns the MTBuffer, or
+        None if the tokens could not be parsed, in which case the help
+        for the command will have been displayed."""
         buf = MTBuffer(entry.subsystem, entry.type, entry.command)
         if buf.cmd.parse_tokens(tokens, buf):
-            buf.send(self.sock)
-        else:
-            self.do_help([cmd])
-        self.prompt()
+            return buf
+        self.do_help([cmd])
+        return None
+
+    def execute(self, tokens):
+        """Act on a tokenised command line.  Returns False if the
+        program should exit, True otherwise."""
+        if not tokens:
+            return True
+        found = self.lookup(tokens[0])
+        if found is None:
+            return True
+        cmd, entry = found
+
+        if entry.subsystem is None:
+            # This is one of our specials, such as help or quit
+            fn = getattr(self, "do_" + cmd.replace("-", "_"))
+            return fn(tokens[1:])
+        buf = self.compile(cmd, entry, tokens)
+        if buf is not None:
+            self.send(buf.frame())
         return True
 
     def do_help(self, tokens):
@@ -145,10 +494,10 @@ class UIHandler:
         if tokens:
             # Help required on a specific command
             name = tokens[0].casefold()
-            if name not in UIHandler.COMMAND_TABLE:
+            entry = self.find_entry(name)
+            if entry is None:
                 print("Command", tokens[0], "not found")
                 return True
-            entry = UIHandler.COMMAND_TABLE[name]
             print("Syntax:", name, end=" ")
             if entry.subsystem is not None:
                 # Deduce the command parameters from the MTAPI command
@@ -160,7 +509,8 @@ class UIHandler:
                     info.extend(field.field_info())
                 print(" ".join(i[0] for i in info))
                 for i in info:
-                    i[2].helper(i[0])
+                    if i[2] is not None:
+                        i[2].helper(i[0])
             print()
             paragraphs = entry.help_text.split("\n\n")
             wrapper.initial_indent = "\t"
@@ -179,4 +529,741 @@ class UIHandler:
 
     def do_quit(self, tokens):
         "Exit the program"
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+        if self.reassembler is not None:
+            self.reassembler.stop()
+            self.reassembler = None
         return False
+
+    def do_source(self, tokens):
+        "Run the commands in a file"
+        if not tokens or len(tokens) > 2:
+            self.do_help(["source"])
+            return True
+        wait = False
+        if len(tokens) == 2:
+            if tokens[1].casefold() != "wait":
+                self.do_help(["source"])
+                return True
+            wait = True
+        if wait and self.mtapi is None:
+            print("Cannot wait for responses: no receiver available")
+            return True
+        # The same file may be named by different paths
+        path = os.path.realpath(tokens[0])
+        if path in self.sourcing:
+            print("File", tokens[0], "is already being run")
+            return True
+        runner = script.ScriptRunner(self)
+        try:
+            if not runner.load(tokens[0]):
+                return True
+        except OSError as e:
+            print("Unable to read %s: %s" % (tokens[0], e.strerror))
+            return True
+        self.sourcing.append(path)
+        try:
+            return runner.run(wait)
+        finally:
+            self.sourcing.pop()
+
+    def do_pyrun(self, tokens):
+        "Run a Python script"
+        if not tokens:
+            self.do_help(["pyrun"])
+            return True
+        if self.mtapi is None:
+            print("Cannot run Python scripts: no receiver available")
+            return True
+        try:
+            with open(tokens[0]) as f:
+                source = f.read()
+        except OSError as e:
+            print("Unable to read %s: %s" % (tokens[0], e.strerror))
+            return True
+        script_api = api.ScriptAPI(self)
+        namespace = { "__name__": "__pyrun__", "__file__": tokens[0],
+                      "mt": script_api, "args": tokens[1:] }
+        try:
+            exec(compile(source, tokens[0], "exec"), namespace)
+        except SystemExit:
+            pass
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            # Nothing can take the script's handlers off once it is gone
+            script_api.close()
+        return True
+
+    def do_repeat(self, tokens):
+        "Send an MTAPI command many times"
+        if len(tokens) < 2:
+            self.do_help(["repeat"])
+            return True
+        try:
+            count = int(tokens[0], 0)
+        except ValueError:
+            self.do_help(["repeat"])
+            return True
+        found = self.lookup(tokens[1])
+        if found is None:
+            return True
+        cmd, entry = found
+        if entry.subsystem is None:
+            print("Only MTAPI commands can be repeated")
+            return True
+        try:
+            frame = template.FrameTemplate(entry.subsystem, entry.type,
+                                           entry.command, tokens[1:])
+        except ParseError as e:
+            print("Error:", e)
+            self.do_help([cmd])
+            return True
+        starts = { name: frame[name] for name in frame.slots }
+        batch = bytearray()
+        for i in range(count):
+            for name, start in starts.items():
+                frame[name] = start + i
+            batch += frame.image
+            if len(batch) >= REPEAT_BATCH:
+                self.sock.write(batch)
+                batch = bytearray()
+                if self.mtapi is not None:
+                    self.mtapi.poll()
+        if batch:
+            self.sock.write(batch)
+        return True
+
+    def compile_raw(self, tokens):
+        """Assemble an MTAPI packet from the tokens of a "raw" command,
+        either a frame in hex or a command name followed by the body in
+        hex.  Returns the MTBuffer, or None after printing an error."""
+        entry = self.find_entry(tokens[0])
+        try:
+            if entry is not None and entry.subsystem is not None:
+                buf = MTBuffer(entry.subsystem, entry.type, entry.command)
+                buf.extend(parse_hex_bytes("".join(tokens[1:])))
+            else:
+                buf = MTBuffer.from_frame(parse_hex_bytes("".join(tokens)))
+        except ParseError as e:
+            print("Error:", e)
+            return None
+        return buf
+
+    def do_raw(self, tokens):
+        "Send a frame given as hex bytes"
+        if not tokens:
+            self.do_help(["raw"])
+            return True
+        buf = self.compile_raw(tokens)
+        if buf is not None:
+            self.send(buf.frame())
+        return True
+
+    def do_output(self, tokens):
+        "Show or set how received packets are displayed"
+        if self.mtapi is None:
+            print("No receiver available")
+            return True
+        if not tokens:
+            print("Output mode:", self.mtapi.display)
+            return True
+        mode = tokens[0].casefold()
+        if len(tokens) > 1 or mode not in DISPLAY_MODES:
+            self.do_help(["output"])
+            return True
+        self.mtapi.display = mode
+        return True
+
+    def do_crawl(self, tokens):
+        "Map the network"
+        if not tokens or len(tokens) > 2:
+            self.do_help(["crawl"])
+            return True
+        window = pipeline.DEFAULT_WINDOW
+        if len(tokens) == 2:
+            try:
+                window = int(tokens[1], 0)
+            except ValueError:
+                window = 0
+            if window < 1:
+                self.do_help(["crawl"])
+                return True
+        if self.mtapi is None:
+            print("Cannot crawl: no receiver available")
+            return True
+        crawler = crawl.Crawler(self.sock, self.mtapi, window)
+        start = time.monotonic()
+        crawler.crawl()
+        try:
+            crawler.save(tokens[0])
+        except OSError as e:
+            print("Unable to write %s: %s" % (tokens[0], e.strerror))
+            return True
+        print("Found %d nodes, %d unreachable, in %.1fs "
+              "(%d requests, %d resent)" %
+              (len(crawler.nodes), len(crawler.unreachable),
+               time.monotonic() - start, crawler.pipeline.sent,
+               crawler.pipeline.resent))
+        return True
+
+    def do_ramdump(self, tokens):
+        "Read device memory into a file"
+        if len(tokens) != 3:
+            self.do_help(["ramdump"])
+            return True
+        try:
+            address = int(tokens[0], 0)
+            length = int(tokens[1], 0)
+        except ValueError:
+            self.do_help(["ramdump"])
+            return True
+        if self.mtapi is None:
+            print("Cannot read memory: no receiver available")
+            return True
+        try:
+            dump = ramdump.RamDump(self.sock, self.mtapi, address, length,
+                                   tokens[2])
+            dump.run()
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        except OSError as e:
+            print("Unable to write %s: %s" % (tokens[2], e.strerror))
+            return True
+        for chunk_address, count in dump.failed:
+            print("Unable to read %d bytes at 0x%04x" %
+                  (count, chunk_address))
+        print("Read %d bytes in %.2fs (%.0f bytes/s, %d requests resent)" %
+              (dump.bytes_read, dump.elapsed, dump.rate(),
+               dump.pipeline.resent))
+        return True
+
+    def do_nvdump(self, tokens):
+        "Save the device's NV items to a file"
+        if not tokens:
+            self.do_help(["nvdump"])
+            return True
+        ids = None
+        if len(tokens) > 1:
+            try:
+                ids = [int(token, 0) for token in tokens[1:]]
+            except ValueError:
+                self.do_help(["nvdump"])
+                return True
+        if self.mtapi is None:
+            print("Cannot read NV: no receiver available")
+            return True
+        dump = nvdump.NvDump(self.sock, self.mtapi, ids)
+        start = time.monotonic()
+        items = dump.run()
+        try:
+            nvdump.save_snapshot(tokens[0], items)
+        except OSError as e:
+            print("Unable to write %s: %s" % (tokens[0], e.strerror))
+            return True
+        for nv_id in dump.failed:
+            print("Unable to read item", nvdump.item_name(nv_id))
+        print("Saved %d items (%d bytes) in %.2fs" %
+              (len(items), sum(len(data) for data in items.values()),
+               time.monotonic() - start))
+        return True
+
+    def do_nvdiff(self, tokens):
+        "Compare two NV snapshots"
+        if len(tokens) != 2:
+            self.do_help(["nvdiff"])
+            return True
+        try:
+            before = nvdump.load_snapshot(tokens[0])
+            after = nvdump.load_snapshot(tokens[1])
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        except OSError as e:
+            print("Unable to read %s: %s" % (e.filename, e.strerror))
+            return True
+        lines = nvdump.diff_snapshots(before, after)
+        for line in lines:
+            print(line)
+        if not lines:
+            print("No differences")
+        return True
+
+    def do_nvrestore(self, tokens):
+        "Write an NV snapshot back to the device"
+        if len(tokens) != 1:
+            self.do_help(["nvrestore"])
+            return True
+        try:
+            items = nvdump.load_snapshot(tokens[0])
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        except OSError as e:
+            print("Unable to read %s: %s" % (tokens[0], e.strerror))
+            return True
+        if self.mtapi is None:
+            print("Cannot restore NV: no receiver available")
+            return True
+        restore = nvdump.NvRestore(self.sock, self.mtapi, items)
+        start = time.monotonic()
+        restore.run()
+        for nv_id in restore.unreadable:
+            print("Unable to read item", nvdump.item_name(nv_id))
+        for nv_id in restore.resized:
+            print("Item %s has changed length, not restored" %
+                  nvdump.item_name(nv_id))
+        for nv_id, offset in restore.failed:
+            if offset is None:
+                print("Unable to create item", nvdump.item_name(nv_id))
+            else:
+                print("Unable to write item %s at offset %d" %
+                      (nvdump.item_name(nv_id), offset))
+        print("Restored %d items in %.2fs: %d unchanged, %d created, "
+              "%d writes (%d bytes)" %
+              (len(items), time.monotonic() - start, restore.unchanged,
+               len(restore.created), restore.writes,
+               restore.bytes_written))
+        return True
+
+    def do_linktest(self, tokens):
+        "Test the serial link"
+        if len(tokens) not in (2, 3):
+            self.do_help(["linktest"])
+            return True
+        try:
+            count = int(tokens[0], 0)
+            size = int(tokens[1], 0)
+            rate = float(tokens[2]) if len(tokens) == 3 else None
+        except ValueError:
+            self.do_help(["linktest"])
+            return True
+        if self.mtapi is None:
+            print("Cannot test the link: no receiver available")
+            return True
+        try:
+            test = linktest.LinkTest(self.sock, self.mtapi, size, rate)
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        test.run(count)
+        for line in test.report():
+            print(line)
+        return True
+
+    def do_aftraffic(self, tokens):
+        "Measure mesh throughput"
+        if len(tokens) < 4:
+            self.do_help(["aftraffic"])
+            return True
+        try:
+            count = int(tokens[0], 0)
+            size = int(tokens[1], 0)
+            rate = float(tokens[2])
+            destinations = [int(token, 16) for token in tokens[3:]]
+        except ValueError:
+            self.do_help(["aftraffic"])
+            return True
+        if self.mtapi is None:
+            print("Cannot send traffic: no receiver available")
+            return True
+        try:
+            traffic = aftraffic.AfTraffic(self.sock, self.mtapi,
+                                          destinations, size,
+                                          rate if rate > 0 else None)
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        traffic.run(count)
+        for line in traffic.report():
+            print(line)
+        return True
+
+    def do_bigsend(self, tokens):
+        "Send a file as one AF message"
+        if not 2 <= len(tokens) <= 3:
+            self.do_help(["bigsend"])
+            return True
+        try:
+            destination = int(tokens[0], 16)
+            cluster = int(tokens[2], 0) if len(tokens) > 2 else 0
+        except ValueError:
+            self.do_help(["bigsend"])
+            return True
+        if self.mtapi is None:
+            print("Cannot send message: no receiver available")
+            return True
+        try:
+            with open(tokens[1], "rb") as f:
+                data = f.read()
+        except OSError as e:
+            print("Unable to read %s: %s" % (tokens[1], e.strerror))
+            return True
+        try:
+            transfer = bigsend.BigSend(self.sock, self.mtapi, destination,
+                                       data, cluster=cluster)
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        status = transfer.run()
+        if status is None:
+            print("Sending %d bytes failed after %d of %d stored" %
+                  (len(data), transfer.stored, len(data)))
+            if transfer.released:
+                print("The incomplete message was sent to free the"
+                      " device's buffer")
+        else:
+            print("Sent %d bytes in %d segments in %.2fs: %s" %
+                  (len(data), transfer.segments, transfer.elapsed,
+                   field_parse_status(bytes((status,)))))
+        return True
+
+    def save_message(self, record, data):
+        "Write the data of an incoming AF message to a file."
+        source = record["SrcAddr"]
+        if not isinstance(source, int):
+            source = 0
+        path = os.path.join(self.bigrecv_dir, "%04x-%08x.bin" %
+                            (source, record["Timestamp"]))
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            print("Unable to write %s: %s" % (path, e.strerror))
+
+    def do_bigrecv(self, tokens):
+        "Save incoming AF messages"
+        if not tokens:
+            if self.reassembler is None:
+                print("Not saving incoming messages")
+            else:
+                print("Saving messages to %s: %d saved, %d retrieved, "
+                      "%d failed" %
+                      (self.bigrecv_dir, self.reassembler.received,
+                       self.reassembler.retrieved,
+                       self.reassembler.failed))
+            return True
+        if len(tokens) != 1:
+            self.do_help(["bigrecv"])
+            return True
+        if tokens[0].casefold() == "off":
+            if self.reassembler is None:
+                print("Not saving incoming messages")
+                return True
+            self.reassembler.stop()
+            print("Saved %d messages to %s" %
+                  (self.reassembler.received, self.bigrecv_dir))
+            self.reassembler = None
+            return True
+        if self.mtapi is None:
+            print("Cannot save messages: no receiver available")
+            return True
+        if not self.interactive:
+            # Nothing calls tick() once a script has finished
+            print("Cannot save messages from a script")
+            return True
+        if self.reassembler is not None:
+            print("Already saving messages to", self.bigrecv_dir)
+            return True
+        if not os.path.isdir(tokens[0]):
+            print("%s is not a directory" % tokens[0])
+            return True
+        self.bigrecv_dir = tokens[0]
+        self.reassembler = bigsend.Reassembler(self.sock, self.mtapi,
+                                               self.save_message)
+        self.reassembler.start()
+        return True
+
+    def do_scan(self, tokens):
+        "Survey the channels"
+        if not 1 <= len(tokens) <= 4:
+            self.do_help(["scan"])
+            return True
+        scan_type = scan.SCAN_TYPES["ed"]
+        channels = scan.ALL_CHANNELS
+        duration = scan.DEFAULT_DURATION
+        try:
+            count = int(tokens[0], 0)
+            if len(tokens) > 1:
+                scan_type = scan.SCAN_TYPES[tokens[1].casefold()]
+            if len(tokens) > 2:
+                channels = scan.parse_channels(tokens[2])
+            if len(tokens) > 3:
+                duration = int(tokens[3], 0)
+        except (KeyError, ValueError):
+            self.do_help(["scan"])
+            return True
+        if count < 1 or not 0 <= duration <= 14:
+            self.do_help(["scan"])
+            return True
+        if self.mtapi is None:
+            print("Cannot scan: no receiver available")
+            return True
+        scanner = scan.Scanner(self.sock, self.mtapi, scan_type, channels,
+                               duration)
+        summary = scanner.run(count)
+        for line in summary.table():
+            print(line)
+        print("%d sweeps, %d failed" % (summary.sweeps, scanner.failed))
+        return True
+
+    def resolver(self, action):
+        """Return an AddressResolver, or None after saying that `action`
+        cannot be done without one."""
+        if self.mtapi is None:
+            print("Cannot %s: no receiver available" % action)
+            return None
+        if self.addresses is None:
+            print("Cannot %s: no address cache" % action)
+            return None
+        return addrcache.AddressResolver(self.sock, self.mtapi,
+                                         self.addresses)
+
+    def do_nwkaddr_of(self, tokens):
+        "Find a device's network address"
+        if len(tokens) != 1:
+            self.do_help(["nwkaddr-of"])
+            return True
+        try:
+            ieee = addrcache.parse_ieee(tokens[0])
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        resolver = self.resolver("look up addresses")
+        if resolver is None:
+            return True
+        nwk, source = resolver.nwk_of(ieee)
+        if nwk is None:
+            print("Unable to find", addrcache.format_ieee(ieee))
+        else:
+            print("%s is %04x (from %s)" %
+                  (addrcache.format_ieee(ieee), nwk, source))
+        return True
+
+    def do_ieeeaddr_of(self, tokens):
+        "Find a device's IEEE address"
+        if len(tokens) != 1:
+            self.do_help(["ieeeaddr-of"])
+            return True
+        try:
+            nwk = int(tokens[0], 16)
+        except ValueError:
+            nwk = -1
+        if not 0 <= nwk < addrcache.NWK_ADDR_INVALID:
+            self.do_help(["ieeeaddr-of"])
+            return True
+        resolver = self.resolver("look up addresses")
+        if resolver is None:
+            return True
+        ieee, source = resolver.ieee_of(nwk)
+        if ieee is None:
+            print("Unable to find %04x" % nwk)
+        else:
+            print("%04x is %s (from %s)" %
+                  (nwk, addrcache.format_ieee(ieee), source))
+        return True
+
+    def do_debuglog(self, tokens):
+        "Show the device's debug messages"
+        if len(tokens) > 1:
+            self.do_help(["debuglog"])
+            return True
+        if self.debug_log is None:
+            print("No debug log is being kept")
+            return True
+        if tokens and tokens[0].casefold() in ("on", "off"):
+            self.debug_log.echo = tokens[0].casefold() == "on"
+            return True
+        if tokens and tokens[0].casefold() == "clear":
+            self.debug_log.clear()
+            return True
+        count = DEBUG_HISTORY
+        if tokens:
+            try:
+                count = int(tokens[0], 0)
+            except ValueError:
+                self.do_help(["debuglog"])
+                return True
+        for entry in self.debug_log.history(count):
+            print(entry)
+        print("%d messages received, %d in the log" %
+              (self.debug_log.received, len(self.debug_log)))
+        return True
+
+    def do_capture(self, tokens):
+        "Keep the packets received for querying"
+        command = tokens[0].casefold() if tokens else None
+        if command == "on" and len(tokens) <= 2:
+            return self.start_capture(tokens[1:])
+        if command == "group" and 2 <= len(tokens) <= 4:
+            return self.group_capture(*tokens[1:])
+        if len(tokens) > 1 or command not in (None, "off", "clear"):
+            self.do_help(["capture"])
+            return True
+        if self.frame_store is None:
+            print("No packets are being kept")
+            return True
+        if command == "off":
+            if self.mtapi in self.frame_store.attached:
+                self.frame_store.detach(self.mtapi)
+            return True
+        if command == "clear":
+            self.frame_store.clear()
+            return True
+        print("%d packets received, %d kept" %
+              (self.frame_store.added, len(self.frame_store)))
+        return True
+
+    def start_capture(self, tokens):
+        """Start keeping the packets received in a FrameStore, which
+        holds the number of frames in `tokens` if one is given."""
+        if self.mtapi is None:
+            print("No packets are being received")
+            return True
+        capacity = framestore.FRAME_CAPACITY
+        if tokens:
+            try:
+                capacity = int(tokens[0], 0)
+            except ValueError:
+                capacity = 0
+            if capacity <= 0:
+                self.do_help(["capture"])
+                return True
+        store = self.frame_store
+        if store is not None and store.capacity != capacity:
+            if self.mtapi in store.attached:
+                store.detach(self.mtapi)
+            store = None
+        if store is None:
+            store = self.frame_store = framestore.FrameStore(capacity)
+        if self.mtapi not in store.attached:
+            store.attach(self.mtapi)
+        return True
+
+    def group_capture(self, key, value=None, command=None):
+        """Show the packets kept grouped by their values in the column
+        `key`, summarising column `value` of `command` packets."""
+        if self.frame_store is None:
+            print("No packets are being kept")
+            return True
+        store = self.frame_store
+        names = { name.casefold(): name for name in store.arrays() }
+        try:
+            key = names[key.casefold()]
+            if value is not None:
+                value = names[value.casefold()]
+        except KeyError as e:
+            print("Unknown column", e.args[0])
+            return True
+        groups = store.group(key, value, command=command)
+        for group_key, group in sorted(groups.items()):
+            if key == "command":
+                found = find_command(group_key >> 8, group_key & 0xff)
+                label = "%04x" % group_key if found is None else found.name
+            elif key == "device":
+                label = str(store.device_name(group_key))
+            elif key in store.columns:
+                label = "0x%04x" % group_key
+            else:
+                label = str(group_key)
+            if value is None:
+                print("%s: %d" % (label, group.count))
+            else:
+                print("%s: %d, mean %.2f, min %s, max %s" %
+                      (label, group.count, group.mean(), group.minimum,
+                       group.maximum))
+        print("%d groups" % len(groups))
+        return True
+
+    def do_status(self, tokens):
+        "Show the device's state"
+        if tokens:
+            self.do_help(["status"])
+            return True
+        if self.device is None:
+            print("The device's state is not being followed")
+            return True
+        for line in self.device.report():
+            print(line)
+        return True
+
+    def do_waitstate(self, tokens):
+        "Wait for the device to reach a state"
+        if not 1 <= len(tokens) <= 2:
+            self.do_help(["waitstate"])
+            return True
+        try:
+            state = devstate.parse_state(tokens[0])
+            timeout = float(tokens[1]) if len(tokens) > 1 else \
+                      WAIT_STATE_TIMEOUT
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        if self.device is None or self.mtapi is None:
+            print("The device's state is not being followed")
+            return True
+        if self.device.wait_for(self.mtapi, state, timeout):
+            print("Device is", devstate.state_name(state))
+        else:
+            print("Timed out waiting for the device to be",
+                  devstate.state_name(state))
+        return True
+
+    def do_zdiags(self, tokens):
+        "Poll diagnostic statistics"
+        if not tokens:
+            if self.poller is None:
+                print("Not polling statistics")
+            else:
+                print("Polling %d attributes into %s: %d rounds, "
+                      "%d samples, %d missed, %d late" %
+                      (len(self.poller.attributes), self.poller.path,
+                       self.poller.rounds, self.poller.samples,
+                       self.poller.missed, self.poller.late))
+            return True
+        if tokens == ["stop"]:
+            if self.poller is None:
+                print("Not polling statistics")
+                return True
+            self.poller.stop()
+            print("Wrote %d samples to %s" %
+                  (self.poller.samples, self.poller.path))
+            self.poller = None
+            return True
+        if len(tokens) < 2:
+            self.do_help(["zdiags"])
+            return True
+        try:
+            interval = float(tokens[1])
+        except ValueError:
+            self.do_help(["zdiags"])
+            return True
+        if self.mtapi is None:
+            print("Cannot poll statistics: no receiver available")
+            return True
+        if not self.interactive:
+            # Nothing calls tick() once a script has finished
+            print("Cannot poll statistics from a script")
+            return True
+        if self.poller is not None:
+            print("Already polling statistics into", self.poller.path)
+            return True
+        try:
+            attributes = None
+            if len(tokens) > 2:
+                attributes = [zdiags.attribute_id(token)
+                              for token in tokens[2:]]
+            poller = zdiags.ZDiagsPoller(self.sock, self.mtapi, tokens[0],
+                                         interval, attributes)
+            poller.start()
+        except ValueError as e:
+            print("Error:", e)
+            return True
+        except OSError as e:
+            print("Unable to write %s: %s" % (tokens[0], e.strerror))
+            return True
+        self.poller = poller
+        return True
@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+
+# linktest.py
+#
+# Measuring the performance of the serial link with UTIL_LOOPBACK
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import time
+from mtcmds import MTBuffer
+import stats
+
+
+# The largest payload a loopback frame can carry, the most the
+# device's MTAPI buffers hold
+LOOPBACK_MAX = 250
+
+# Seconds to wait for each echo before counting the frame as lost
+LOOPBACK_TIMEOUT = 1.0
+
+# Bytes of a frame besides its payload: SOF, header and FCS
+FRAME_OVERHEAD = 5
+
+
+class LinkTest:
+    """Sends UTIL_LOOPBACK frames with random payloads of `size` bytes
+    and checks that each SRSP echoes the payload exactly.  Frames are
+    sent one at a time, each as soon as the previous one is answered
+    or, if `rate` is given, at that many frames per second.  The first
+    two bytes of each payload (if it is that big) are a sequence
+    number, so that a late echo of an earlier frame is not mistaken
+    for a corrupt echo of the current one."""
+    def __init__(self, sock, mtapi, size, rate=None,
+                 timeout=LOOPBACK_TIMEOUT):
+        """Create a link test sending to the serial comms socket `sock`
+        and receiving through the MTAPI receiver `mtapi`.  Raises a
+        ValueError if `size` or `rate` is out of range."""
+        if not 0 <= size <= LOOPBACK_MAX:
+            raise ValueError("Payload size must be from 0 to %d bytes" %
+                             LOOPBACK_MAX)
+        if rate is not None and rate <= 0:
+            raise ValueError("Rate must be positive")
+        self.sock = sock
+        self.mtapi = mtapi
+        self.size = size
+        self.rate = rate
+        self.timeout = timeout
+        self.expected = None
+        self.echo = None
+        self.sent = 0
+        self.ok = 0
+        self.corrupt = 0
+        self.lost = 0
+        self.late = 0
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def payload(self, sequence):
+        "Return the payload for frame number `sequence`."
+        header = (sequence & 0xffff).to_bytes(2, "little")[:self.size]
+        return header + os.urandom(self.size - len(header))
+
+    def listener(self, type_name, subsystem_name, cmd, data):
+        "Catch the echo of the frame being waited for."
+        if (type_name, subsystem_name, cmd) != ("SRSP", "UTIL", 0x10):
+            return
+        if self.expected is None:
+            self.late += 1
+        elif len(data) >= 2 and data[:2] != self.expected[:2]:
+            self.late += 1
+        else:
+            self.echo = data
+
+    def run(self, count):
+        "Send `count` frames and collect the results."
+        self.mtapi.add_listener(self.listener)
+        start = time.monotonic()
+        try:
+            for sequence in range(count):
+                if self.rate is not None:
+                    due = start + sequence / self.rate
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        self.mtapi.run_until(lambda: False, wait)
+                self.exchange(sequence)
+        finally:
+            self.expected = None
+            self.mtapi.remove_listener(self.listener)
+        self.elapsed = time.monotonic() - start
+
+    def exchange(self, sequence):
+        "Send one frame and wait for its echo."
+        payload = self.payload(sequence)
+        buf = MTBuffer("UTIL", "SREQ", "UTIL_LOOPBACK")
+        buf.extend(payload)
+        frame = buf.frame()
+        self.expected = payload
+        self.echo = None
+        sent_at = time.perf_counter()
+        self.sock.write(frame)
+        self.sent += 1
+        if not self.mtapi.run_until(lambda: self.echo is not None,
+                                    self.timeout):
+            self.lost += 1
+        elif self.echo != payload:
+            self.corrupt += 1
+        else:
+            self.latencies.append(time.perf_counter() - sent_at)
+            self.ok += 1
+        self.expected = None
+
+    def error_rate(self):
+        "Return the fraction of frames sent that were not echoed intact."
+        if self.sent == 0:
+            return 0.0
+        return (self.corrupt + self.lost) / self.sent
+
+    def throughput(self):
+        """Return the payload bytes per second echoed intact, and the
+        bytes per second of those frames on the wire in both directions
+        together."""
+        if self.elapsed <= 0:
+            return 0.0, 0.0
+        payload = self.ok * self.size
+        wire = 2 * self.ok * (self.size + FRAME_OVERHEAD)
+        return payload / self.elapsed, wire / self.elapsed
+
+    def report(self):
+        "Return the results as a list of lines of text."
+        lines = ["Sent %d frames of %d bytes in %.2fs: %d ok, %d corrupt, "
+                 "%d lost (%.2f%% errors)" %
+                 (self.sent, self.size, self.elapsed, self.ok,
+                  self.corrupt, self.lost, 100 * self.error_rate())]
+        if self.late:
+            lines.append("%d late or unexpected echoes ignored" %
+                         self.late)
+        summary = stats.summarise(self.latencies)
+        if summary:
+            lines.append("Round trip (ms): " +
+                         ", ".join("%s %.2f" % (name, 1000 * value)
+                                   for name, value in summary))
+        payload, wire = self.throughput()
+        lines.append("Throughput: %.0f payload bytes/s each way, "
+                     "%.0f bytes/s on the wire" % (payload, wire))
+        return lines
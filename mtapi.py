@@ -22,7 +22,10 @@
 # limitations under the License.
 
 
+import struct
 import sys
+from array import array
+from contextlib import contextmanager
 
 class ParseError(Exception):
     "Generic exception class for MTConsole."
@@ -83,6 +86,16 @@ class MTAPISubsystem:
         return cls.STRING.index(name)
 
 
+def calculate_fcs(data):
+    """Calculate the MTAPI Frame Check Sequence of `data`, the XOR of
+    all the bytes presented.  For a complete frame `data` should start
+    at the length byte, i.e. exclude the Start Of Frame byte."""
+    fcs = 0
+    for b in data:
+        fcs ^= b
+    return fcs
+
+
 class MTAPICmd:
     """Class encapsulating the description of MTAPI commands.  Class
     instances encapsulate individual commands, and the command is parsed
@@ -104,6 +117,22 @@ class MTAPICmd:
         the offset into the data at which parsing stops."""
         return parse_generic(self.fields, data)
 
+    def decode(self, data):
+        """Decode the data into the fields of the command without
+        printing anything, returning a dictionary of field values keyed
+        by field name.  Raises an mtapi.ParseError if the data does not
+        fit the command exactly."""
+        record, offset = decode_generic(self.fields, data)
+        if offset != len(data):
+            raise ParseError("Unparsed data in " + self.name)
+        return record
+
+    def encode(self, record):
+        """Return the body of the command with the field values in the
+        dictionary `record`, laid out as decode() expects.  Fields that
+        are missing from `record` are zero or empty."""
+        return bytes(encode_generic(self.fields, record))
+
     def parse_tokens(self, tokens, buf):
         """Parse the textual token stream into binary, and insert it
         into the byte buffer passed in.  Returns True if the token
@@ -166,6 +195,34 @@ class ParseField:
                         " ".join("0x%02x" % b for b in byte_range))
         return offset + self.length
 
+    def decode(self, data, offset, record):
+        """Extract the field from `offset` bytes into `data` into the
+        dictionary `record`, returning the offset of the next field.
+        Fields of up to eight bytes are stored as little endian
+        integers, longer fields as bytes.  An mtapi.ParseError is raised
+        if the field is missing."""
+        end = offset + self.length
+        if len(data) < end:
+            raise ParseError("Field %s missing" % self.name)
+        if self.length <= 8:
+            record[self.name] = int.from_bytes(data[offset:end], "little")
+        else:
+            record[self.name] = bytes(data[offset:end])
+        return end
+
+    def encode(self, record, out):
+        """Append the field's value in the dictionary `record` to the
+        bytearray `out`, as decode() would have extracted it.  A missing
+        value is taken to be zero."""
+        value = record.get(self.name, 0)
+        if isinstance(value, int):
+            out += value.to_bytes(self.length, "little")
+        elif len(value) == self.length:
+            out += value
+        else:
+            raise ParseError("Field %s must be %d bytes long" %
+                             (self.name, self.length))
+
     def parse_token(self, token, buf):
         """Parses the tokenised input stream of text into binary, and
         stores it in the MTBuffer provided.  Returns True on success,
@@ -173,7 +230,7 @@ class ParseField:
         try:
             value = int(token, 0)
         except ValueError:
-            if self.parser is None:
+            if not hasattr(self.parser, "parse_token"):
                 return False
             try:
                 value = self.parser.parse_token(token)
@@ -212,19 +269,38 @@ class ParseClusterList:
             raise ParseError("Field %s missing" % self.name)
         count = data[offset]
         print(" " * (2*indent+1), self.name, ":", count)
-        clusters = []
         offset += 1
         if len(data) < offset + 2*count:
             raise ParseError("Field %s missing or short" % self.list_name)
-        while count > 0:
-            cluster = data[offset] | (data[offset+1] << 8)
-            clusters.append(cluster)
-            offset += 2
-            count -= 1
+        clusters = read_hwords(data, offset, count)
+        offset += 2*count
         print_field(indent, self.list_name,
                     ", ".join("%04x" % cluster for cluster in clusters))
         return offset
 
+    def decode(self, data, offset, record):
+        """Extract the count and the list of two-byte values into the
+        dictionary `record`, returning the offset of the next field."""
+        if len(data) <= offset:
+            raise ParseError("Field %s missing" % self.name)
+        count = data[offset]
+        offset += 1
+        end = offset + 2*count
+        if len(data) < end:
+            raise ParseError("Field %s missing or short" % self.list_name)
+        record[self.name] = count
+        record[self.list_name] = read_hwords(data, offset, count)
+        return end
+
+    def encode(self, record, out):
+        """Append the list of two-byte values in the dictionary `record`
+        to the bytearray `out`, preceded by their count.  A missing list
+        is taken to be empty."""
+        values = record.get(self.list_name, [])
+        out.append(len(values))
+        for value in values:
+            out += value.to_bytes(2, "little")
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -271,7 +347,56 @@ class ParseVariable:
                                            offset+count+self.len_bytes]))
         return offset + count + self.len_bytes
 
-    # TODO: field_info() and parse_tokens()
+    def decode(self, data, offset, record):
+        """Extract the length and the bytes of data into the dictionary
+        `record`, returning the offset of the next field."""
+        start = offset + self.len_bytes
+        if len(data) < start:
+            raise ParseError("Field %s missing or short" % self.name)
+        count = int.from_bytes(data[offset:start], "little")
+        if self.limit is not None and count > self.limit:
+            raise ParseError("Variable field %s exceeds limit (%d > %d)" %
+                             (self.name, count, self.limit))
+        if len(data) < start + count:
+            raise ParseError("Field %s missing or short" % self.data_name)
+        record[self.name] = count
+        record[self.data_name] = bytes(data[start:start+count])
+        return start + count
+
+    def encode(self, record, out):
+        """Append the bytes of data in the dictionary `record` to the
+        bytearray `out`, preceded by their length.  Missing data is
+        taken to be empty."""
+        data = record.get(self.data_name, b'')
+        out += len(data).to_bytes(self.len_bytes, "little")
+        out += data
+
+    def field_info(self):
+        """Get the list of (field name, byte length, parser function)
+        triplets for help information.  Only the data field is typed
+        in; the length field is calculated from it."""
+        return [(self.data_name, None, None)]
+
+    def parse_token(self, token, buf):
+        """Parses a token of hexadecimal byte values into the length
+        and data fields, and stores them in the MTBuffer provided.
+        Returns True on success, False on failure."""
+        try:
+            data = parse_hex_bytes(token)
+        except ParseError:
+            return False
+        count = len(data)
+        if self.limit is not None and count > self.limit:
+            return False
+        if count >= 1 << (8*self.len_bytes):
+            return False
+        try:
+            for i in range(self.len_bytes):
+                buf.append((count >> (8*i)) & 0xff)
+            buf.extend(data)
+        except ParseError:
+            return False
+        return True
 
 
 class ParseExtData:
@@ -314,6 +439,34 @@ class ParseExtData:
                              for d in data[offset+2: offset+count+2]))
         return offset + count + 2
 
+    def decode(self, data, offset, record):
+        """Extract the length and the bytes of data into the dictionary
+        `record`, returning the offset of the next field.  The data is
+        None if it was too long to be included."""
+        if len(data) <= offset + 1:
+            raise ParseError("Field %s is missing or short" % self.name)
+        count = (data[offset+1] << 8) | data[offset]
+        record[self.name] = count
+        if count > self.limit:
+            record[self.data_name] = None
+            return offset + 2
+        if len(data) < offset + 2 + count:
+            raise ParseError("Field %s is missing or short" %
+                             self.data_name)
+        record[self.data_name] = bytes(data[offset+2:offset+count+2])
+        return offset + count + 2
+
+    def encode(self, record, out):
+        """Append the length and bytes of data in the dictionary `record`
+        to the bytearray `out`.  The data is left out if the length is
+        over the limit, so the length may be given without the data.
+        Missing data is taken to be empty."""
+        data = record.get(self.data_name) or b''
+        count = record.get(self.name, len(data))
+        out += count.to_bytes(2, "little")
+        if count <= self.limit:
+            out += data
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -333,6 +486,15 @@ class ParseRemaining:
                     " ".join("%02x" % d for d in data[offset:]))
         return len(data)
 
+    def decode(self, data, offset, record):
+        "Extract all the remaining bytes into the dictionary `record`."
+        record[self.name] = bytes(data[offset:])
+        return len(data)
+
+    def encode(self, record, out):
+        "Append the bytes in the dictionary `record` to the bytearray `out`."
+        out += record.get(self.name, b'')
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -364,13 +526,11 @@ class ParseAddress:
         if mode == 3:
             print_field(indent, self.name, "64-bit")
             print_field(indent, self.addr_name,
-                        ":".join("%02x" % b
-                                 for b in data[offset+8:offset:-1]))
+                        field_parse_ieee_addr(data[offset+1:offset+9]))
         elif mode == 2:
             print_field(indent, self.name, "16-bit")
             print_field(indent, self.addr_name,
-                        "%04x" % (data[offset+1] |
-                                  (data[offset+2] << 8)))
+                        field_parse_nwk_addr(data[offset+1:offset+3]))
         elif mode == 1:
             print_field(indent, self.name, "Group address")
             print_field(indent, self.addr_name,
@@ -390,6 +550,43 @@ class ParseAddress:
                                  for b in data[offset+1:offset+9]))
         return offset + 9
 
+    def decode(self, data, offset, record):
+        """Extract the address mode and address into the dictionary
+        `record`, returning the offset of the next field.  The address
+        is an integer, or None if the mode says it is not present, or
+        the raw bytes if the mode is not recognised."""
+        if len(data) < offset + 9:
+            raise ParseError("Field %s is missing or short" %
+                             self.addr_name)
+        mode = data[offset]
+        record[self.name] = mode
+        if mode == 3:
+            address = int.from_bytes(data[offset+1:offset+9], "little")
+        elif mode in (1, 2, 0xff):
+            address = data[offset+1] | (data[offset+2] << 8)
+        elif mode == 0:
+            address = None
+        else:
+            address = bytes(data[offset+1:offset+9])
+        record[self.addr_name] = address
+        return offset + 9
+
+    def encode(self, record, out):
+        """Append the address mode and address in the dictionary `record`
+        to the bytearray `out`, padded to eight bytes.  A missing mode
+        is taken to be zero, for no address."""
+        mode = record.get(self.name, 0)
+        address = record.get(self.addr_name)
+        out.append(mode)
+        if isinstance(address, (bytes, bytearray)):
+            out += address
+        elif mode == 3:
+            out += address.to_bytes(8, "little")
+        elif mode in (1, 2, 0xff):
+            out += address.to_bytes(2, "little") + bytes(6)
+        else:
+            out += bytes(8)
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -465,6 +662,49 @@ class ParseBindAddress:
         raise ParseError("Invalid field %s (%02x)" % (self.name,
                                                       data[offset]))
 
+    def decode(self, data, offset, record):
+        """Extract the address mode, address and endpoint into the
+        dictionary `record`, returning the offset of the next field.
+        Only the fields present for the address mode are stored."""
+        if len(data) <= offset:
+            raise ParseError("Field %s is missing" % self.name)
+        mode = data[offset]
+        if mode == 0:
+            record[self.name] = mode
+            return offset + 1
+        if mode in (1, 2, 0xff):
+            if len(data) < offset + 3:
+                raise ParseError("Field %s is missing or short" %
+                                 self.addr_name)
+            record[self.name] = mode
+            record[self.addr_name] = data[offset+1] | (data[offset+2] << 8)
+            return offset + 3
+        if mode == 3:
+            if len(data) < offset + 9:
+                raise ParseError("Field %s is missing or short" %
+                                 self.addr_name)
+            if len(data) == offset + 9:
+                raise ParseError("Field %s is missing" % self.ep_name)
+            record[self.name] = mode
+            record[self.addr_name] = int.from_bytes(data[offset+1:offset+9],
+                                                    "little")
+            record[self.ep_name] = data[offset+9]
+            return offset + 10
+        raise ParseError("Invalid field %s (%02x)" % (self.name, mode))
+
+    def encode(self, record, out):
+        """Append the address mode, address and endpoint in the
+        dictionary `record` to the bytearray `out`, as many of them as
+        the mode requires.  A missing mode is taken to be zero, for no
+        address."""
+        mode = record.get(self.name, 0)
+        out.append(mode)
+        if mode in (1, 2, 0xff):
+            out += record[self.addr_name].to_bytes(2, "little")
+        elif mode == 3:
+            out += record[self.addr_name].to_bytes(8, "little")
+            out.append(record[self.ep_name])
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -506,6 +746,45 @@ class ParseInterPan:
         print_field(indent, "Endpoint", "0x%02x" % data[offset+3])
         return offset + 4
 
+    def decode(self, data, offset, record):
+        """Extract the command and its parameters into the dictionary
+        `record`, returning the offset of the next field."""
+        if len(data) <= offset:
+            raise ParseError("Field Command is missing")
+        command = data[offset]
+        if command == 0:
+            record["Command"] = command
+            return offset + 1
+        if command in (1, 2):
+            if len(data) == offset + 1:
+                raise ParseError("Field %s is missing" %
+                                 ("Channel", "Endpoint")[command-1])
+            record["Command"] = command
+            record[("Channel", "Endpoint")[command-1]] = data[offset+1]
+            return offset + 2
+        if command != 3:
+            raise ParseError("Unknown InterPan command 0x%02x" % command)
+        if len(data) <= offset + 2:
+            raise ParseError("Field PanId is missing or short")
+        if len(data) == offset + 3:
+            raise ParseError("Field Endpoint is missing")
+        record["Command"] = command
+        record["PanId"] = data[offset+1] | (data[offset+2] << 8)
+        record["Endpoint"] = data[offset+3]
+        return offset + 4
+
+    def encode(self, record, out):
+        """Append the command and its parameters in the dictionary
+        `record` to the bytearray `out`.  A missing command is taken to
+        be zero, which has no parameters."""
+        command = record.get("Command", 0)
+        out.append(command)
+        if command in (1, 2):
+            out.append(record[("Channel", "Endpoint")[command-1]])
+        elif command == 3:
+            out += record["PanId"].to_bytes(2, "little")
+            out.append(record["Endpoint"])
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -538,6 +817,11 @@ class BitField:
         print_field(indent, self.name,
                     "%02x" % ((byte & self.mask) >> self.shift))
 
+    def decode(self, byte, record):
+        """Extract the bitfield from the integer `byte` into the
+        dictionary `record`, shifted down to start at bit 0."""
+        record[self.name] = (byte & self.mask) >> self.shift
+
     # TODO: field_info() and parse_tokens() ?
 
 
@@ -569,6 +853,25 @@ class ParseBitFields:
             f.parse(byte, indent+1)
         return offset + 1
 
+    def decode(self, data, offset, record):
+        """Extract each of the bitfields of the byte at `offset` bytes
+        into `data` into the dictionary `record`, keyed by their own
+        names, returning the offset of the next field."""
+        if len(data) <= offset:
+            raise ParseError("Field %s is missing" % self.name)
+        byte = data[offset]
+        for f in self.fields:
+            f.decode(byte, record)
+        return offset + 1
+
+    def encode(self, record, out):
+        """Append the byte made up of the bitfields in the dictionary
+        `record` to the bytearray `out`.  Missing bitfields are zero."""
+        byte = 0
+        for f in self.fields:
+            byte |= (record.get(f.name, 0) << f.shift) & f.mask
+        out.append(byte)
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -583,25 +886,80 @@ class ParseRepeated:
         self.count_name = count_name
         self.field_name = field_name
         self.fields = fields
+        self.entry_length = fixed_length(fields)
+        self.layout = entry_layout(fields)
 
     def parse(self, data, offset, indent=0):
         """Extracts the repetition count from `offset` bytes into the
         `data` bytestream, then calls parse_generic() to parse each
         field in the `fields` sequence, calling as many times as
-        indicated by the count."""
-        if len(data) <= offset:
-            raise ParseError("Field %s is missing" % self.count_name)
-        count = data[offset]
+        indicated by the count.  The repetitions are parsed in place
+        rather than from copies of the rest of the data."""
+        count = self.read_count(data, offset)
         print_field(indent, self.count_name, count)
         print_field(indent, self.field_name, "")
-        offset +=1
-        while count > 0:
-            import sys
-            field_len = parse_generic(self.fields, data[offset:], indent+1)
-            offset += field_len
-            count -= 1
+        offset += 1
+        for _ in range(count):
+            offset = parse_generic(self.fields, data, indent+1, offset)
+        return offset
+
+    def decode(self, data, offset, record):
+        """Extract the repetition count and a list of dictionaries, one
+        for each repetition of the fields, into the dictionary
+        `record`.  Returns the offset of the next field."""
+        count = self.read_count(data, offset)
+        offset += 1
+        if self.layout is not None:
+            entries, offset = self.unpack(data, offset, count)
+        else:
+            entries = []
+            for _ in range(count):
+                entry, offset = decode_generic(self.fields, data, offset)
+                entries.append(entry)
+        record[self.count_name] = count
+        record[self.field_name] = entries
         return offset
 
+    def unpack(self, data, offset, count):
+        """Decode `count` entries made up only of simple fields from
+        `offset` bytes into `data` all at once, rather than a field at
+        a time.  Returns the list of entries and the offset after them.
+        """
+        layout, names, bitfields = self.layout
+        end = offset + count * layout.size
+        entries = []
+        for values in layout.iter_unpack(memoryview(data)[offset:end]):
+            entry = dict(zip(names, values))
+            for name, fields in bitfields:
+                byte = entry.pop(name)
+                for f in fields:
+                    entry[f.name] = (byte & f.mask) >> f.shift
+            entries.append(entry)
+        return entries, end
+
+    def read_count(self, data, offset):
+        """Return the repetition count at `offset` bytes into `data`.
+        If the repeated fields have a fixed length, an mtapi.ParseError
+        is raised at once if there is not room for all of them, so that
+        a bad count is caught before any of the fields are looked at."""
+        if len(data) <= offset:
+            raise ParseError("Field %s is missing" % self.count_name)
+        count = data[offset]
+        if (self.entry_length is not None and
+                len(data) < offset + 1 + count * self.entry_length):
+            raise ParseError("Field %s is missing or short" %
+                             self.field_name)
+        return count
+
+    def encode(self, record, out):
+        """Append the repetitions of the fields listed in the dictionary
+        `record` to the bytearray `out`, preceded by their count.  A
+        missing list is taken to be empty."""
+        entries = record.get(self.field_name, [])
+        out.append(len(entries))
+        for entry in entries:
+            encode_generic(self.fields, entry, out)
+
     # TODO: field_info() and parse_tokens()
 
 class ParseKey:
@@ -664,6 +1022,27 @@ class ParseKey:
         print_field(indent, self.index_name, "%02x" % data[offset+10])
         return offset + 11
 
+    def decode(self, data, offset, record):
+        """Extract the key fields into the dictionary `record`,
+        returning the offset of the next field.  The source is kept as
+        bytes in stream order."""
+        if len(data) < offset + 11:
+            raise ParseError("Fields %s to %s are missing or short" %
+                             (self.source_name, self.index_name))
+        record[self.source_name] = bytes(data[offset:offset+8])
+        record[self.security_name] = data[offset+8]
+        record[self.id_mode_name] = data[offset+9]
+        record[self.index_name] = data[offset+10]
+        return offset + 11
+
+    def encode(self, record, out):
+        """Append the key fields in the dictionary `record` to the
+        bytearray `out`.  Missing fields are zero."""
+        out += record.get(self.source_name, bytes(8))
+        out.append(record.get(self.security_name, 0))
+        out.append(record.get(self.id_mode_name, 0))
+        out.append(record.get(self.index_name, 0))
+
     # TODO: field_info() and parse_tokens()
 
 
@@ -706,20 +1085,133 @@ class ParseTime:
                     extract_little_endian(data[offset+9:offset+11]))
         return offset + 11
 
+    def decode(self, data, offset, record):
+        """Extract the time fields into the dictionary `record`,
+        returning the offset of the next field."""
+        if len(data) < offset + 11:
+            raise ParseError("Time fields are missing or short")
+        record["UTCTime"] = extract_little_endian(data[offset:offset+4])
+        for i, name in enumerate(("Hour", "Minute", "Second",
+                                  "Month", "Day")):
+            record[name] = data[offset+4+i]
+        record["Year"] = extract_little_endian(data[offset+9:offset+11])
+        return offset + 11
+
+    def encode(self, record, out):
+        """Append the time fields in the dictionary `record` to the
+        bytearray `out`.  Missing fields are zero."""
+        out += record.get("UTCTime", 0).to_bytes(4, "little")
+        for name in ("Hour", "Minute", "Second", "Month", "Day"):
+            out.append(record.get(name, 0))
+        out += record.get("Year", 0).to_bytes(2, "little")
+
     # TODO: field_info() and parse_tokens()
 
 
-def parse_generic(fields, data, indent=0):
-    "Recurse through the sequence `fields`, parsing the data into them."
-    offset = 0
+def parse_generic(fields, data, indent=0, offset=0):
+    """Recurse through the sequence `fields`, parsing the data from
+    `offset` bytes in into them.  Returns the offset at which parsing
+    stopped."""
     for field in fields:
         offset = field.parse(data, offset, indent)
     return offset
 
 
+def fixed_length(fields):
+    """Return the number of bytes the sequence `fields` always takes
+    up, or None if that depends on the data."""
+    total = 0
+    for field in fields:
+        if isinstance(field, ParseField):
+            total += field.length
+        elif isinstance(field, ParseBitFields):
+            total += 1
+        elif isinstance(field, ParseAddress):
+            total += 9
+        elif isinstance(field, (ParseKey, ParseTime)):
+            total += 11
+        else:
+            return None
+    return total
+
+
+def entry_layout(fields):
+    """Return how to decode the sequence `fields` with a single struct,
+    as a (struct.Struct, field names, bitfields) triple, or None if it
+    has fields other than integers of 1, 2, 4 or 8 bytes, byte strings
+    of more than 8 bytes and bitfields.  The bitfields are a list of
+    (name, BitFields) pairs for the bytes to be split up after
+    unpacking."""
+    codes = { 1: "B", 2: "H", 4: "I", 8: "Q" }
+    layout = "<"
+    names = []
+    bitfields = []
+    for field in fields:
+        if isinstance(field, ParseField):
+            if field.length in codes:
+                layout += codes[field.length]
+            elif field.length > 8:
+                layout += "%ds" % field.length
+            else:
+                return None
+        elif isinstance(field, ParseBitFields):
+            layout += "B"
+            bitfields.append((field.name, field.fields))
+        else:
+            return None
+        names.append(field.name)
+    # Later fields overwrite earlier ones of the same name when decoded
+    # one at a time, which unpacking does not copy
+    all_names = names + [f.name for _, bits in bitfields for f in bits]
+    if len(set(all_names)) != len(all_names):
+        return None
+    return struct.Struct(layout), names, bitfields
+
+
+def read_hwords(data, offset, count):
+    """Return the list of `count` two-byte little endian values from
+    `offset` bytes into `data`, converted all at once."""
+    values = array("H", data[offset:offset + 2*count])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tolist()
+
+
+def decode_generic(fields, data, offset=0):
+    """Decode the data into the sequence `fields`, returning a
+    dictionary of the field values and the offset at which decoding
+    stopped."""
+    record = {}
+    for field in fields:
+        offset = field.decode(data, offset, record)
+    return record, offset
+
+
+def encode_generic(fields, record, out=None):
+    """Encode the field values in the dictionary `record` into the
+    sequence `fields`, the reverse of decode_generic().  The bytes are
+    appended to the bytearray `out`, or a new one, which is returned.
+    """
+    if out is None:
+        out = bytearray()
+    for field in fields:
+        field.encode(record, out)
+    return out
+
+
 # Helper routines for parsing field types into strings
 
 
+def parse_hex_bytes(token):
+    """Converts a token of two digit hexadecimal byte values into
+    bytes.  The values may be run together or separated by colons, so
+    "0102ff" and "01:02:ff" are equivalent.  Raises an mtapi.ParseError
+    if the token is not in that form."""
+    try:
+        return bytes.fromhex(token.replace(":", " "))
+    except ValueError:
+        raise ParseError("Value '%s' is not a list of bytes" % token)
+
 def extract_little_endian(data):
     "Converts the bytes of `data` into an integer, little endian."
     value = 0
@@ -762,12 +1254,72 @@ class FieldParseInteger:
 field_parse_hword = FieldParseInteger(2)
 field_parse_word = FieldParseInteger(4)
 
+class FieldParseNwkAddr(FieldParseInteger):
+    """Parse bytes as a 16-bit network address.  If `resolver` is not
+    None, it is called with the address as an integer and may return
+    a description of the device (such as its IEEE address) to show
+    after the address, or None.  The resolver is only set while a
+    receiver that has one displays a packet; see resolving()."""
+    def __init__(self):
+        super().__init__(2)
+        self.resolver = None
+
+    def __call__(self, data, as_decimal=False):
+        text = super().__call__(data, as_decimal)
+        if self.resolver is not None:
+            note = self.resolver(extract_little_endian(data[:2]))
+            if note is not None:
+                text += " (%s)" % note
+        return text
+
+field_parse_nwk_addr = FieldParseNwkAddr()
+
 def field_parse_colon_sep(data):
     """Reverse the order of the bytes presented and return them as
     two digit hexadecimal numbers with no leading '0x', separated by
     colons.  This is largely intended for IEEE MAC addresses."""
     return ":".join("%02x" % d for d in data[-1::-1])
 
+class FieldParseIeeeAddr:
+    """Parse bytes as an IEEE address, rendered as for
+    field_parse_colon_sep().  If `resolver` is not None, it is called
+    with the address as an integer and may return a description of the
+    device (such as its network address) to show after the address, or
+    None.  As for network addresses, it is set by resolving()."""
+    def __init__(self):
+        self.resolver = None
+
+    def __call__(self, data):
+        text = field_parse_colon_sep(data[:8])
+        if self.resolver is not None:
+            note = self.resolver(extract_little_endian(data[:8]))
+            if note is not None:
+                text += " (%s)" % note
+        return text
+
+    def helper(self, field_name):
+        """Called by UI Handler's help routing to output information
+        on the expected text values."""
+        print("Value '%s' is a 64-bit number" % field_name)
+
+field_parse_ieee_addr = FieldParseIeeeAddr()
+
+@contextmanager
+def resolving(resolvers):
+    """Within the with statement, annotate the addresses displayed as
+    `resolvers` says: a dictionary of resolver functions indexed by the
+    field parser (such as field_parse_nwk_addr) they are for.  The
+    resolvers in force before are restored afterwards, so that each
+    MTAPI receiver's resolvers apply only to the packets it displays."""
+    saved = [(parser, parser.resolver) for parser in resolvers]
+    try:
+        for parser, resolver in resolvers.items():
+            parser.resolver = resolver
+        yield
+    finally:
+        for parser, resolver in saved:
+            parser.resolver = resolver
+
 def field_parse_scan_channels(data):
     """Interpret a four byte little-endian integer as a bitfield of
     channel numbers, and print the result as a comma-separated list of
@@ -22,7 +22,10 @@
 # limitations under the License.
 
 
+import selectors
+import time
 from mtapi import *
+from events import EventBus
 
 
 # Some common field parsers to reduce the proliferation of objects
@@ -30,16 +33,16 @@ PARSE_ENDPOINT = ParseField("Endpoint", 1)
 PARSE_DST_EP = ParseField("DstEndpoint", 1)
 PARSE_SRC_EP = ParseField("SrcEndpoint", 1)
 
-PARSE_DST_ADDR = ParseField("DstAddr", 2, field_parse_hword)
-PARSE_SRC_ADDR = ParseField("SrcAddr", 2, field_parse_hword)
+PARSE_DST_ADDR = ParseField("DstAddr", 2, field_parse_nwk_addr)
+PARSE_SRC_ADDR = ParseField("SrcAddr", 2, field_parse_nwk_addr)
 PARSE_ASSOC_ADDR = ParseField("AssocShortAddress", 2,
-                              field_parse_hword)
-PARSE_DEV_ADDR = ParseField("DeviceAddr", 2, field_parse_hword)
-PARSE_NWK_ADDR = ParseField("NwkAddr", 2, field_parse_hword)
-PARSE_SHORT_ADDR = ParseField("ShortAddr", 2, field_parse_hword)
+                              field_parse_nwk_addr)
+PARSE_DEV_ADDR = ParseField("DeviceAddr", 2, field_parse_nwk_addr)
+PARSE_NWK_ADDR = ParseField("NwkAddr", 2, field_parse_nwk_addr)
+PARSE_SHORT_ADDR = ParseField("ShortAddr", 2, field_parse_nwk_addr)
 PARSE_INTEREST_ADDR = ParseField("NwkAddrOfInterest", 2,
-                                 field_parse_hword)
-PARSE_PARENT_ADDR = ParseField("ParentAddr", 2, field_parse_hword)
+                                 field_parse_nwk_addr)
+PARSE_PARENT_ADDR = ParseField("ParentAddr", 2, field_parse_nwk_addr)
 
 PARSE_ADDR_MODE = ParseField("AddrMode", 1, field_parse_address_mode)
 PARSE_DST_MODE = ParseField("DstAddrMode", 1,
@@ -55,14 +58,14 @@ PARSE_MODED_COORD_ADDR = ParseAddress("CoordAddressMode",
 PARSE_MODED_DEV_ADDR = ParseAddress("DeviceAddressMode",
                                     "DeviceAddress")
 
-PARSE_EXT_ADDR = ParseField("ExtAddr", 8, field_parse_colon_sep)
+PARSE_EXT_ADDR = ParseField("ExtAddr", 8, field_parse_ieee_addr)
 PARSE_DEV_EXT_ADDR = ParseField("DeviceExtAddr", 8,
-                                field_parse_colon_sep)
+                                field_parse_ieee_addr)
 PARSE_SRC_EXT_ADDR = ParseField("SrcExtAddr", 8,
-                                field_parse_colon_sep)
+                                field_parse_ieee_addr)
 PARSE_DST_EXT_ADDR = ParseField("DstExtAddr", 8,
-                                field_parse_colon_sep)
-PARSE_IEEE_ADDR = ParseField("IEEEAddr", 8, field_parse_colon_sep)
+                                field_parse_ieee_addr)
+PARSE_IEEE_ADDR = ParseField("IEEEAddr", 8, field_parse_ieee_addr)
 
 PARSE_PAN_ID = ParseField("PanId", 2, field_parse_hword)
 PARSE_DST_PAN_ID = ParseField("DstPanId", 2, field_parse_hword)
@@ -248,7 +251,7 @@ MT_AF_AREQ_CMDS = {
                      PARSE_SECURITY_USE,
                      PARSE_TIMESTAMP,
                      ParseField("TransSeqNumber", 1),
-                     PARSE_DATA])
+                     ParseExtData("Length", "Data", 223)])
 }
 
 MT_APP_SREQ_CMDS = {
@@ -1184,7 +1187,7 @@ MT_ZDO_AREQ_CMDS = {
     0xb6: MTAPICmd("ZDO_MGMT_PERMIT_JOIN_RSP",
                    [ PARSE_SRC_ADDR, PARSE_STATUS ]),
     0xc0: MTAPICmd("ZDO_STATE_CHANGE_IND",
-                   [ ParseField("State", 1) ]),
+                   [ ParseField("State", 1, field_parse_device_state) ]),
     0xc1: MTAPICmd("ZDO_END_DEVICE_ANNCE_IND",
                    [ PARSE_SRC_ADDR,
                      PARSE_NWK_ADDR,
@@ -1261,6 +1264,25 @@ MT_COMMANDS = { ("SREQ", "AF"):    MT_AF_SREQ_CMDS,
                 ("AREQ", "ZDO"):   MT_ZDO_AREQ_CMDS
 }
 
+# Index of the commands that can be sent to a device, giving the
+# (subsystem, type) pair for each command name
+MT_REQUESTS = {}
+for (mtype_name, subsystem_name), table in MT_COMMANDS.items():
+    if mtype_name != "SRSP":
+        for command in table.values():
+            MT_REQUESTS[command.name] = (subsystem_name, mtype_name)
+
+# The ways MTAPI can display received packets: fully decoded, as the
+# raw bytes of the frame in hex, or not at all
+DISPLAY_MODES = ("decode", "hex", "none")
+
+
+def find_command(cmd0, cmd1):
+    """Find the MTAPICmd for the packet header bytes `cmd0` and
+    `cmd1`.  Returns None if the command is not known."""
+    key = (str(MTAPIType(cmd0)), str(MTAPISubsystem(cmd0)))
+    return MT_COMMANDS.get(key, {}).get(cmd1)
+
 
 class MTAPI:
     """State machine for managing serial comms reception from a device
@@ -1270,12 +1292,41 @@ class MTAPI:
         to expect a Start Of Frame byte."""
         self.sock = sock
         self.state = self.read_sof
+        self.listeners = []
+        self.events = EventBus(MT_COMMANDS)
+        self.selector = None
+        self.display = "decode"
+        self.malformed = 0
+        # A frame to be displayed in hex once its FCS has been read
+        self.held = None
+        # Functions annotating the addresses this receiver displays,
+        # indexed by field parser, as for mtapi.resolving()
+        self.resolvers = {}
+
+    def add_listener(self, listener):
+        """Register `listener` to be called with every packet received.
+        It is called as `listener(type_name, subsystem_name, cmd, data)`
+        before the packet is parsed, so that listeners see packets
+        even if they are malformed.  A listener that returns True has
+        dealt with the packet itself, and it is not displayed.
+
+        Listeners see every packet, so those only interested in a few
+        kinds of packet should subscribe to them through `events`
+        instead, and be handed them already decoded."""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        "Stop calling `listener` for received packets."
+        self.listeners.remove(listener)
 
     def read_sof(self):
         """State in which the protocol is expecting a start of frame
-        (0xfe) byte."""
+        (0xfe) byte.  If a frame is waiting to be displayed in hex, the
+        byte is its Frame Check Sequence instead."""
         byte = self.sock.read(1)
-        if len(byte) == 1 and byte[0] == 0xfe:
+        if len(byte) == 1 and self.held is not None:
+            self.show_held(byte[0])
+        elif len(byte) == 1 and byte[0] == 0xfe:
             self.state = self.read_len
 
     def read_len(self):
@@ -1283,6 +1334,11 @@ class MTAPI:
         an MTAPI header, the body length.  Will read the rest of the
         header if it is available."""
         byte = self.sock.read(3)
+        # The Frame Check Sequence is not checked, so one that happens
+        # to be 0xfe is taken for a Start Of Frame.  No MTAPI body is
+        # that long, so a length of 0xfe must be the real SOF.
+        while byte[:1] == b'\xfe':
+            byte = byte[1:]
         if len(byte) == 0:
             return
         self.len = byte[0]
@@ -1298,6 +1354,7 @@ class MTAPI:
             byte = self.sock.read(2)
         if len(byte) == 0:
             return
+        self.cmd0 = byte[0]
         self.type = MTAPIType(byte[0])
         self.subsystem = MTAPISubsystem(byte[0])
         self.state = self.read_cmd1
@@ -1335,18 +1392,57 @@ class MTAPI:
             self.state = self.read_sof
             self.execute()
 
+    def frame(self):
+        """Returns the packet read in as a complete MTAPI frame, with
+        the Frame Check Sequence recalculated (the received one is not
+        kept)."""
+        frame = bytearray((0xfe, self.len, self.cmd0, self.cmd))
+        frame += self.data
+        frame.append(calculate_fcs(frame[1:]))
+        return frame
+
+    def show_held(self, fcs):
+        """Display the frame held for display in hex, with `fcs`, the
+        Frame Check Sequence received, marking it if it is wrong."""
+        frame = self.held
+        self.held = None
+        if calculate_fcs(frame[1:]) == fcs:
+            print(frame.hex(" "), "%02x" % fcs)
+        else:
+            print(frame.hex(" "), "%02x (bad FCS)" % fcs)
+
     def execute(self):
         """Parse the MTAPI packet read in, using the packet
         descriptions held in the MT_COMMANDS global variable.  The
-        results are written to stdout."""
-        print(self.type, self.subsystem, "Cmd = %02x" % self.cmd)
+        results are written to stdout in the form given by `display`:
+        decoded, as hex bytes or not at all, unless a listener or an
+        event handler has already dealt with the packet."""
         key = (str(self.type), str(self.subsystem))
+        handled = False
+        for listener in tuple(self.listeners):
+            if listener(key[0], key[1], self.cmd, self.data):
+                handled = True
+        if self.events.publish(key[0], key[1], self.cmd, self.data):
+            handled = True
+        if handled:
+            self.data = None
+            return
+        if self.display != "decode":
+            # Decoding is wasted effort if only the bytes are wanted
+            if self.display == "hex":
+                # Shown once the FCS received has been read, so that a
+                # corrupt frame does not appear to be a good one
+                self.held = self.frame()[:-1]
+            self.data = None
+            return
+        print(self.type, self.subsystem, "Cmd = %02x" % self.cmd)
         if key in MT_COMMANDS:
             command_table = MT_COMMANDS[key]
             if self.cmd in command_table:
                 command = command_table[self.cmd]
                 print(" ", command.name)
-                offset = command(self.data)
+                with resolving(self.resolvers):
+                    offset = command(self.data)
                 if offset != len(self.data):
                     raise ParseError("Unparsed data in " + command.name)
         self.data = None
@@ -1357,6 +1453,53 @@ class MTAPI:
         # Return value is True to continue execution, False to quit
         return True
 
+    def work(self):
+        """Work the state machine, reporting a packet that cannot be
+        parsed rather than letting the error stop the program, since a
+        noisy line can deliver anything.  Returns True, as for calling
+        the receiver."""
+        try:
+            self.state()
+        except ParseError as e:
+            self.malformed += 1
+            print("Error:", e)
+        return True
+
+    def wait_readable(self, timeout):
+        """Wait up to `timeout` seconds for input from the socket.
+        Returns True if there is input to be read."""
+        if self.selector is None:
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.sock, selectors.EVENT_READ)
+        return bool(self.selector.select(timeout))
+
+    def poll(self):
+        """Work the state machine for as long as there is input
+        waiting, without blocking."""
+        while self.wait_readable(0):
+            self.work()
+
+    def run_until(self, done, timeout=None):
+        """Work the state machine until `done()` returns True, or
+        until `timeout` seconds have passed if `timeout` is not None.
+        Returns the final value of `done()`.  This requires a socket
+        that can be used with the selectors module.  The EOFError a
+        socket transport raises when the other end closes the
+        connection is passed on, since nothing more will arrive."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while not done():
+            if deadline is None:
+                wait = None
+            else:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    return done()
+            if self.wait_readable(wait):
+                self.work()
+        return True
+
 
 class MTBuffer:
     """Class for constructing an MTAPI packet to transmit on the
@@ -1383,6 +1526,32 @@ class MTBuffer:
                           MTAPISubsystem.to_number(subsystem_name))
         self.buffer[3] = cmd_code
 
+    @classmethod
+    def from_frame(cls, data):
+        """Create a transmission buffer from `data`, a complete MTAPI
+        frame starting with the Start Of Frame byte.  The Frame Check
+        Sequence may be left off, in which case it is added when the
+        frame is sent; if it is given it must be correct.  The command
+        does not have to be one in MT_COMMANDS, in which case the `cmd`
+        attribute is None.  An mtapi.ParseError is raised if the frame
+        is malformed."""
+        if len(data) < 4 or data[0] != 0xfe:
+            raise ParseError("Frame must start 'fe LEN CMD0 CMD1'")
+        body_length = len(data) - 4
+        if body_length == data[1] + 1:
+            fcs = calculate_fcs(data[1:-1])
+            if data[-1] != fcs:
+                raise ParseError("Frame check sequence is %02x, "
+                                 "should be %02x" % (data[-1], fcs))
+            data = data[:-1]
+        elif body_length != data[1]:
+            raise ParseError("Frame length is %d but body has %d bytes" %
+                             (data[1], body_length))
+        buf = cls.__new__(cls)
+        buf.cmd = find_command(data[2], data[3])
+        buf.buffer = bytearray(data)
+        return buf
+
     def append(self, byte):
         """Adds a single byte to the transmission buffer.  Raises an
         mtapi.ParseError if this causes the buffer to overflow."""
@@ -1394,11 +1563,16 @@ class MTBuffer:
     def extend(self, iterable):
         """Adds a number of bytes to the transmission buffer.  Raises
         an mtapi.ParseError if this cases the buffer to overflow."""
-        if self.buffer[1] + len(iterable) < self.buffer[1]:
+        if self.buffer[1] + len(iterable) > 0xff:
             raise ParseError("MT Buffer body overflow")
         self.buffer[1] += len(iterable)
         self.buffer.extend(iterable)
 
+    def frame(self):
+        """Returns the assembled transmit buffer as a complete MTAPI
+        frame, with the Frame Check Sequence appended."""
+        return bytes(self.buffer) + bytes((calculate_fcs(self.buffer[1:]),))
+
     def send(self, socket):
         "Sends the assembled transmit buffer to the serial socket."
-        socket.write(self.buffer)
+        socket.write(self.frame())
@@ -0,0 +1,411 @@
+#! /usr/bin/env python3
+
+# nvdump.py
+#
+# Snapshots of a device's OSAL NV items: taking, comparing and restoring
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import struct
+from mtcmds import MTBuffer
+from template import FrameTemplate
+import pipeline
+
+
+# The OSAL NV items defined by Z-Stack (the ZCD_NV_xxx constants)
+NV_ITEMS = {
+    0x0001: "EXTADDR",
+    0x0002: "BOOTCOUNTER",
+    0x0003: "STARTUP_OPTION",
+    0x0004: "START_DELAY",
+    0x0021: "NIB",
+    0x0022: "DEVICE_LIST",
+    0x0023: "ADDRMGR",
+    0x0024: "POLL_RATE",
+    0x0025: "QUEUED_POLL_RATE",
+    0x0026: "RESPONSE_POLL_RATE",
+    0x0027: "REJOIN_POLL_RATE",
+    0x0028: "DATA_RETRIES",
+    0x0029: "POLL_FAILURE_RETRIES",
+    0x002a: "STACK_PROFILE",
+    0x002b: "INDIRECT_MSG_TIMEOUT",
+    0x002c: "ROUTE_EXPIRY_TIME",
+    0x002d: "EXTENDED_PAN_ID",
+    0x002e: "BCAST_RETRIES",
+    0x002f: "PASSIVE_ACK_TIMEOUT",
+    0x0030: "BCAST_DELIVERY_TIME",
+    0x0031: "NWK_MODE",
+    0x0032: "CONCENTRATOR_ENABLE",
+    0x0033: "CONCENTRATOR_DISCOVERY",
+    0x0034: "CONCENTRATOR_RADIUS",
+    0x0036: "CONCENTRATOR_RC",
+    0x0037: "NWK_MGR_MODE",
+    0x0038: "SRC_RTG_EXPIRY_TIME",
+    0x0039: "ROUTE_DISCOVERY_TIME",
+    0x003a: "NWK_ACTIVE_KEY_INFO",
+    0x003b: "NWK_ALTERN_KEY_INFO",
+    0x003c: "ROUTER_OFF_ASSOC_CLEANUP",
+    0x003d: "NWK_LEAVE_REQ_ALLOWED",
+    0x003e: "NWK_CHILD_AGE_ENABLE",
+    0x003f: "DEVICE_LIST_KA_TIMEOUT",
+    0x0041: "BINDING_TABLE",
+    0x0042: "GROUP_TABLE",
+    0x0043: "APS_FRAME_RETRIES",
+    0x0044: "APS_ACK_WAIT_DURATION",
+    0x0045: "APS_ACK_WAIT_MULTIPLIER",
+    0x0046: "BINDING_TIME",
+    0x0047: "APS_USE_EXT_PANID",
+    0x0048: "APS_USE_INSECURE_JOIN",
+    0x0049: "COMMISSIONED_NWK_ADDR",
+    0x004b: "APS_NONMEMBER_RADIUS",
+    0x004c: "APS_LINK_KEY_TABLE",
+    0x004d: "APS_DUPREJ_TIMEOUT_INC",
+    0x004e: "APS_DUPREJ_TIMEOUT_COUNT",
+    0x004f: "APS_DUPREJ_TABLE_SIZE",
+    0x0050: "DIAGNOSTIC_STATS",
+    0x0061: "SECURITY_LEVEL",
+    0x0062: "PRECFGKEY",
+    0x0063: "PRECFGKEYS_ENABLE",
+    0x0064: "SECURITY_MODE",
+    0x0065: "SECURE_PERMIT_JOIN",
+    0x0066: "APS_LINK_KEY_TYPE",
+    0x0067: "APS_ALLOW_R19_SECURITY",
+    0x0069: "IMPLICIT_CERTIFICATE",
+    0x006a: "DEVICE_PRIVATE_KEY",
+    0x006b: "CA_PUBLIC_KEY",
+    0x006c: "KE_MAX_DEVICES",
+    0x0070: "USE_DEFAULT_TCLK",
+    0x0072: "RNG_COUNTER",
+    0x0073: "RANDOM_SEED",
+    0x0074: "TRUSTCENTER_ADDR",
+    0x0080: "USERDESC",
+    0x0081: "NWKKEY",
+    0x0082: "PANID",
+    0x0083: "CHANLIST",
+    0x0084: "LEAVE_CTRL",
+    0x0085: "SCAN_DURATION",
+    0x0086: "LOGICAL_TYPE",
+    0x0087: "NWKMGR_MIN_TX",
+    0x0088: "NWKMGR_ADDR",
+    0x008f: "ZDO_DIRECT_CB",
+    0x0090: "SCENE_TABLE",
+    0x0091: "MIN_FREE_NWK_ADDR",
+    0x0092: "MAX_FREE_NWK_ADDR",
+    0x0093: "MIN_FREE_GRP_ID",
+    0x0094: "MAX_FREE_GRP_ID",
+    0x0095: "MIN_GRP_IDS",
+    0x0096: "MAX_GRP_IDS",
+    0x00a1: "SAPI_ENDPOINT",
+    0x00b1: "SAS_SHORT_ADDR",
+    0x00b2: "SAS_EXT_PANID",
+    0x00b3: "SAS_PANID",
+    0x00b4: "SAS_CHANNEL_MASK",
+    0x00b5: "SAS_PROTOCOL_VER",
+    0x00b6: "SAS_STACK_PROFILE",
+    0x00b7: "SAS_STARTUP_CTRL",
+    0x00c1: "SAS_TC_ADDR",
+    0x00c2: "SAS_TC_MASTER_KEY",
+    0x00c3: "SAS_NWK_KEY",
+    0x00c4: "SAS_USE_INSEC_JOIN",
+    0x00c5: "SAS_PRECFG_LINK_KEY",
+    0x00c6: "SAS_NWK_KEY_SEQ_NUM",
+    0x00c7: "SAS_NWK_KEY_TYPE",
+    0x00c8: "SAS_NWK_MGR_ADDR",
+    0x00d1: "SAS_CURR_TC_MASTER_KEY",
+    0x00d2: "SAS_CURR_NWK_KEY",
+    0x00d3: "SAS_CURR_PRECFG_LINK_KEY",
+    0x0101: "TCLK_TABLE_START",
+    0x0201: "APS_LINK_KEY_DATA_START",
+    0x0301: "MASTER_KEY_DATA_START"
+}
+
+# SYS_OSAL_NV_READ has a one byte offset; further into an item
+# SYS_OSAL_NV_READ_EXT must be used
+NV_READ_MAX_OFFSET = 0xff
+
+# When restoring, items are compared in windows of this many bytes,
+# and only the windows that differ are written.  Adjacent windows are
+# written together, up to the most that one SYS_OSAL_NV_WRITE_EXT can
+# carry alongside its ID, offset and length fields.
+NV_RESTORE_WINDOW = 32
+NV_WRITE_MAX = 244
+
+# SYS_OSAL_NV_ITEM_INIT statuses meaning the item already existed
+# (SUCCESS) or has been created (NV_ITEM_UNINIT)
+NV_ITEM_INIT_OK = (0x00, 0x09)
+
+# Snapshot files start with this, followed by a (ID, length, data)
+# record for each item present on the device
+SNAPSHOT_MAGIC = b'MTNV\x01'
+SNAPSHOT_ITEM = struct.Struct("<HH")
+
+
+def item_name(nv_id):
+    "Return a printable name for the NV item `nv_id`."
+    return "0x%04x %s" % (nv_id, NV_ITEMS.get(nv_id, "(unknown)"))
+
+
+class NvDump:
+    """Reads the contents of a set of OSAL NV items.  The lengths of all
+    the items are asked for first, in one batch through a Pipeline;
+    items that exist are then read a window at a time, each window
+    starting where the device's previous reply left off.  Requests for
+    all the items share the pipeline, so the serial link stays busy
+    until the last byte is in."""
+    def __init__(self, sock, mtapi, ids=None,
+                 timeout=pipeline.DEFAULT_TIMEOUT,
+                 retries=pipeline.DEFAULT_RETRIES):
+        """Create an NV reader that sends requests to the serial comms
+        socket `sock` and reads the replies through the MTAPI receiver
+        `mtapi`.  `ids` is the sequence of item IDs to read, by default
+        all the items in NV_ITEMS."""
+        self.pipeline = pipeline.Pipeline(sock, mtapi, timeout=timeout,
+                                          retries=retries)
+        self.length_template = FrameTemplate(
+            "SYS", "SREQ", "SYS_OSAL_NV_LENGTH",
+            ["sys_osal_nv_length", "{}"])
+        self.read_template = FrameTemplate(
+            "SYS", "SREQ", "SYS_OSAL_NV_READ",
+            ["sys_osal_nv_read", "{}", "{}"])
+        self.read_ext_template = FrameTemplate(
+            "SYS", "SREQ", "SYS_OSAL_NV_READ_EXT",
+            ["sys_osal_nv_read_ext", "{}", "{}"])
+        self.ids = sorted(NV_ITEMS) if ids is None else list(ids)
+        self.items = {}
+        self.failed = []
+
+    def run(self):
+        """Read the items.  Returns a dictionary of the contents of
+        each item that exists, keyed by item ID.  The IDs of any items
+        that could not be read are listed in `failed`."""
+        for nv_id in self.ids:
+            self.request_length(nv_id)
+        self.pipeline.run()
+        return self.items
+
+    def request_length(self, nv_id):
+        "Queue the request for the length of item `nv_id`."
+        def received(request, record):
+            if record is None:
+                self.failed.append(nv_id)
+            elif record["ItemLen"] > 0:
+                self.items[nv_id] = bytearray()
+                self.request_read(nv_id, record["ItemLen"])
+        frame = self.length_template.frame(Id=nv_id)
+        self.pipeline.submit(pipeline.Request(frame, callback=received))
+
+    def request_read(self, nv_id, length):
+        """Queue the request for the next window of item `nv_id`, which
+        is `length` bytes long in total."""
+        data = self.items[nv_id]
+        offset = len(data)
+        def received(request, record):
+            if record is None:
+                del self.items[nv_id]
+                self.failed.append(nv_id)
+                return
+            data.extend(record["Data"])
+            if len(data) < length:
+                self.request_read(nv_id, length)
+            else:
+                del data[length:]
+        def match(record):
+            return len(record["Data"]) > 0
+        if offset > NV_READ_MAX_OFFSET:
+            frame = self.read_ext_template.frame(Id=nv_id, Offset=offset)
+        else:
+            frame = self.read_template.frame(Id=nv_id, Offset=offset)
+        self.pipeline.submit(pipeline.Request(frame, None, match,
+                                              received))
+
+
+def save_snapshot(path, items):
+    """Write the dictionary of NV item contents `items` to the snapshot
+    file `path`."""
+    with open(path, "wb") as output:
+        output.write(SNAPSHOT_MAGIC)
+        for nv_id in sorted(items):
+            data = items[nv_id]
+            output.write(SNAPSHOT_ITEM.pack(nv_id, len(data)))
+            output.write(data)
+
+
+def load_snapshot(path):
+    """Read the snapshot file `path`, returning a dictionary of NV item
+    contents keyed by item ID.  Raises a ValueError if the file is not
+    a snapshot."""
+    with open(path, "rb") as snapshot:
+        contents = snapshot.read()
+    if not contents.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("%s is not an NV snapshot" % path)
+    items = {}
+    offset = len(SNAPSHOT_MAGIC)
+    while offset < len(contents):
+        if offset + SNAPSHOT_ITEM.size > len(contents):
+            raise ValueError("%s is truncated" % path)
+        nv_id, length = SNAPSHOT_ITEM.unpack_from(contents, offset)
+        offset += SNAPSHOT_ITEM.size
+        if offset + length > len(contents):
+            raise ValueError("%s is truncated" % path)
+        items[nv_id] = contents[offset:offset+length]
+        offset += length
+    return items
+
+
+def diff_snapshots(before, after):
+    """Compare two dictionaries of NV item contents.  Returns a list of
+    lines describing the differences, item by item in ID order."""
+    lines = []
+    for nv_id in sorted(set(before) | set(after)):
+        if nv_id not in after:
+            lines.append("%s: removed" % item_name(nv_id))
+        elif nv_id not in before:
+            lines.append("%s: added, %d bytes" %
+                         (item_name(nv_id), len(after[nv_id])))
+        elif before[nv_id] != after[nv_id]:
+            old, new = before[nv_id], after[nv_id]
+            first = next((i for i, (a, b) in enumerate(zip(old, new))
+                          if a != b), min(len(old), len(new)))
+            changed = sum(a != b for a, b in zip(old, new))
+            changed += abs(len(old) - len(new))
+            lines.append("%s: %d bytes differ from offset %d "
+                         "(length %d -> %d)" %
+                         (item_name(nv_id), changed, first,
+                          len(old), len(new)))
+    return lines
+
+
+def changed_windows(old, new, window=NV_RESTORE_WINDOW, limit=NV_WRITE_MAX):
+    """Compare the contents `old` and `new` of an item a window of
+    `window` bytes at a time.  Returns a list of (offset, data) pairs
+    covering the windows of `new` that differ from `old`, with runs of
+    adjacent windows merged into writes of up to `limit` bytes.  If
+    `old` is None every window is included."""
+    writes = []
+    for start in range(0, len(new), window):
+        end = min(start + window, len(new))
+        if old is not None and old[start:end] == new[start:end]:
+            continue
+        if writes:
+            offset, data = writes[-1]
+            if (offset + len(data) == start and
+                    len(data) + end - start <= limit):
+                writes[-1] = (offset, data + new[start:end])
+                continue
+        writes.append((start, new[start:end]))
+    return writes
+
+
+def write_frame(nv_id, offset, data):
+    """Return the SYS_OSAL_NV_WRITE frame (or SYS_OSAL_NV_WRITE_EXT if
+    `offset` needs it) writing `data` into item `nv_id` at `offset`."""
+    if offset > NV_READ_MAX_OFFSET:
+        buf = MTBuffer("SYS", "SREQ", "SYS_OSAL_NV_WRITE_EXT")
+        buf.extend(struct.pack("<HH", nv_id, offset))
+    else:
+        buf = MTBuffer("SYS", "SREQ", "SYS_OSAL_NV_WRITE")
+        buf.extend(struct.pack("<HB", nv_id, offset))
+    buf.append(len(data))
+    buf.extend(data)
+    return buf.frame()
+
+
+class NvRestore:
+    """Writes the contents of a snapshot back to a device's OSAL NV
+    items, touching as little flash as possible.  The current contents
+    of the items are read first, and only the windows that differ from
+    the snapshot are written.  Items missing from the device are
+    created.  Items whose length has changed are not written, since
+    OSAL NV items cannot be resized in place."""
+    def __init__(self, sock, mtapi, items,
+                 timeout=pipeline.DEFAULT_TIMEOUT,
+                 retries=pipeline.DEFAULT_RETRIES):
+        """Create a restore of `items`, a dictionary of item contents
+        keyed by item ID such as load_snapshot() returns, that sends
+        requests to the serial comms socket `sock` and reads the
+        replies through the MTAPI receiver `mtapi`."""
+        self.sock = sock
+        self.mtapi = mtapi
+        self.items = items
+        self.timeout = timeout
+        self.retries = retries
+        self.pipeline = pipeline.Pipeline(sock, mtapi, timeout=timeout,
+                                          retries=retries)
+        self.init_template = FrameTemplate(
+            "SYS", "SREQ", "SYS_OSAL_NV_ITEM_INIT",
+            ["sys_osal_nv_item_init", "{}", "{}", ""])
+        self.unreadable = []
+        self.resized = []
+        self.created = []
+        self.unchanged = 0
+        self.writes = 0
+        self.bytes_written = 0
+        self.failed = []
+
+    def run(self):
+        """Restore the items.  Returns True if every item now matches
+        the snapshot.  Otherwise the IDs of items that could not be
+        read or had changed length are listed in `unreadable` and
+        `resized` respectively, and the (ID, offset) pairs of writes
+        that failed in `failed`, with an offset of None for an item
+        that could not be created."""
+        dump = NvDump(self.sock, self.mtapi, sorted(self.items),
+                      self.timeout, self.retries)
+        current = dump.run()
+        self.unreadable = dump.failed
+        for nv_id in sorted(self.items):
+            new = self.items[nv_id]
+            if nv_id in self.unreadable or not new:
+                continue
+            old = current.get(nv_id)
+            if old is None:
+                self.request_init(nv_id, new)
+                continue
+            if len(old) != len(new):
+                self.resized.append(nv_id)
+                continue
+            writes = changed_windows(old, new)
+            if not writes:
+                self.unchanged += 1
+            for offset, data in writes:
+                self.request_write(nv_id, offset, data)
+        self.pipeline.run()
+        return not (self.unreadable or self.resized or self.failed)
+
+    def request_init(self, nv_id, data):
+        """Queue the request creating item `nv_id` to hold `data`, and
+        once the device has created it, the writes filling it in."""
+        def received(request, record):
+            if record is None:
+                self.failed.append((nv_id, None))
+                return
+            self.created.append(nv_id)
+            for offset, chunk in changed_windows(None, data):
+                self.request_write(nv_id, offset, chunk)
+        frame = self.init_template.frame(Id=nv_id, ItemLen=len(data))
+        self.pipeline.submit(pipeline.Request(frame, callback=received,
+                                              statuses=NV_ITEM_INIT_OK))
+
+    def request_write(self, nv_id, offset, data):
+        "Queue the request writing `data` into item `nv_id` at `offset`."
+        def received(request, record):
+            if record is None:
+                self.failed.append((nv_id, offset))
+            else:
+                self.bytes_written += len(data)
+        self.writes += 1
+        self.pipeline.submit(pipeline.Request(
+            write_frame(nv_id, offset, data), callback=received))
@@ -0,0 +1,245 @@
+#! /usr/bin/env python3
+
+# pipeline.py
+#
+# Keeping many MTAPI requests in flight at once
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+from collections import deque
+from mtapi import MTAPIType, MTAPISubsystem, ParseError
+from mtcmds import MT_COMMANDS
+
+
+# Defaults for the number of requests in flight, the seconds to wait
+# for each reply and the number of times to resend a request
+DEFAULT_WINDOW = 8
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_RETRIES = 2
+
+
+def command_key(type_name, subsystem_name, command_name):
+    """Return the (type, subsystem, command) key that MTAPI listeners
+    receive for the named command.  Raises an mtapi.ParseError if the
+    command is not known."""
+    table = MT_COMMANDS.get((type_name, subsystem_name), {})
+    for cmd, command in table.items():
+        if command.name == command_name:
+            return (type_name, subsystem_name, cmd)
+    raise ParseError("Unable to find command " + command_name)
+
+
+class Request:
+    """A request frame and the reply that completes it.  SREQ frames
+    must first receive their SRSP; if that has a Status field, it must
+    be one of `statuses`, by default just zero.  If `reply` is None the
+    SRSP completes the request, otherwise `reply` is the (type,
+    subsystem, command) key of the packet that does, such as an AREQ
+    sent once the device has heard from the network.  If `match` is not
+    None, it is called with each decoded candidate reply and must
+    return True for the reply to be accepted.  An SRSP that completes
+    a request but is not accepted causes the request to be retried.
+
+    When the request completes, `callback` is called with the request
+    and the decoded reply, or with None in place of the reply if the
+    request failed after all its retries."""
+    def __init__(self, frame, reply=None, match=None, callback=None,
+                 statuses=(0,)):
+        self.frame = frame
+        self.reply = reply
+        self.match = match
+        self.callback = callback
+        self.statuses = statuses
+        self.srsp = None
+        if str(MTAPIType(frame[2])) == "SREQ":
+            self.srsp = ("SRSP", str(MTAPISubsystem(frame[2])), frame[3])
+        self.tries = 0
+        self.sent_at = None
+        self.deadline = None
+
+
+class Pipeline:
+    """Sends requests to a device, keeping up to `window` of them
+    waiting for replies at once.  Only one SREQ may be waiting for its
+    SRSP at a time, as the MTAPI protocol requires, but the slower
+    replies that come back from across the network (such as ZDO
+    responses) are waited for in parallel.  Replies are matched to
+    requests in the order the requests were sent, so identical
+    requests with identical replies are resolved first in first out.
+    Requests that get no reply within `timeout` seconds are sent again
+    up to `retries` times before being given up on.  If `rate` is not
+    None, no more than that many requests are sent each second."""
+    def __init__(self, sock, mtapi, window=DEFAULT_WINDOW,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 rate=None):
+        """Create a pipeline that writes to the serial comms socket
+        `sock` and reads replies through the MTAPI receiver `mtapi`."""
+        self.sock = sock
+        self.mtapi = mtapi
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.rate = rate
+        self.next_send = None
+        self.queue = deque()
+        self.sreq = None
+        self.waiting = {}
+        self.in_flight = 0
+        self.progress = False
+        self.sent = 0
+        self.resent = 0
+        self.failed = 0
+
+    def submit(self, request):
+        """Queue `request` to be sent.  Requests may be submitted while
+        the pipeline is running, e.g. from a callback."""
+        self.queue.append(request)
+
+    def send(self, request):
+        "Write `request` to the device and start waiting for its reply."
+        self.sock.write(request.frame)
+        request.tries += 1
+        self.sent += 1
+        request.sent_at = time.monotonic()
+        request.deadline = request.sent_at + self.timeout
+        self.in_flight += 1
+        if request.srsp is not None:
+            self.sreq = request
+        elif request.reply is not None:
+            self.waiting.setdefault(request.reply, []).append(request)
+        else:
+            self.complete(request, {})
+
+    def ready(self):
+        """Return True if the next queued request may be sent as far as
+        the window and the single outstanding SREQ are concerned."""
+        return (self.sreq is None and bool(self.queue) and
+                self.in_flight < self.window)
+
+    def fill(self):
+        "Send queued requests until the window is full."
+        while self.ready():
+            if self.rate is not None:
+                now = time.monotonic()
+                if self.next_send is None:
+                    self.next_send = now
+                elif now < self.next_send:
+                    break
+                # Keep to the rate on average, but do not make up for
+                # a long stall with a burst
+                self.next_send = max(self.next_send, now) + 1 / self.rate
+            self.send(self.queue.popleft())
+
+    def complete(self, request, record):
+        """Finish with `request`, passing the decoded reply `record` (or
+        None on failure) to its callback."""
+        self.in_flight -= 1
+        self.progress = True
+        if record is None:
+            self.failed += 1
+        if request.callback is not None:
+            request.callback(request, record)
+
+    def retry(self, request):
+        """Send `request` again ahead of anything queued, or give up on
+        it if it has no retries left."""
+        if request.tries > self.retries:
+            self.complete(request, None)
+            return
+        self.in_flight -= 1
+        self.progress = True
+        self.resent += 1
+        self.queue.appendleft(request)
+
+    def listener(self, type_name, subsystem_name, cmd, data):
+        "Match packets received against the requests waiting for them."
+        key = (type_name, subsystem_name, cmd)
+        request = self.sreq
+        if request is not None and key == request.srsp:
+            self.sreq = None
+            try:
+                record = MT_COMMANDS[key[:2]][cmd].decode(data)
+            except ParseError:
+                self.retry(request)
+                return
+            if record.get("Status", 0) not in request.statuses:
+                self.retry(request)
+            elif request.reply is None:
+                if request.match is None or request.match(record):
+                    self.complete(request, record)
+                else:
+                    self.retry(request)
+            else:
+                request.deadline = time.monotonic() + self.timeout
+                self.waiting.setdefault(request.reply, []).append(request)
+                self.progress = True
+            return
+        requests = self.waiting.get(key)
+        if not requests:
+            return
+        try:
+            record = MT_COMMANDS[key[:2]][cmd].decode(data)
+        except ParseError:
+            return
+        for i, request in enumerate(requests):
+            if request.match is None or request.match(record):
+                del requests[i]
+                self.complete(request, record)
+                return
+
+    def expire(self):
+        "Retry or give up on any requests that have run out of time."
+        now = time.monotonic()
+        if self.sreq is not None and self.sreq.deadline <= now:
+            request = self.sreq
+            self.sreq = None
+            self.retry(request)
+        for requests in self.waiting.values():
+            expired = [r for r in requests if r.deadline <= now]
+            for request in expired:
+                requests.remove(request)
+                self.retry(request)
+
+    def next_deadline(self):
+        """Return the time by which the next reply is due or the next
+        request may be sent, whichever is sooner, or None."""
+        deadlines = [r.deadline
+                     for requests in self.waiting.values()
+                     for r in requests]
+        if self.sreq is not None:
+            deadlines.append(self.sreq.deadline)
+        if self.rate is not None and self.ready():
+            deadlines.append(self.next_send)
+        return min(deadlines) if deadlines else None
+
+    def run(self):
+        """Send all the requests submitted, including any submitted by
+        callbacks along the way, and wait until every one has been
+        answered or given up on."""
+        self.mtapi.add_listener(self.listener)
+        try:
+            while True:
+                self.fill()
+                deadline = self.next_deadline()
+                if deadline is None:
+                    break
+                self.progress = False
+                self.mtapi.run_until(lambda: self.progress,
+                                     max(deadline - time.monotonic(), 0))
+                self.expire()
+        finally:
+            self.mtapi.remove_listener(self.listener)
@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+
+# ramdump.py
+#
+# Reading blocks of device memory into a file
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import mmap
+import time
+from template import FrameTemplate
+import pipeline
+
+
+# The most bytes a single SYS_RAM_READ can return.  The SRSP body is
+# the Status and Len fields followed by the data, and the device's
+# MTAPI buffers hold at most 250 bytes of body.
+RAM_READ_CHUNK = 248
+
+# SYS_RAM_READ addresses are 16 bits wide
+RAM_READ_LIMIT = 0x10000
+
+
+class RamDump:
+    """Reads `length` bytes of device memory from `address` into the
+    file `path`, using as few SYS_RAM_READ requests as possible.  The
+    file is created at its full size and memory mapped, so that each
+    chunk of data is copied straight into place as its SRSP arrives
+    whatever order the chunks complete in.  Chunks that fail or come
+    back short are retried by the pipeline."""
+    def __init__(self, sock, mtapi, address, length, path,
+                 timeout=pipeline.DEFAULT_TIMEOUT,
+                 retries=pipeline.DEFAULT_RETRIES):
+        """Create the dump, sending requests to the serial comms socket
+        `sock` and reading the replies through the MTAPI receiver
+        `mtapi`.  Raises a ValueError if the memory range cannot be
+        read with SYS_RAM_READ."""
+        if length <= 0 or address < 0 or address + length > RAM_READ_LIMIT:
+            raise ValueError("Range %#x+%#x is outside the readable "
+                             "memory" % (address, length))
+        self.pipeline = pipeline.Pipeline(sock, mtapi, timeout=timeout,
+                                          retries=retries)
+        self.template = FrameTemplate("SYS", "SREQ", "SYS_RAM_READ",
+                                      ["sys_ram_read", "{}", "{}"])
+        self.address = address
+        self.length = length
+        self.path = path
+        self.failed = []
+        self.bytes_read = 0
+        self.elapsed = 0.0
+
+    def run(self):
+        """Read the memory into the file.  Returns True if every byte
+        was read; otherwise the (address, length) pairs of the chunks
+        that could not be read are listed in `failed`, and the file
+        holds zeroes in their place.  Raises an OSError if the file
+        cannot be written."""
+        start = time.monotonic()
+        with open(self.path, "w+b") as output:
+            output.truncate(self.length)
+            with mmap.mmap(output.fileno(), self.length) as buffer:
+                for offset in range(0, self.length, RAM_READ_CHUNK):
+                    self.request(buffer, offset,
+                                 min(RAM_READ_CHUNK, self.length - offset))
+                self.pipeline.run()
+                buffer.flush()
+        self.elapsed = time.monotonic() - start
+        return not self.failed
+
+    def request(self, buffer, offset, count):
+        """Queue the request for the `count` bytes at `offset` into the
+        dump, to be copied into `buffer` when they arrive."""
+        def match(record):
+            return len(record["Data"]) == count
+        def received(request, record):
+            if record is None:
+                self.failed.append((self.address + offset, count))
+            else:
+                buffer[offset:offset+count] = record["Data"]
+                self.bytes_read += count
+        frame = self.template.frame(Address=self.address + offset,
+                                    Len=count)
+        self.pipeline.submit(pipeline.Request(frame, None,
+                                              match, received))
+
+    def rate(self):
+        "Return the average bytes per second read by the last run."
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes_read / self.elapsed
@@ -0,0 +1,206 @@
+#! /usr/bin/env python3
+
+# scan.py
+#
+# Repeated MAC channel scans, summarised per channel and per PAN
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from template import FrameTemplate
+import pipeline
+
+
+# The 2.4GHz channels, and the ScanChannels mask selecting all of them
+CHANNEL_FIRST = 11
+CHANNEL_LAST = 26
+CHANNEL_COUNT = CHANNEL_LAST - CHANNEL_FIRST + 1
+ALL_CHANNELS = 0x07fff800
+
+# The ScanType values of the scans that can be summarised
+SCAN_TYPES = { "ed": 0x00, "active": 0x01, "passive": 0x02 }
+
+# The default ScanDuration, about 0.14s per channel
+DEFAULT_DURATION = 3
+
+# Seconds to allow for a sweep on top of its nominal scan time
+SCAN_MARGIN = 2.0
+
+# A channel scan lasts aBaseSuperframeDuration * (2**n + 1) symbols
+# of 16us for a ScanDuration of n
+SCAN_UNIT = 960 * 16e-6
+
+SCAN_CNF_KEY = ("AREQ", "MAC", 0x8c)
+BEACON_NOTIFY_KEY = ("AREQ", "MAC", 0x83)
+
+
+def channel_list(mask):
+    "Return the 2.4GHz channels selected by the ScanChannels `mask`."
+    return [channel for channel in range(CHANNEL_FIRST, CHANNEL_LAST+1)
+            if mask & (1 << channel)]
+
+
+def parse_channels(token):
+    """Return the ScanChannels mask for `token`, which is "all" or a
+    comma-separated list of channels and ranges such as "11,15-20".
+    Raises a ValueError if it is neither."""
+    if token.casefold() == "all":
+        return ALL_CHANNELS
+    mask = 0
+    for part in token.split(","):
+        first, _, last = part.partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        if not CHANNEL_FIRST <= first <= last <= CHANNEL_LAST:
+            raise ValueError("Channels must be from %d to %d" %
+                             (CHANNEL_FIRST, CHANNEL_LAST))
+        for channel in range(first, last+1):
+            mask |= 1 << channel
+    return mask
+
+
+class ScanSummary:
+    """Accumulates the results of scans in lists indexed by channel,
+    from CHANNEL_FIRST upwards.  Energy detect results are kept as the
+    minimum, maximum and total of the readings for each channel, and
+    beacons heard as counts per channel for each PAN ID."""
+    def __init__(self):
+        self.sweeps = 0
+        self.ed_min = [None] * CHANNEL_COUNT
+        self.ed_max = [None] * CHANNEL_COUNT
+        self.ed_total = [0] * CHANNEL_COUNT
+        self.ed_count = [0] * CHANNEL_COUNT
+        self.beacons = {}
+
+    def add_energy(self, channel, energy):
+        "Add an energy detect reading for `channel`."
+        i = channel - CHANNEL_FIRST
+        if self.ed_count[i] == 0 or energy < self.ed_min[i]:
+            self.ed_min[i] = energy
+        if self.ed_count[i] == 0 or energy > self.ed_max[i]:
+            self.ed_max[i] = energy
+        self.ed_total[i] += energy
+        self.ed_count[i] += 1
+
+    def add_confirm(self, record, channels):
+        """Add the decoded MAC_SCAN_CNF `record` of an energy detect
+        scan of the ScanChannels mask `channels`.  The device reports
+        either one reading for each channel scanned, in channel order,
+        or a reading for every channel number from zero; the length of
+        the result list tells which."""
+        self.sweeps += 1
+        if record["ScanType"] != SCAN_TYPES["ed"]:
+            return
+        results = record["ResultList"]
+        if len(results) > CHANNEL_LAST:
+            for channel in channel_list(channels):
+                self.add_energy(channel, results[channel])
+            return
+        scanned = channel_list(channels & ~record["UnscannedChannelList"])
+        for channel, energy in zip(scanned, results):
+            self.add_energy(channel, energy)
+
+    def add_beacon(self, record):
+        "Add the decoded MAC_BEACON_NOTIFY_IND `record`."
+        channel = record["LogicalChannel"]
+        if not CHANNEL_FIRST <= channel <= CHANNEL_LAST:
+            return
+        counts = self.beacons.setdefault(record["PanId"],
+                                         [0] * CHANNEL_COUNT)
+        counts[channel - CHANNEL_FIRST] += 1
+
+    def table(self):
+        """Return the summary as a list of lines of text: a row for
+        each channel with any results, giving its minimum, mean and
+        maximum energy and the number of beacons heard from each PAN.
+        """
+        pans = sorted(self.beacons)
+        lines = ["Chan  ED min  mean   max" +
+                 "".join("  %04x" % pan for pan in pans)]
+        for i in range(CHANNEL_COUNT):
+            beacons = [self.beacons[pan][i] for pan in pans]
+            if self.ed_count[i] == 0 and not any(beacons):
+                continue
+            if self.ed_count[i] == 0:
+                line = "%4d  %6s %5s %5s" % (CHANNEL_FIRST + i,
+                                             "-", "-", "-")
+            else:
+                line = "%4d  %6d %5.1f %5d" % (
+                    CHANNEL_FIRST + i, self.ed_min[i],
+                    self.ed_total[i] / self.ed_count[i], self.ed_max[i])
+            lines.append(line + "".join("  %4d" % count
+                                        for count in beacons))
+        return lines
+
+
+class Scanner:
+    """Runs MAC_SCAN_REQ sweeps of the channels in the mask `channels`
+    back to back, each starting as soon as the MAC_SCAN_CNF of the
+    previous one arrives, and gathers the decoded results into a
+    ScanSummary.  Beacons are only reported with MAC_BEACON_NOTIFY_IND
+    if the device's ZMAC_AUTO_REQUEST attribute is off."""
+    def __init__(self, sock, mtapi, scan_type=SCAN_TYPES["ed"],
+                 channels=ALL_CHANNELS, duration=DEFAULT_DURATION,
+                 retries=pipeline.DEFAULT_RETRIES):
+        """Create a scanner writing to the serial comms socket `sock`
+        and reading the results through the MTAPI receiver `mtapi`."""
+        timeout = (len(channel_list(channels)) * SCAN_UNIT *
+                   (2 ** duration + 1) + SCAN_MARGIN)
+        self.pipeline = pipeline.Pipeline(sock, mtapi, window=1,
+                                          timeout=timeout,
+                                          retries=retries)
+        self.mtapi = mtapi
+        self.channels = channels
+        # The security key fields are left as zero, for no security
+        self.frame = FrameTemplate.from_record(
+            "MAC", "SREQ", "MAC_SCAN_REQ",
+            dict(ScanChannels=channels, ScanType=scan_type,
+                 ScanDuration=duration, ChannelPage=0,
+                 MaxResults=0xff)).frame()
+        self.summary = ScanSummary()
+        self.remaining = 0
+        self.failed = 0
+
+    def handler(self, key, record):
+        "Count the beacons heard during the scans."
+        self.summary.add_beacon(record)
+
+    def run(self, count):
+        "Run `count` sweeps and return the ScanSummary."
+        self.remaining = count
+        self.mtapi.events.subscribe(self.handler, *BEACON_NOTIFY_KEY)
+        try:
+            if count > 0:
+                self.sweep()
+                self.pipeline.run()
+        finally:
+            self.mtapi.events.unsubscribe(self.handler)
+        return self.summary
+
+    def sweep(self):
+        "Queue the next scan."
+        self.pipeline.submit(pipeline.Request(self.frame, SCAN_CNF_KEY,
+                                              callback=self.received))
+
+    def received(self, request, record):
+        """Add the results of a scan, and start the next one if there
+        are more to do."""
+        if record is None:
+            self.failed += 1
+        else:
+            self.summary.add_confirm(record, self.channels)
+        self.remaining -= 1
+        if self.remaining > 0:
+            self.sweep()
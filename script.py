@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+
+# script.py
+#
+# Running files of console commands without user interaction
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import namedtuple
+from tokenizer import tokenize
+
+
+# A single line of a script.  MTAPI commands are assembled into a
+# complete `frame` when the script is loaded; `response` is then the
+# (type, subsystem, command) key of the reply to wait for, if any.
+# Other commands have a `frame` of None and are executed by the UI
+# Handler from their `tokens` when the script is run.
+ScriptStep = namedtuple("ScriptStep",
+                        "line_number, tokens, frame, response")
+
+# Seconds to wait for each SRSP before giving up on the script
+RESPONSE_TIMEOUT = 2.0
+
+
+class ScriptRunner:
+    """Runs a file of console commands, as typed to the UIHandler.
+    The file is loaded and parsed in its entirety before anything is
+    sent, so that a mistake late in a file does not leave a device
+    half configured, and so that transmission is never held up by
+    parsing.  Commands are then sent as fast as the serial link will
+    take them, optionally waiting for the response to each SREQ."""
+    def __init__(self, ui, timeout=RESPONSE_TIMEOUT):
+        """Create a script runner that uses the UIHandler `ui` to
+        parse and execute commands.  `timeout` is the time in seconds
+        to wait for each response when running in waiting mode."""
+        self.ui = ui
+        self.timeout = timeout
+        self.path = None
+        self.steps = []
+        self.expected = None
+        self.answered = False
+
+    def load(self, path):
+        """Read and parse the script file `path`.  Errors are reported
+        with the line they were found on.  Returns True if the whole
+        file was parsed successfully, False otherwise."""
+        self.path = path
+        self.steps = []
+        ok = True
+        with open(path) as script_file:
+            for number, line in enumerate(script_file, 1):
+                if not self.load_line(number, line):
+                    print("Error in %s line %d" % (path, number))
+                    ok = False
+        return ok
+
+    def load_line(self, number, line):
+        """Parse a single `line` of a script, line number `number`,
+        adding a step for it if necessary.  Returns False if the line
+        could not be parsed."""
+        try:
+            tokens = tokenize(line, comments=True)
+        except ValueError as e:
+            print(e)
+            return False
+        if not tokens:
+            return True
+        found = self.ui.lookup(tokens[0])
+        if found is None:
+            return False
+        cmd, entry = found
+        if entry.subsystem is None:
+            self.steps.append(ScriptStep(number, tokens, None, None))
+            return True
+        buf = self.ui.compile(cmd, entry, tokens)
+        if buf is None:
+            return False
+        response = None
+        if entry.type == "SREQ":
+            response = ("SRSP", entry.subsystem, buf.buffer[3])
+        self.steps.append(ScriptStep(number, tokens, buf.frame(), response))
+        return True
+
+    def listener(self, type_name, subsystem_name, cmd, data):
+        "Watch received packets for the response we are waiting for."
+        if (type_name, subsystem_name, cmd) == self.expected:
+            self.answered = True
+
+    def run(self, wait=False):
+        """Run the loaded script.  If `wait` is True, each SREQ must
+        receive its SRSP before the next command is sent; if it does
+        not arrive in time the script is abandoned.  Returns False if
+        the script asks for the program to exit, True otherwise."""
+        mtapi = self.ui.mtapi
+        if wait:
+            mtapi.add_listener(self.listener)
+        try:
+            for step in self.steps:
+                if step.frame is None:
+                    if not self.ui.execute(step.tokens):
+                        return False
+                    continue
+                self.ui.send(step.frame)
+                if wait and step.response is not None:
+                    self.expected = step.response
+                    self.answered = False
+                    if not mtapi.run_until(lambda: self.answered,
+                                           self.timeout):
+                        print("No response to line %d of %s, stopping" %
+                              (step.line_number, self.path))
+                        return True
+                elif mtapi is not None:
+                    mtapi.poll()
+        finally:
+            self.expected = None
+            if wait:
+                mtapi.remove_listener(self.listener)
+        return True
@@ -0,0 +1,346 @@
+#! /usr/bin/env python3
+
+# server.py
+#
+# Sharing the device's serial port with other programs over sockets
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import errno
+import os
+import selectors
+import socket
+import stat
+import time
+from collections import deque
+from functools import partial
+from mtapi import calculate_fcs
+from transport import socket_address
+
+
+# Frames queued for a client before further frames for it are dropped
+CLIENT_QUEUE_LIMIT = 256
+
+# Seconds to wait for the SRSP to a client's SREQ before sending the
+# next client's
+SRSP_TIMEOUT = 2.0
+
+# Bytes to read from a client at once
+CLIENT_READ_SIZE = 4096
+
+# The first byte of a client's filter message, in place of the Start
+# Of Frame byte of an MTAPI frame
+FILTER_SOF = 0xfd
+
+# The type bits of an MTAPI frame's Cmd0 byte
+TYPE_MASK = 0xe0
+TYPE_SREQ = 0x20
+TYPE_SRSP = 0x60
+
+
+def listen(address):
+    """Return a socket listening for clients at `address`, which is
+    either "unix:PATH" or "tcp:[HOST:]PORT".  TCP sockets listen on the
+    loopback interface unless a host is given.  Raises a ValueError if
+    the address is not in either form, or an OSError if it cannot be
+    listened on, including when the path of a Unix socket is taken by
+    something other than a socket."""
+    address = socket_address(address)
+    if address is None:
+        raise ValueError("Address must be unix:PATH or tcp:[HOST:]PORT")
+    family, where = address
+    if family == socket.AF_UNIX and os.path.lexists(where):
+        # Only replace a socket left behind by an earlier server
+        if not stat.S_ISSOCK(os.lstat(where).st_mode):
+            raise FileExistsError(errno.EEXIST, "Not a socket", where)
+        os.unlink(where)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(where)
+    sock.listen()
+    sock.setblocking(False)
+    return sock
+
+
+class Client:
+    """A program connected to the server.  Frames for the client wait
+    in a queue of at most `limit` frames; a frame arriving when the
+    queue is full is dropped rather than holding up everyone else.
+    The frames queued are the very bytes objects the server received,
+    shared between all the clients they go to, and a partly sent frame
+    is kept as a memoryview of the rest.
+
+    Until the client sends a filter, it receives every frame.  A filter
+    message is the byte FILTER_SOF, a length byte, and then a triple of
+    bytes (Cmd0, Cmd1, mask) for each kind of frame wanted: frames with
+    that Cmd0 whose Cmd1 matches in the bits set in the mask.  A mask
+    of zero selects all the commands of a subsystem and type, and an
+    empty filter selects nothing."""
+    def __init__(self, server, sock, limit=CLIENT_QUEUE_LIMIT):
+        self.server = server
+        self.sock = sock
+        self.limit = limit
+        self.queue = deque()
+        self.partial = None
+        self.writing = False
+        self.filters = None
+        self.input = bytearray()
+        self.dropped = 0
+        self.rejected = 0
+        self.closed = False
+
+    def wants(self, cmd0, cmd1):
+        "Return True if the frame (`cmd0`, `cmd1`) passes the filter."
+        if self.filters is None:
+            return True
+        for want0, want1, mask in self.filters:
+            if cmd0 == want0 and (cmd1 ^ want1) & mask == 0:
+                return True
+        return False
+
+    def enqueue(self, frame, force=False):
+        """Queue `frame` to be sent to the client, unless the queue is
+        full and `force` is False."""
+        if self.closed:
+            return
+        if len(self.queue) >= self.limit and not force:
+            self.dropped += 1
+            return
+        self.queue.append(frame)
+        self.flush()
+
+    def flush(self):
+        """Send as much of the queue as the socket will take without
+        blocking, and only wait to write to it while there is more."""
+        try:
+            while self.partial is not None or self.queue:
+                if self.partial is None:
+                    self.partial = memoryview(self.queue.popleft())
+                sent = self.sock.send(self.partial)
+                if sent < len(self.partial):
+                    self.partial = self.partial[sent:]
+                    break
+                self.partial = None
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.server.remove_client(self)
+            return
+        waiting = self.partial is not None
+        if waiting != self.writing:
+            self.writing = waiting
+            self.server.watch(self)
+
+    def __call__(self):
+        """Read whatever the client has sent and send it whatever is
+        waiting.  Returns True, for the console's main loop."""
+        try:
+            data = self.sock.recv(CLIENT_READ_SIZE)
+        except BlockingIOError:
+            data = None
+        except OSError:
+            data = b''
+        if data == b'':
+            self.server.remove_client(self)
+            return True
+        if data:
+            self.input += data
+            self.parse()
+        self.flush()
+        return True
+
+    def parse(self):
+        "Act on every complete message the client has sent."
+        data = self.input
+        start = 0
+        while start < len(data):
+            if data[start] not in (0xfe, FILTER_SOF):
+                # Skip rubbish until something that could be a message
+                start += 1
+                continue
+            if len(data) < start + 2:
+                break
+            length = data[start+1]
+            if data[start] == FILTER_SOF:
+                end = start + 2 + length
+                if len(data) < end:
+                    break
+                self.set_filter(data[start+2:end])
+            else:
+                end = start + length + 5
+                if len(data) < end:
+                    break
+                frame = bytes(data[start:end])
+                if calculate_fcs(frame[1:-1]) != frame[-1]:
+                    self.rejected += 1
+                else:
+                    self.server.submit(self, frame)
+            start = end
+        del data[:start]
+
+    def set_filter(self, data):
+        "Replace the client's filter with the triples in `data`."
+        if len(data) % 3 != 0:
+            self.rejected += 1
+            return
+        self.filters = [tuple(data[i:i+3]) for i in range(0, len(data), 3)]
+
+    def close(self):
+        "Disconnect the client."
+        self.closed = True
+        self.queue.clear()
+        self.partial = None
+        self.sock.close()
+
+
+class MTServer:
+    """Lets any number of programs share the device through sockets,
+    alongside the console itself.  Clients send and receive complete
+    MTAPI frames.  Every frame the device sends goes to each client
+    whose filter wants it, except that the SRSP to a client's SREQ
+    goes to that client alone.  AREQs from clients go straight to the
+    device, but SREQs are queued and sent one at a time, each after the
+    previous one has been answered or has timed out, since the device
+    only deals with one at a time and its SRSPs must be told apart.
+
+    The server does not block.  Its sockets are registered with
+    `selector`, the console's main loop selector, with callables as
+    their data that the main loop calls when they are ready; `tick()`
+    must be called whenever `wait_time()` says there is work to do."""
+    def __init__(self, serial, receiver, selector,
+                 limit=CLIENT_QUEUE_LIMIT, timeout=SRSP_TIMEOUT):
+        """Create a server sharing the serial port `serial`, read
+        through the MTAPI receiver `receiver`."""
+        self.serial = serial
+        self.receiver = receiver
+        self.selector = selector
+        self.limit = limit
+        self.timeout = timeout
+        self.listening = []
+        self.clients = []
+        self.pending = deque()
+        self.owner = None
+        self.deadline = None
+        receiver.add_listener(self.listener)
+
+    def listen(self, address):
+        """Start accepting clients at `address`, as for listen().  Raises
+        a ValueError or OSError if that is not possible."""
+        sock = listen(address)
+        self.listening.append(sock)
+        self.selector.register(sock, selectors.EVENT_READ,
+                               partial(self.accept, sock))
+
+    def accept(self, sock):
+        "Accept a client connecting to `sock`."
+        try:
+            client_sock, _ = sock.accept()
+        except BlockingIOError:
+            return True
+        self.add_client(client_sock)
+        return True
+
+    def add_client(self, sock):
+        "Start serving the client connected to `sock`."
+        sock.setblocking(False)
+        client = Client(self, sock, self.limit)
+        self.clients.append(client)
+        self.selector.register(sock, selectors.EVENT_READ, client)
+        return client
+
+    def watch(self, client):
+        "Wait for `client` to be writable only when it has data waiting."
+        events = selectors.EVENT_READ
+        if client.writing:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(client.sock, events, client)
+
+    def remove_client(self, client):
+        "Stop serving `client` and disconnect it."
+        if client.closed:
+            return
+        self.selector.unregister(client.sock)
+        self.clients.remove(client)
+        self.pending = deque((c, f) for c, f in self.pending
+                             if c is not client)
+        client.close()
+
+    def submit(self, client, frame):
+        """Send `frame` from `client` to the device, or queue it if it
+        is an SREQ and another is waiting for its SRSP."""
+        if frame[2] & TYPE_MASK != TYPE_SREQ:
+            self.serial.write(frame)
+            return
+        self.pending.append((client, frame))
+        self.send_next()
+
+    def send_next(self):
+        "Send the next SREQ queued if none is outstanding."
+        if self.owner is not None or not self.pending:
+            return
+        client, frame = self.pending.popleft()
+        self.owner = (client, frame[2] & 0x1f, frame[3])
+        self.deadline = time.monotonic() + self.timeout
+        self.serial.write(frame)
+
+    def listener(self, type_name, subsystem_name, cmd, data):
+        """Pass the frame received to the clients that want it.  The
+        frame is still displayed by the console as usual."""
+        if not self.clients and self.owner is None:
+            return False
+        frame = bytes(self.receiver.frame())
+        cmd0 = frame[2]
+        if (self.owner is not None and cmd0 & TYPE_MASK == TYPE_SRSP and
+                self.owner[1:] == (cmd0 & 0x1f, cmd)):
+            self.owner[0].enqueue(frame, force=True)
+            self.owner = None
+            self.send_next()
+            return False
+        # Sending may drop a client that has gone away
+        for client in tuple(self.clients):
+            if client.wants(cmd0, cmd):
+                client.enqueue(frame)
+        return False
+
+    def wait_time(self):
+        """Return the seconds until `tick()` next has anything to do, or
+        None if no SREQ is outstanding."""
+        if self.owner is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def tick(self):
+        "Give up on an SREQ whose SRSP is overdue, and send the next."
+        if self.owner is not None and self.deadline <= time.monotonic():
+            self.owner = None
+            self.send_next()
+
+    def close(self):
+        "Disconnect every client and stop listening."
+        for client in list(self.clients):
+            self.remove_client(client)
+        for sock in self.listening:
+            self.selector.unregister(sock)
+            if sock.family == socket.AF_UNIX:
+                try:
+                    os.unlink(sock.getsockname())
+                except FileNotFoundError:
+                    pass
+            sock.close()
+        self.listening = []
+        if self.listener in self.receiver.listeners:
+            self.receiver.remove_listener(self.listener)
@@ -0,0 +1,375 @@
+#! /usr/bin/env python3
+
+# simulator.py
+#
+# A simulated MTAPI device for testing without hardware
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+import heapq
+import math
+import selectors
+import sys
+import time
+from mtapi import MTAPIType, MTAPISubsystem, ParseError, calculate_fcs
+from mtcmds import MTAPI, MT_COMMANDS
+from api import find_key
+import server
+import transport
+
+
+# Bits sent on a serial line for each byte, with its start and stop bits
+BITS_PER_BYTE = 10
+
+# The simulated device's IEEE address
+SIM_IEEE_ADDR = 0x00124b0001020304
+
+# The values of SRSP fields that are not all zero on a real device,
+# by the name of the SREQ.  Fields with the same name as a field of
+# the SREQ take its value, as with endpoints and addresses.
+RESPONSES = {
+    "SYS_PING": { "Capabilities": 0x0179 },
+    "SYS_VERSION": { "TransportRev": 2, "ProductId": 0, "MajorRel": 2,
+                     "MinorRel": 6, "MaintRel": 3 },
+    "UTIL_GET_DEVICE_INFO": { "IEEEAddr": SIM_IEEE_ADDR, "ShortAddr": 0,
+                              "DeviceType": 0x01, "DeviceState": 0x09 },
+    "ZDO_EXT_NWK_INFO": { "ShortAddr": 0, "PanId": 0x1a62,
+                          "ParentAddr": 0, "ExtendedPanId": SIM_IEEE_ADDR,
+                          "Channel": 11 }
+}
+
+
+def reset_ind(request):
+    "The SYS_RESET_IND a device sends as it comes back from a reset."
+    return ("SYS_RESET_IND", { "Reason": 0x00, "TransportRev": 2,
+                               "ProductId": 0, "MajorRel": 2,
+                               "MinorRel": 6, "HwRev": 3 })
+
+
+def data_confirm(request):
+    "The AF_DATA_CONFIRM reporting that a data request was delivered."
+    return ("AF_DATA_CONFIRM", { "Status": 0x00,
+                                 "Endpoint": request["SrcEndpoint"],
+                                 "TransId": request["TransId"] })
+
+
+# The functions returning the (name, values) of the AREQ that follows
+# a request, by the name of the request
+FOLLOWUPS = {
+    "SYS_RESET_REQ": reset_ind,
+    "AF_DATA_REQUEST": data_confirm,
+    "AF_DATA_REQUEST_EXT": data_confirm
+}
+
+# Plausible contents of the AREQs most often sent in storms, and the
+# sequence number field that changes from one to the next
+STORMS = {
+    "AF_INCOMING_MSG": ({ "ClusterId": 0x0006, "SrcAddr": 0x1234,
+                          "SrcEndpoint": 1, "DstEndpoint": 1,
+                          "LinkQuality": 0xc8,
+                          "Data": b'\x18\x00\x0a\x00\x00\x10\x01' },
+                        "TransSeqNumber"),
+    "ZDO_SRC_RTG_IND": ({ "DstAddr": 0x1234, "RelayList": [0x5678] },
+                        None),
+    "MAC_DATA_IND": ({ "SrcAddrMode": 2, "SrcAddr": 0x1234,
+                       "DstAddrMode": 2, "DstAddr": 0x0000,
+                       "SrcPanId": 0x1a62, "DstPanId": 0x1a62,
+                       "LinkQuality": 0xc8, "Data": b'\x01\x02\x03' },
+                     "DSN")
+}
+
+
+def make_frame(key, body):
+    """Return the complete MTAPI frame of the command with the (type,
+    subsystem, command) key `key` and the body `body`."""
+    type_name, subsystem_name, cmd = key
+    frame = bytearray((0xfe, len(body),
+                       MTAPIType.to_number(type_name) |
+                       MTAPISubsystem.to_number(subsystem_name),
+                       cmd))
+    frame += body
+    frame.append(calculate_fcs(frame[1:]))
+    return bytes(frame)
+
+
+def build_frame(key, values):
+    """Return the frame of the command with key `key`, encoding the
+    field values in the dictionary `values`.  Fields not given are
+    zero or empty."""
+    command = MT_COMMANDS[key[:2]][key[2]]
+    return make_frame(key, command.encode(values))
+
+
+def rpc_error(cmd0, cmd1):
+    """Return the RPC error SRSP a device sends for an SREQ it does not
+    support, the `cmd0` and `cmd1` of which are returned in it."""
+    frame = bytearray((0xfe, 3, 0x60, 0x00, 0x02, cmd0, cmd1))
+    frame.append(calculate_fcs(frame[1:]))
+    return bytes(frame)
+
+
+class Storm:
+    """A stream of the AREQ named `name` sent `rate` times a second,
+    `count` times or until stopped.  The frames are built in advance;
+    if `counter` names a single byte field, that field counts up from
+    one frame to the next, otherwise every frame is the same.  Raises
+    a ValueError if the rate is not a positive number."""
+    def __init__(self, name, rate, count=None, counter=None, **values):
+        if not 0 < rate < math.inf:
+            raise ValueError("Storm rate must be positive")
+        key = find_key(name)
+        if counter is None:
+            self.frames = [build_frame(key, values)]
+        else:
+            self.frames = [build_frame(key, dict(values, **{counter: i}))
+                           for i in range(256)]
+        self.interval = 1.0 / rate
+        self.remaining = count
+        self.due = time.monotonic()
+        self.sent = 0
+
+    def finished(self):
+        "Return True if every frame has been sent."
+        return self.remaining is not None and self.sent >= self.remaining
+
+    def due_frames(self, now):
+        "Generate the frames that are due to have been sent by `now`."
+        while self.due <= now and not self.finished():
+            yield self.frames[self.sent % len(self.frames)]
+            self.sent += 1
+            self.due += self.interval
+
+
+class Simulator:
+    """A device that speaks MTAPI through `link`, a transport from the
+    transport module, so that the console and the tools built on it
+    can be tried out and loaded heavily without hardware.
+
+    Every SREQ in MT_COMMANDS is answered with its SRSP, which has a
+    Status of success and otherwise the values in RESPONSES, or zero;
+    fields named the same as fields of the SREQ echo them back.  The
+    requests in FOLLOWUPS are followed by an AREQ, as a real device
+    would send later, and SREQs the simulator does not know are
+    answered with an RPC error.  Storms of AREQs can be added to stand
+    in for a busy network.
+
+    If `baud` is given, frames are sent no faster than a serial line
+    at that baud rate could carry them.  Every response is delayed by
+    `latency` seconds.  Like the rest of the program, the simulator
+    does not block: it is called when `link` has input, and `tick()`
+    must be called whenever `wait_time()` says there is work to do.
+    """
+    def __init__(self, link, baud=None, latency=0.0):
+        self.link = link
+        self.baud = baud
+        self.latency = latency
+        self.responses = { name: dict(values)
+                           for name, values in RESPONSES.items() }
+        self.followups = dict(FOLLOWUPS)
+        self.storms = []
+        self.output = []
+        self.queued = 0
+        self.line_free = 0.0
+        self.requests = 0
+        self.unknown = 0
+        self.sent = 0
+        self.receiver = MTAPI(link)
+        self.receiver.display = "none"
+        self.receiver.add_listener(self.listener)
+
+    def respond(self, name, **values):
+        """Answer the SREQ called `name` with the SRSP field values
+        given, as well as the usual ones."""
+        self.responses.setdefault(name.upper(), {}).update(values)
+
+    def storm(self, name, rate, count=None, counter=None, **values):
+        """Start sending the AREQ called `name` `rate` times a second,
+        as for Storm.  With no values given, the plausible contents in
+        STORMS are used if there are some.  Returns the Storm."""
+        name = name.upper()
+        if not values and name in STORMS:
+            values, default_counter = STORMS[name]
+            if counter is None:
+                counter = default_counter
+        storm = Storm(name, rate, count, counter, **values)
+        self.storms.append(storm)
+        return storm
+
+    def queue(self, frame, delay=0.0):
+        "Send `frame` after `delay` seconds, after the frames queued earlier."
+        self.queued += 1
+        heapq.heappush(self.output,
+                       (time.monotonic() + delay, self.queued, frame))
+
+    def listener(self, type_name, subsystem_name, cmd, data):
+        "Act on a request from the console."
+        self.requests += 1
+        request = MT_COMMANDS.get((type_name, subsystem_name), {}).get(cmd)
+        if type_name == "SREQ":
+            response = MT_COMMANDS.get(("SRSP", subsystem_name), {}).get(cmd)
+            if request is None or response is None:
+                self.unknown += 1
+                self.queue(rpc_error(self.receiver.cmd0, cmd), self.latency)
+                return True
+        elif request is None:
+            self.unknown += 1
+            return True
+        try:
+            record = request.decode(data)
+        except ParseError:
+            record = {}
+        if type_name == "SREQ":
+            key = ("SRSP", subsystem_name, cmd)
+            values = dict(record, Status=0)
+            values.update(self.responses.get(request.name, {}))
+            try:
+                frame = build_frame(key, values)
+            except (ParseError, OverflowError):
+                # A field of the SREQ does not fit the SRSP's namesake
+                frame = build_frame(key, self.responses.get(request.name,
+                                                            {}))
+            self.queue(frame, self.latency)
+        followup = self.followups.get(request.name)
+        if followup is not None and record:
+            name, values = followup(record)
+            self.queue(build_frame(find_key(name), values), self.latency)
+        return True
+
+    def __call__(self):
+        """Read whatever the console has sent.  Returns True, for the
+        main loop."""
+        return self.receiver.work()
+
+    def wait_time(self):
+        """Return the seconds until `tick()` next has anything to do, or
+        None if there is nothing waiting to be sent."""
+        times = [storm.due for storm in self.storms]
+        if self.output:
+            times.append(max(self.output[0][0], self.line_free))
+        if not times:
+            return None
+        return max(min(times) - time.monotonic(), 0)
+
+    def tick(self):
+        "Send everything that is due to be sent."
+        now = time.monotonic()
+        for storm in self.storms:
+            for frame in storm.due_frames(now):
+                self.queue(frame)
+        self.storms = [storm for storm in self.storms
+                       if not storm.finished()]
+        output = self.output
+        while output and output[0][0] <= now and self.line_free <= now:
+            frame = heapq.heappop(output)[2]
+            self.link.write(frame)
+            self.sent += 1
+            if self.baud is not None:
+                self.line_free = (max(self.line_free, now) +
+                                  len(frame) * BITS_PER_BYTE / self.baud)
+
+    def run(self, duration=None):
+        """Act as the device for `duration` seconds, or until the link
+        is closed."""
+        deadline = None
+        if duration is not None:
+            deadline = time.monotonic() + duration
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.link, selectors.EVENT_READ)
+            while True:
+                timeout = self.wait_time()
+                if deadline is not None:
+                    remaining = max(deadline - time.monotonic(), 0)
+                    if timeout is None or timeout > remaining:
+                        timeout = remaining
+                if selector.select(timeout):
+                    try:
+                        self()
+                    except EOFError:
+                        return
+                self.tick()
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+
+
+def parse_storm(text):
+    """Return the (name, rate, count) given by `text`, written as
+    NAME:RATE[:COUNT].  Raises a ValueError if it is not like that, or
+    if the rate is not positive or the count is negative."""
+    parts = text.split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError("Storm must be NAME:RATE[:COUNT]")
+    rate = float(parts[1])
+    if not 0 < rate < math.inf:
+        raise ValueError("Storm rate must be positive")
+    count = int(parts[2]) if len(parts) == 3 else None
+    if count is not None and count < 0:
+        raise ValueError("Storm count must not be negative")
+    return parts[0], rate, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MTAPI Device Simulator")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--listen", metavar="ADDRESS",
+                       help="Wait for the console to connect to ADDRESS, "
+                       "either unix:PATH or tcp:[HOST:]PORT")
+    group.add_argument("--pty", action="store_true",
+                       help="Create a pseudo-terminal for the console "
+                       "to open as its serial port")
+    parser.add_argument("-b", "--baud", type=int,
+                        help="Send no faster than a serial line at this "
+                        "baud rate (default: as fast as possible)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to wait before responding "
+                        "(default: %(default)s)")
+    parser.add_argument("--storm", action="append", default=[],
+                        metavar="NAME:RATE[:COUNT]",
+                        help="Send the AREQ NAME RATE times a second, "
+                        "COUNT times or forever (may be repeated)")
+    parser.add_argument("--duration", type=float,
+                        help="Seconds to run for (default: until the "
+                        "console disconnects)")
+    args = parser.parse_args()
+    try:
+        storms = [parse_storm(text) for text in args.storm]
+    except ValueError as e:
+        parser.error(e)
+
+    if args.pty:
+        link = transport.PtyTransport()
+        print("Open", link.name, "as the serial port")
+    else:
+        try:
+            listener = server.listen(args.listen)
+        except (ValueError, OSError) as e:
+            sys.exit("Unable to listen on %s: %s" % (args.listen, e))
+        print("Waiting for the console on", args.listen)
+        listener.setblocking(True)
+        sock, _ = listener.accept()
+        listener.close()
+        link = transport.SocketTransport(sock)
+    simulator = Simulator(link, args.baud, args.latency)
+    for storm in storms:
+        simulator.storm(*storm)
+    simulator.run(args.duration)
+    print("%d requests, %d unknown, %d frames sent" %
+          (simulator.requests, simulator.unknown, simulator.sent))
+    link.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+
+# stats.py
+#
+# Simple statistics for measurements taken by the console
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# The percentiles usually quoted for latencies
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def percentile(ordered, percent):
+    """Return the `percent` percentile of the sequence `ordered`, which
+    must already be sorted, interpolating between the nearest values.
+    Returns None if the sequence is empty."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * percent / 100
+    below = int(position)
+    if below + 1 >= len(ordered):
+        return ordered[-1]
+    fraction = position - below
+    return ordered[below] + (ordered[below+1] - ordered[below]) * fraction
+
+
+def summarise(values, percents=LATENCY_PERCENTILES):
+    """Return a list of (name, value) pairs describing the spread of
+    `values`: the minimum, the given percentiles and the maximum.  The
+    list is empty if there are no values."""
+    if not values:
+        return []
+    ordered = sorted(values)
+    summary = [("min", ordered[0])]
+    for percent in percents:
+        summary.append(("%d%%" % percent, percentile(ordered, percent)))
+    summary.append(("max", ordered[-1]))
+    return summary
@@ -0,0 +1,162 @@
+#! /usr/bin/env python3
+
+# template.py
+#
+# Precompiled MTAPI frames with fields that can be changed quickly
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import re
+from mtapi import ParseError, ParseField, fixed_length
+from mtcmds import MTBuffer
+
+
+# A slot token is a pair of braces, optionally containing the initial
+# value of the field, e.g. "{}" or "{0x10}"
+SLOT_TOKEN = re.compile(r"\{([^{}]*)\}$")
+
+
+def fold(value, width):
+    """XOR the `width` bytes of the integer `value` together, giving
+    the change in Frame Check Sequence caused by XORing `value` into a
+    field of that width."""
+    result = 0
+    while width > 0:
+        result ^= value
+        value >>= 8
+        width -= 1
+    return result & 0xff
+
+
+class FrameTemplate:
+    """A complete MTAPI frame assembled once from command tokens, in
+    which some fixed-width fields are marked as slots.  Slots can then
+    be rewritten in place without reparsing the command; the Frame
+    Check Sequence is adjusted by the change in the slot's bytes rather
+    than being recalculated over the whole frame.
+
+    In the command tokens a slot is written as "{}", or as "{value}"
+    to give it an initial value other than zero.  Slots are named
+    after the field they occupy, so "{}" in the TransId position of
+    AF_DATA_REQUEST gives a slot called "TransId".  Only simple fixed
+    width fields can be slots."""
+    def __init__(self, subsystem_name, type_name, command_name, tokens):
+        """Assemble the template for the MTAPI command defined by the
+        subsystem, type and command names.  `tokens` is the tokenised
+        command line, with the command name itself as the first token.
+        An mtapi.ParseError is raised if the tokens cannot be parsed.
+        """
+        buf = MTBuffer(subsystem_name, type_name, command_name)
+        fields = buf.cmd.fields
+        if len(fields) != len(tokens) - 1:
+            raise ParseError("Wrong number of tokens for " + command_name)
+        self.slots = {}
+        initial = {}
+        for field, token in zip(fields, tokens[1:]):
+            match = SLOT_TOKEN.match(token)
+            if match is None:
+                if not field.parse_token(token, buf):
+                    raise ParseError("'%s' not recognised in field %s" %
+                                     (token, field.name))
+                continue
+            if not isinstance(field, ParseField):
+                raise ParseError("Field %s cannot be a slot" % field.name)
+            if field.name in self.slots:
+                raise ParseError("Duplicate slot %s" % field.name)
+            self.slots[field.name] = (len(buf.buffer), field.length)
+            if match.group(1):
+                if not field.parse_token(match.group(1), buf):
+                    raise ParseError("'%s' not recognised in field %s" %
+                                     (match.group(1), field.name))
+            else:
+                buf.extend(bytes(field.length))
+        self.image = bytearray(buf.frame())
+
+    @classmethod
+    def from_record(cls, subsystem_name, type_name, command_name, record,
+                    slots=()):
+        """Assemble the template from the field values in the dictionary
+        `record` rather than from tokens, laid out as MTAPICmd.encode()
+        does, making slots of the fields named in `slots` with their
+        values in `record` as the initial ones.  An mtapi.ParseError is
+        raised if a slot is not a simple field at the same offset in
+        every packet, or if the frame would be too long."""
+        buf = MTBuffer(subsystem_name, type_name, command_name)
+        template = cls.__new__(cls)
+        template.slots = {}
+        offset = len(buf.buffer)
+        for field in buf.cmd.fields:
+            # Some compound fields have no name of their own
+            if getattr(field, "name", None) in slots:
+                if offset is None or not isinstance(field, ParseField):
+                    raise ParseError("Field %s cannot be a slot" %
+                                     field.name)
+                template.slots[field.name] = (offset, field.length)
+            if offset is not None:
+                length = fixed_length([field])
+                offset = None if length is None else offset + length
+        for name in slots:
+            if name not in template.slots:
+                raise ParseError("No field %s in %s" % (name, command_name))
+        buf.extend(buf.cmd.encode(record))
+        template.image = bytearray(buf.frame())
+        return template
+
+    def __getitem__(self, name):
+        "Return the current value of the slot `name`."
+        offset, width = self.slots[name]
+        return int.from_bytes(self.image[offset:offset+width], "little")
+
+    def __setitem__(self, name, value):
+        """Rewrite the slot `name` with the integer `value`, truncated
+        to fit the field, and update the Frame Check Sequence to
+        match."""
+        offset, width = self.slots[name]
+        image = self.image
+        if width == 1:
+            value &= 0xff
+            image[-1] ^= image[offset] ^ value
+            image[offset] = value
+            return
+        value &= (1 << (8*width)) - 1
+        old = int.from_bytes(image[offset:offset+width], "little")
+        image[offset:offset+width] = value.to_bytes(width, "little")
+        image[-1] ^= fold(old ^ value, width)
+
+    def frame(self, **values):
+        """Return the frame as bytes, after setting any slots given
+        as keyword arguments."""
+        for name, value in values.items():
+            self[name] = value
+        return bytes(self.image)
+
+    def frames(self, name, values):
+        """Generate a frame for each of the `values` in turn, placed
+        in the slot `name`."""
+        offset, width = self.slots[name]
+        image = self.image
+        if width != 1:
+            for value in values:
+                self[name] = value
+                yield bytes(image)
+            return
+        # Single byte slots are by far the most common (sequence
+        # numbers, transaction IDs), so are worth special handling.
+        for value in values:
+            value &= 0xff
+            image[-1] ^= image[offset] ^ value
+            image[offset] = value
+            yield bytes(image)
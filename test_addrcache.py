@@ -0,0 +1,234 @@
+#! /usr/bin/env python3
+
+# test_addrcache.py
+#
+# Unit tests for the address cache
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import keyboard
+import mtapi
+import mtcmds
+import addrcache
+from test_pipeline import FakeDevice, make_frame
+
+
+IEEE = 0x00124b0001020304
+IEEE_TEXT = "00:12:4b:00:01:02:03:04"
+
+
+def annce(nwk, ieee):
+    "A ZDO_END_DEVICE_ANNCE_IND from `nwk`"
+    body = (nwk.to_bytes(2, "little") + nwk.to_bytes(2, "little") +
+            ieee.to_bytes(8, "little") + b'\x8e')
+    return make_frame(0x45, 0xc1, body)
+
+
+def nwk_addr_rsp(nwk, ieee, status=0):
+    "A ZDO_NWK_ADDR_RSP with no associated devices"
+    body = (bytes((status,)) + ieee.to_bytes(8, "little") +
+            nwk.to_bytes(2, "little") + b'\x00\x00')
+    return make_frame(0x45, 0x80, body)
+
+
+class AddressCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.addrmgr = {}
+        self.network = {}
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        self.cache = addrcache.AddressCache()
+        self.cache.attach(self.mtapi)
+        self.addCleanup(self.cache.detach, self.mtapi)
+
+    def respond(self, frame):
+        """Answer address lookups from `addrmgr`, and address requests
+        from `network`"""
+        key = frame[2:4]
+        if key == b'\x27\x40':
+            ieee = int.from_bytes(frame[4:12], "little")
+            nwk = self.addrmgr.get(ieee, 0xfffe)
+            return make_frame(0x67, 0x40, nwk.to_bytes(2, "little"))
+        if key == b'\x27\x41':
+            nwk = int.from_bytes(frame[4:6], "little")
+            ieee = {v: k for k, v in self.addrmgr.items()}.get(nwk, 0)
+            return make_frame(0x67, 0x41, ieee.to_bytes(8, "little"))
+        if key == b'\x25\x00':
+            ieee = int.from_bytes(frame[4:12], "little")
+            reply = make_frame(0x65, 0x00, b'\x00')
+            if ieee in self.network:
+                reply += nwk_addr_rsp(self.network[ieee], ieee)
+            return reply
+        if key == b'\x25\x01':
+            nwk = int.from_bytes(frame[4:6], "little")
+            reply = make_frame(0x65, 0x01, b'\x00')
+            for ieee, known in self.network.items():
+                if known == nwk:
+                    body = (b'\x00' + ieee.to_bytes(8, "little") +
+                            frame[4:6] + b'\x00\x00')
+                    reply += make_frame(0x45, 0x81, body)
+            return reply
+        return frame
+
+    def receive(self, frame):
+        "Have the device send `frame`"
+        self.fake.device.sendall(frame)
+        self.mtapi.run_until(lambda: False, 0.02)
+
+    def test_learn(self):
+        cache = addrcache.AddressCache(3)
+        for i in range(3):
+            cache.learn(0x1000 + i, IEEE + i)
+        self.assertEqual(cache.nwk_of(IEEE), 0x1000)
+        self.assertEqual(cache.ieee_of(0x1001), IEEE + 1)
+        # IEEE + 2 is now the least recently used
+        cache.learn(0x1003, IEEE + 3)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.nwk_of(IEEE + 2))
+        self.assertIsNone(cache.ieee_of(0x1002))
+        # A device that rejoins with a new address
+        cache.learn(0x2000, IEEE)
+        self.assertIsNone(cache.ieee_of(0x1000))
+        self.assertEqual(cache.nwk_of(IEEE), 0x2000)
+        # Another device taking over an address
+        cache.learn(0x2000, IEEE + 5)
+        self.assertIsNone(cache.nwk_of(IEEE))
+        self.assertEqual(len(cache.by_ieee), len(cache.by_nwk))
+        cache.learn(0xfffe, IEEE + 6)
+        self.assertIsNone(cache.nwk_of(IEEE + 6))
+
+    def test_parse_ieee(self):
+        self.assertEqual(addrcache.parse_ieee(IEEE_TEXT), IEEE)
+        self.assertEqual(addrcache.parse_ieee("0x00124b0001020304"), IEEE)
+        self.assertEqual(addrcache.parse_ieee("00124b0001020304"), IEEE)
+        # Sixteen decimal digits are still hex bytes, not a number
+        self.assertEqual(addrcache.parse_ieee("1234000001020304"),
+                         0x1234000001020304)
+        self.assertEqual(addrcache.format_ieee(IEEE), IEEE_TEXT)
+        for token in ("00:12:4b", "nonsense", "-1", "0x1%016x" % 0):
+            with self.assertRaises(ValueError):
+                addrcache.parse_ieee(token)
+
+    def test_passive(self):
+        self.receive(annce(0x1234, IEEE))
+        self.receive(nwk_addr_rsp(0x5678, IEEE + 1))
+        self.receive(nwk_addr_rsp(0x9abc, IEEE + 2, status=0x81))
+        body = (b'\x00' + (IEEE + 3).to_bytes(8, "little") +
+                b'\x00\x00\x00\x09\x00')
+        self.receive(make_frame(0x67, 0x00, body))
+        self.assertEqual(self.cache.ieee_of(0x1234), IEEE)
+        self.assertEqual(self.cache.ieee_of(0x5678), IEEE + 1)
+        self.assertIsNone(self.cache.nwk_of(IEEE + 2))
+        self.assertEqual(self.cache.ieee_of(0x0000), IEEE + 3)
+
+    def test_addrmgr_replies(self):
+        self.addrmgr[IEEE] = 0x4321
+        ui = keyboard.UIHandler(self.fake, self.mtapi, interactive=False,
+                                addresses=self.cache)
+        ui.execute(["util_addrmgr_ext_addr_lookup", hex(IEEE)])
+        self.mtapi.run_until(lambda: False, 0.02)
+        self.assertEqual(self.cache.nwk_of(IEEE), 0x4321)
+        # Replies with no question are ignored
+        self.receive(make_frame(0x67, 0x40, b'\x11\x11'))
+        self.assertIsNone(self.cache.ieee_of(0x1111))
+
+    def test_annotation(self):
+        self.mtapi.display = "decode"
+        with support.captured_stdout() as stdout:
+            self.receive(annce(0x1234, IEEE))
+            self.receive(nwk_addr_rsp(0x2222, IEEE + 1))
+        output = stdout.getvalue()
+        self.assertIn("NwkAddr : 1234 (%s)" % IEEE_TEXT, output)
+        self.assertIn("IEEEAddr : %s (1234)" % IEEE_TEXT, output)
+        self.cache.detach(self.mtapi)
+        self.addCleanup(self.cache.attach, self.mtapi)
+        with support.captured_stdout() as stdout:
+            self.receive(annce(0x1234, IEEE))
+        self.assertIn("NwkAddr : 1234\n", stdout.getvalue())
+
+    def test_annotation_per_receiver(self):
+        # Detaching from one receiver leaves another's annotations, and
+        # a receiver the cache is not attached to has none
+        other = mtcmds.MTAPI(None)
+        self.cache.attach(other)
+        self.cache.learn(0x1234, IEEE)
+        plain = mtcmds.MTAPI(None)
+        other.data = annce(0x1234, IEEE)[4:-1]
+        plain.data = other.data
+        for receiver in (other, plain):
+            receiver.type = mtapi.MTAPIType(0x45)
+            receiver.subsystem = mtapi.MTAPISubsystem(0x45)
+            receiver.cmd = 0xc1
+        self.cache.detach(self.mtapi)
+        self.addCleanup(self.cache.attach, self.mtapi)
+        with support.captured_stdout() as stdout:
+            other.execute()
+        self.assertIn("NwkAddr : 1234 (%s)" % IEEE_TEXT, stdout.getvalue())
+        with support.captured_stdout() as stdout:
+            plain.execute()
+        self.assertIn("NwkAddr : 1234\n", stdout.getvalue())
+
+    def test_resolve(self):
+        self.addrmgr[IEEE + 1] = 0x1001
+        self.network[IEEE + 2] = 0x1002
+        self.cache.learn(0x1000, IEEE)
+        resolver = addrcache.AddressResolver(self.fake, self.mtapi,
+                                             self.cache, 0.05)
+        self.assertEqual(resolver.nwk_of(IEEE), (0x1000, "cache"))
+        self.assertEqual(self.fake.written, [])
+        self.assertEqual(resolver.nwk_of(IEEE + 1), (0x1001, "device"))
+        self.assertEqual(len(self.fake.written), 1)
+        self.assertEqual(resolver.nwk_of(IEEE + 2), (0x1002, "network"))
+        self.assertEqual(len(self.fake.written), 3)
+        self.assertEqual(resolver.nwk_of(IEEE + 2), (0x1002, "cache"))
+        self.assertEqual(resolver.nwk_of(IEEE + 3), (None, None))
+        self.assertEqual(resolver.ieee_of(0x1001), (IEEE + 1, "cache"))
+        self.cache = addrcache.AddressCache()
+        resolver.cache = self.cache
+        self.assertEqual(resolver.ieee_of(0x1001), (IEEE + 1, "device"))
+        self.assertEqual(resolver.ieee_of(0x1002), (IEEE + 2, "network"))
+        self.assertEqual(resolver.ieee_of(0x1003), (None, None))
+
+    def test_commands(self):
+        self.cache.learn(0x1000, IEEE)
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False,
+                                    addresses=self.cache)
+            self.assertTrue(ui.execute(["nwkaddr-of", IEEE_TEXT]))
+            self.assertTrue(ui.execute(["ieee", "1000"]))
+            self.assertTrue(ui.execute(["nwkaddr-of", "nonsense"]))
+            self.assertTrue(ui.execute(["ieeeaddr-of", "fffe"]))
+            self.assertEqual(self.fake.written, [])
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["nwkaddr-of", IEEE_TEXT]))
+        output = stdout.getvalue()
+        self.assertIn("%s is 1000 (from cache)" % IEEE_TEXT, output)
+        self.assertIn("1000 is %s (from cache)" % IEEE_TEXT, output)
+        self.assertIn("'nonsense' is not an IEEE address", output)
+        self.assertIn("Syntax: ieeeaddr-of", output)
+        self.assertIn("Cannot look up addresses: no address cache",
+                      output)
+
+
+if __name__ == "__main__":
+    unittest.main()
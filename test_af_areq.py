@@ -98,9 +98,9 @@ class TestAfIncomingMsg(BaseAfAReq):
 
 
 class TestAfIncomingMsgExt(BaseAfAReq):
-    # This test is somewhat awkward, since the spec claims that the
-    # 'Length' field is both 1 and 2 bytes long.  Fixing the over-
-    # length data handling is therefore not a priority
+    # The 'Length' field is two bytes long.  Messages too long to fit
+    # in a frame leave the data out, to be fetched with
+    # AF_DATA_RETRIEVE
     COMMAND = 0x82
     COMMAND_NAME = "AF_INCOMING_MSG_EXT"
 
@@ -118,7 +118,7 @@ class TestAfIncomingMsgExt(BaseAfAReq):
         self.add_byte("SecurityUse", "0x00")
         self.add_word("Timestamp", "789abcde", 0x789abcde)
         self.add_byte("TransSeqNumber", "0x13")
-        self.add_byte("Length", "1")
+        self.add_hword("Length", "1")
         self.add_bytes("Data", (0x58,))
         self.run_test()
 
@@ -136,10 +136,28 @@ class TestAfIncomingMsgExt(BaseAfAReq):
         self.add_byte("SecurityUse", "0x01")
         self.add_word("Timestamp", "89abcdef", 0x89abcdef)
         self.add_byte("TransSeqNumber", "0x24")
-        self.add_byte("Length", "0")
+        self.add_hword("Length", "0")
         self.add_bytes("Data", ())
         self.run_test()
 
+    def test_long_msg(self):
+        self.add_hword("GroupId", "0000", 0)
+        self.add_hword("ClusterId", "0019", 0x0019)
+        self.add_byte("SrcAddrMode", "16-bit", 2)
+        self.add_hword("SrcAddr", "1234", 0x1234)
+        self.add_padding(6)
+        self.add_byte("SrcEndpoint", "0x01")
+        self.add_hword("SrcPanId", "abcd", 0xabcd)
+        self.add_byte("DstEndpoint", "0x01")
+        self.add_byte("WasBroadcast", "0x00")
+        self.add_byte("LinkQuality", "0xbb")
+        self.add_byte("SecurityUse", "0x00")
+        self.add_word("Timestamp", "00001000", 0x1000)
+        self.add_byte("TransSeqNumber", "0x35")
+        self.add_hword("Length", "1024")
+        self.add_text("Data", "Blank")
+        self.run_test()
+
 
 if __name__ == "__main__":
     unittest.main()
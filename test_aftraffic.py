@@ -0,0 +1,146 @@
+#! /usr/bin/env python3
+
+# test_aftraffic.py
+#
+# Unit tests for the AF traffic generator
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import time
+import keyboard
+import mtcmds
+import aftraffic
+from test_pipeline import FakeDevice, make_frame
+
+
+class AfTrafficTest(unittest.TestCase):
+    def setUp(self):
+        self.failures = {}
+        self.drop = set()
+        self.delay = set()
+        self.held = b''
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+
+    def decode(self, frame):
+        "Decode a data request written to the device"
+        command = mtcmds.MT_COMMANDS[("SREQ", "AF")][frame[3]]
+        return command.decode(frame[4:-1])
+
+    def respond(self, frame):
+        """Accept data requests, confirming them unless told otherwise.
+        A delayed confirmation is sent after the next one."""
+        record = self.decode(frame)
+        trans_id = record["TransId"]
+        reply = make_frame(0x64, frame[3], b'\x00')
+        if trans_id in self.drop:
+            return reply
+        status = self.failures.get(trans_id, 0)
+        confirm = make_frame(0x44, 0x80, bytes((status, 1, trans_id)))
+        if trans_id in self.delay:
+            self.held = confirm
+            return reply
+        reply += confirm + self.held
+        self.held = b''
+        return reply
+
+    def test_delivery(self):
+        traffic = aftraffic.AfTraffic(self.fake, self.mtapi,
+                                      [0x1234, 0x5678], 50)
+        traffic.run(20)
+        records = [self.decode(frame) for frame in self.fake.written]
+        self.assertTrue(all(frame[3] == 0x01
+                            for frame in self.fake.written))
+        self.assertEqual([r["DstAddr"] for r in records[:3]],
+                         [0x1234, 0x5678, 0x1234])
+        self.assertEqual([r["TransId"] for r in records],
+                         list(range(20)))
+        self.assertTrue(all(r["Length"] == 50 for r in records))
+        self.assertEqual(records[0]["Options"], aftraffic.AF_ACK_REQUEST)
+        self.assertEqual((traffic.confirmed, traffic.lost), (20, 0))
+        self.assertEqual(len(traffic.latencies), 20)
+        self.assertGreater(traffic.throughput(), 0)
+
+    def test_ext(self):
+        traffic = aftraffic.AfTraffic(self.fake, self.mtapi, [0x4321],
+                                      200)
+        traffic.run(3)
+        self.assertTrue(all(frame[3] == 0x02
+                            for frame in self.fake.written))
+        record = self.decode(self.fake.written[0])
+        self.assertEqual((record["DstAddrMode"], record["DstAddr"]),
+                         (2, 0x4321))
+        self.assertEqual(len(record["Data"]), 200)
+        self.assertEqual(traffic.confirmed, 3)
+
+    def test_failures(self):
+        self.failures[3] = 0xe9
+        self.drop.add(5)
+        self.delay.add(1)
+        traffic = aftraffic.AfTraffic(self.fake, self.mtapi, [0x0001],
+                                      10, timeout=0.05)
+        traffic.run(8)
+        self.assertEqual((traffic.confirmed, traffic.lost), (6, 1))
+        self.assertEqual(traffic.statuses[0xe9], 1)
+        report = traffic.report()
+        self.assertTrue(report[0].endswith(
+            "6 delivered, 1 failed, 1 unconfirmed"))
+        self.assertEqual(report[1], "  ZMacNoAck: 1")
+        self.assertTrue(report[2].startswith("Confirm latency (ms): "))
+
+    def test_rate(self):
+        traffic = aftraffic.AfTraffic(self.fake, self.mtapi, [0x0001],
+                                      10, rate=100)
+        start = time.monotonic()
+        traffic.run(6)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(traffic.confirmed, 6)
+
+    def test_limits(self):
+        for destinations, size, rate, window in (([], 10, None, 4),
+                                                 ([1], 0, None, 4),
+                                                 ([1], 231, None, 4),
+                                                 ([1], 10, 0, 4),
+                                                 ([1], 10, None, 0)):
+            with self.assertRaises(ValueError):
+                aftraffic.AfTraffic(self.fake, self.mtapi, destinations,
+                                    size, rate, window)
+
+    def test_command(self):
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["aftraffic", "4", "10", "0"]))
+            self.assertTrue(ui.execute(["aftraffic", "4", "10", "0",
+                                        "xyz"]))
+            self.assertTrue(ui.execute(["aftraffic", "4", "300", "0",
+                                        "1234"]))
+            self.assertEqual(self.fake.written, [])
+            self.assertTrue(ui.execute(["aftraffic", "4", "10", "0",
+                                        "1234"]))
+        output = stdout.getvalue()
+        self.assertIn("Syntax: aftraffic", output)
+        self.assertIn("Error: Payload size", output)
+        self.assertIn("4 delivered, 0 failed, 0 unconfirmed", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+
+# test_api.py
+#
+# Unit tests for the Python scripting interface
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import os
+import tempfile
+import keyboard
+import mtcmds
+import api
+from mtapi import ParseError
+from test_pipeline import FakeDevice, make_frame
+
+
+class ScriptAPITest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        self.ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                     interactive=False)
+        self.mt = api.ScriptAPI(self.ui)
+
+    def respond(self, frame):
+        "Answer pings and NV writes, and follow a reset with its AREQ"
+        if frame[2:4] == b'\x21\x01':
+            return make_frame(0x61, 0x01, b'\x79\x01')
+        if frame[2:4] == b'\x21\x09':
+            return make_frame(0x61, 0x09, b'\x00')
+        if frame[2:4] == b'\x41\x00':
+            return make_frame(0x41, 0x80, b'\x00\x02\x00\x02\x06\x03')
+        return b''
+
+    def test_build(self):
+        buf = api.build("sys_reset_req", Type=1)
+        self.assertEqual(buf.frame(), make_frame(0x41, 0x00, b'\x01'))
+        buf = api.build("SYS_RESET_REQ", Type="software")
+        self.assertEqual(buf.frame(), make_frame(0x41, 0x00, b'\x01'))
+        buf = api.build("SYS_OSAL_NV_WRITE", Id=0x0003, Offset=0,
+                        Data=b'\x01\x02')
+        self.assertEqual(buf.frame(),
+                         make_frame(0x21, 0x09,
+                                    b'\x03\x00\x00\x02\x01\x02'))
+        buf = api.build("SYS_SET_EXTADDR",
+                        ExtAddr=bytes(range(8)))
+        self.assertEqual(buf.buffer[4:], bytes(range(8)))
+
+    def test_build_errors(self):
+        for name, fields in (("SYS_NONSENSE", {}),
+                             ("SYS_RESET_REQ", {}),
+                             ("SYS_RESET_REQ", {"Type": 256}),
+                             ("SYS_RESET_REQ", {"Type": "sideways"}),
+                             ("SYS_RESET_REQ", {"Type": 0, "Extra": 1}),
+                             ("SYS_SET_EXTADDR", {"ExtAddr": b'\x01'})):
+            with self.assertRaises(ParseError):
+                api.build(name, **fields)
+
+    def test_send(self):
+        self.assertEqual(self.mt.send("SYS_PING"), {"Capabilities": 0x179})
+        self.assertIsNone(self.mt.send("SYS_VERSION", timeout=0.05))
+        self.assertEqual(len(self.fake.written), 2)
+
+    def test_wait_for(self):
+        self.assertIsNone(self.mt.send("SYS_RESET_REQ", Type=1))
+        self.assertIsNone(self.mt.wait_for("SYS_RESET_IND", 0.05,
+                                           match=lambda r: False))
+        frame = api.build("SYS_RESET_REQ", Type=0).frame()
+        record = self.mt.wait_for("SYS_RESET_IND", send=frame)
+        self.assertEqual(record["MajorRel"], 2)
+        self.assertEqual(self.mtapi.events.subscriptions, [])
+
+    def test_on(self):
+        seen = []
+        def handler(key, record):
+            seen.append(key)
+        self.mt.on("SYS_*_IND", handler)
+        self.mt.send("SYS_RESET_REQ", Type=1)
+        self.mt.sleep(0.05)
+        self.mt.off(handler)
+        self.mt.send("SYS_RESET_REQ", Type=1)
+        self.mt.sleep(0.05)
+        self.assertEqual(seen, [("AREQ", "SYS", 0x80)])
+
+    def test_on_error(self):
+        calls = []
+        def handler(key, record):
+            calls.append(key)
+            raise KeyError("Nonsense")
+        self.mt.on("SYS_*_IND", handler)
+        self.mt.on("SYS_RESET_IND", handler)
+        with support.captured_stdout() as stdout:
+            self.mt.send("SYS_RESET_REQ", Type=1)
+            self.mt.sleep(0.05)
+            self.mt.send("SYS_RESET_REQ", Type=1)
+            self.mt.sleep(0.05)
+        # The handler is dropped after its first failure
+        self.assertEqual(calls, [("AREQ", "SYS", 0x80)])
+        self.assertIn("KeyError: 'Nonsense'", stdout.getvalue())
+        self.assertEqual(self.mtapi.events.subscriptions, [])
+        self.mt.off(handler)
+
+    def test_pyrun(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "ping.py")
+        with open(path, "w") as f:
+            f.write("reply = mt.send('SYS_PING')\n"
+                    "print('Capabilities %x' % reply['Capabilities'])\n"
+                    "print(args)\n"
+                    "mt.command('output hex')\n"
+                    "mt.send('SYS_NONSENSE')\n")
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.ui.execute(["pyrun", path, "a", "b"]))
+            self.assertTrue(self.ui.execute(["pyrun"]))
+        output = stdout.getvalue()
+        self.assertIn("Capabilities 179\n['a', 'b']\n", output)
+        self.assertEqual(self.mtapi.display, "hex")
+        self.assertIn("ParseError: Unable to find command SYS_NONSENSE",
+                      output)
+        self.assertIn("Syntax: pyrun", output)
+
+    def test_pyrun_handlers(self):
+        # Handlers left registered by a script, whether it returns or
+        # raises, are removed when it finishes
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "handlers.py")
+        with open(path, "w") as f:
+            f.write("mt.on('SYS_*_IND', lambda key, record: True)\n"
+                    "mt.on('ZDO_*', lambda key, record: True)\n"
+                    "if args:\n"
+                    "    raise ValueError(args[0])\n")
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.ui.execute(["pyrun", path]))
+            self.assertEqual(self.mtapi.events.subscriptions, [])
+            self.assertTrue(self.ui.execute(["pyrun", path, "Wombat"]))
+            self.assertEqual(self.mtapi.events.subscriptions, [])
+        self.assertIn("ValueError: Wombat", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
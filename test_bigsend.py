@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+
+# test_bigsend.py
+#
+# Unit tests for sending and receiving big AF messages
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import os
+import struct
+import tempfile
+import time
+import keyboard
+import mtcmds
+import bigsend
+from test_pipeline import FakeDevice, make_frame
+
+
+# The fields of AF_INCOMING_MSG_EXT before the data length
+INCOMING_HEADER = struct.Struct("<HHBQBHBBBBIB")
+
+
+def incoming_msg_ext(source, timestamp, length, data=b''):
+    "An AF_INCOMING_MSG_EXT from `source`"
+    body = INCOMING_HEADER.pack(0, 0x0019, 2, source, 1, 0xabcd, 1, 0,
+                                0xbb, 0, timestamp, 0x35)
+    body += length.to_bytes(2, "little") + data
+    return make_frame(0x44, 0x82, body)
+
+
+class BigSendTest(unittest.TestCase):
+    def setUp(self):
+        self.staged = None
+        self.delivered = None
+        self.fail_index = None
+        self.messages = {}
+        self.fail_retrieve = False
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+
+    def respond(self, frame):
+        """Stage, send and hand out messages as Z-Stack does, confirming
+        every message sent"""
+        self.assertEqual(frame[2], 0x24)
+        body = frame[4:-1]
+        if frame[3] == 0x02:
+            record = mtcmds.MT_COMMANDS[("SREQ", "AF")][0x02].decode(body)
+            self.trans_id = record["TransId"]
+            if record["Data"] is not None:
+                self.delivered = record["Data"]
+                return (make_frame(0x64, 0x02, b'\x00') +
+                        make_frame(0x44, 0x80,
+                                   bytes((0, 1, self.trans_id))))
+            self.staged = bytearray(record["Len"])
+            return make_frame(0x64, 0x02, b'\x00')
+        if frame[3] == 0x11:
+            index, length = struct.unpack_from("<HB", body)
+            if index == self.fail_index:
+                return make_frame(0x64, 0x11, b'\x10')
+            if length == 0:
+                self.delivered = bytes(self.staged)
+                self.staged = None
+                return (make_frame(0x64, 0x11, b'\x00') +
+                        make_frame(0x44, 0x80,
+                                   bytes((0, 1, self.trans_id))))
+            self.staged[index:index+length] = body[3:]
+            return make_frame(0x64, 0x11, b'\x00')
+        self.assertEqual(frame[3], 0x12)
+        timestamp, index, length = struct.unpack_from("<IHB", body)
+        if length == 0:
+            del self.messages[timestamp]
+            return make_frame(0x64, 0x12, b'\x00\x00')
+        if self.fail_retrieve:
+            return make_frame(0x64, 0x12, b'\x01\x00')
+        data = self.messages[timestamp][index:index+length]
+        return make_frame(0x64, 0x12, bytes((0, len(data))) + data)
+
+    def run_reassembler(self, reassembler, done):
+        "Drive `reassembler` as the console would until `done()`"
+        limit = time.monotonic() + 5
+        while not done():
+            self.assertLess(time.monotonic(), limit)
+            wait = reassembler.wait_time()
+            self.mtapi.run_until(
+                lambda: done() or (reassembler.current is None and
+                                   bool(reassembler.queue)),
+                0.1 if wait is None else wait)
+            reassembler.tick()
+
+    def test_single_frame(self):
+        data = os.urandom(100)
+        transfer = bigsend.BigSend(self.fake, self.mtapi, 0x1234, data)
+        self.assertEqual(transfer.run(), 0)
+        self.assertEqual(len(self.fake.written), 1)
+        self.assertEqual(self.delivered, data)
+        self.assertEqual(transfer.segments, 0)
+
+    def test_segments(self):
+        data = os.urandom(1000)
+        transfer = bigsend.BigSend(self.fake, self.mtapi, 0x1234, data,
+                                   trans_id=7)
+        self.assertEqual(transfer.run(), 0)
+        self.assertEqual(self.delivered, data)
+        self.assertEqual(transfer.segments, 5)
+        self.assertEqual(transfer.stored, 1000)
+        # The request, five segments and the empty store that sends it
+        self.assertEqual([frame[3] for frame in self.fake.written],
+                         [0x02] + [0x11] * 6)
+        self.assertEqual(self.fake.written[0][1], 20)
+        self.assertEqual(self.fake.written[1][1], 250)
+        self.assertEqual(self.fake.written[-1][1], 3)
+
+    def test_store_failure(self):
+        self.fail_index = bigsend.STORE_MAX
+        transfer = bigsend.BigSend(self.fake, self.mtapi, 0x1234,
+                                   bytes(1000), timeout=0.05)
+        self.assertIsNone(transfer.run())
+        # Only the first segment was taken
+        self.assertEqual(transfer.stored, bigsend.STORE_MAX)
+        # The request, the first segment, the second three times, and
+        # the empty store that frees the device's buffer
+        self.assertEqual(len(self.fake.written), 6)
+        self.assertEqual(self.fake.written[-1][1:4], b'\x03\x24\x11')
+        self.assertTrue(transfer.released)
+        self.assertIsNone(self.staged)
+        # A request that fails leaves no buffer to free
+        self.fail_index = None
+        self.staged = None
+        self.fake.respond = lambda frame: make_frame(0x64, 0x02, b'\x10')
+        self.assertIsNone(transfer.run())
+        self.assertFalse(transfer.released)
+        self.assertEqual(len(self.fake.written), 9)
+
+    def test_limits(self):
+        with self.assertRaises(ValueError):
+            bigsend.BigSend(self.fake, self.mtapi, 0x1234,
+                            bytes(bigsend.BIGSEND_MAX + 1))
+
+    def test_reassemble(self):
+        big = os.urandom(600)
+        self.messages[0x1000] = big
+        received = []
+        reassembler = bigsend.Reassembler(
+            self.fake, self.mtapi,
+            lambda record, data: received.append((record["SrcAddr"],
+                                                  bytes(data))))
+        reassembler.start()
+        self.fake.device.sendall(incoming_msg_ext(0x4321, 0x0fff, 3,
+                                                  b'abc') +
+                                 incoming_msg_ext(0x1234, 0x1000, 600))
+        self.run_reassembler(reassembler, lambda: len(received) == 2)
+        reassembler.stop()
+        self.assertEqual(received, [(0x4321, b'abc'), (0x1234, big)])
+        requests = [struct.unpack_from("<IHB", frame, 4)
+                    for frame in self.fake.written]
+        self.assertEqual(requests, [(0x1000, 0, 248), (0x1000, 248, 248),
+                                    (0x1000, 496, 104), (0x1000, 600, 0)])
+        self.assertEqual(self.messages, {})
+        self.assertEqual((reassembler.received, reassembler.retrieved,
+                          reassembler.failed), (2, 1, 0))
+
+    def test_retrieve_failure(self):
+        self.messages[0x2000] = bytes(600)
+        self.fail_retrieve = True
+        received = []
+        reassembler = bigsend.Reassembler(
+            self.fake, self.mtapi,
+            lambda record, data: received.append(data))
+        reassembler.start()
+        self.fake.device.sendall(incoming_msg_ext(0x1234, 0x2000, 600))
+        self.run_reassembler(reassembler, lambda: not self.messages)
+        reassembler.stop()
+        self.assertEqual(received, [])
+        self.assertEqual(len(self.fake.written), 2)
+        self.assertEqual(reassembler.failed, 1)
+
+    def test_commands(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "image.bin")
+        data = os.urandom(500)
+        with open(path, "wb") as f:
+            f.write(data)
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["bigsend", "1234"]))
+            self.assertTrue(ui.execute(["bigsend", "1234", path]))
+            self.assertTrue(ui.execute(["bigrecv"]))
+            self.assertTrue(ui.execute(["bigrecv", directory.name]))
+        output = stdout.getvalue()
+        self.assertIn("Syntax: bigsend", output)
+        self.assertIn("Sent 500 bytes in 3 segments", output)
+        self.assertIn("Not saving incoming messages", output)
+        self.assertIn("Cannot save messages from a script", output)
+        self.assertEqual(self.delivered, data)
+
+
+if __name__ == "__main__":
+    unittest.main()
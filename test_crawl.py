@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+
+# test_crawl.py
+#
+# Unit tests for mapping the network
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import json
+import os
+import tempfile
+import keyboard
+import mtcmds
+import crawl
+from test_pipeline import FakeDevice, make_frame
+
+
+EXT_PAN_ID = bytes(range(8))
+
+# Neighbour tables of the fake network: (IEEE address, network
+# address, device type, relationship, depth, LQI) for each neighbour
+NETWORK = {
+    0x0000: [ (0xa1, 0x1001, 1, 1, 1, 200),
+              (0xa2, 0x1002, 1, 1, 1, 180) ],
+    0x1001: [ (0xa0, 0x0000, 0, 0, 0, 210),
+              (0xa2, 0x1002, 1, 2, 1, 90),
+              (0xb1, 0x2001, 2, 1, 2, 150) ],
+    0x1002: None
+}
+PAGE_SIZE = 2
+
+
+def lqi_rsp(src, start):
+    "The ZDO_MGMT_LQI_RSP for the page of `src`'s table from `start`"
+    table = NETWORK[src]
+    page = table[start:start+PAGE_SIZE]
+    body = bytearray(src.to_bytes(2, "little"))
+    body += bytes((0, len(table), start, len(page)))
+    for ieee, nwk, dev_type, relation, depth, lqi in page:
+        body += EXT_PAN_ID + ieee.to_bytes(8, "little")
+        body += nwk.to_bytes(2, "little")
+        body += bytes(((relation << 4) | (1 << 2) | dev_type, 0,
+                       depth, lqi))
+    return make_frame(0x45, 0xb1, bytes(body))
+
+
+def respond(frame):
+    "Answer ZDO_MGMT_LQI_REQs as the fake network would"
+    reply = make_frame(0x65, 0x31, b'\x00')
+    dst = frame[4] | (frame[5] << 8)
+    if NETWORK[dst] is not None:
+        reply += lqi_rsp(dst, frame[6])
+    return reply
+
+
+class CrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+
+    def crawl(self):
+        crawler = crawl.Crawler(self.fake, self.mtapi, window=4,
+                                timeout=0.05, retries=1)
+        crawler.crawl()
+        return crawler
+
+    def test_crawl(self):
+        crawler = self.crawl()
+        self.assertEqual(set(crawler.nodes), { 0xa0, 0xa1, 0xa2, 0xb1 })
+        self.assertEqual(crawler.unreachable, { 0x1002 })
+        # Each router once, two pages for 0x1001, one retry for 0x1002
+        requests = [(f[4] | (f[5] << 8), f[6]) for f in self.fake.written]
+        self.assertEqual(sorted(requests),
+                         [(0x0000, 0), (0x1001, 0), (0x1001, 2),
+                          (0x1002, 0), (0x1002, 0)])
+        graph = crawler.graph()
+        nodes = { node["id"]: node for node in graph["nodes"] }
+        self.assertEqual(len(nodes), 4)
+        node = nodes["00:00:00:00:00:00:00:b1"]
+        self.assertEqual(node["nwk"], "0x2001")
+        self.assertEqual(node["device_type"], "End Device")
+        self.assertEqual(node["depth"], 2)
+        self.assertFalse(nodes["00:00:00:00:00:00:00:a2"]["reachable"])
+        self.assertIn({ "source": "00:00:00:00:00:00:00:a1",
+                        "target": "00:00:00:00:00:00:00:b1",
+                        "lqi": 150, "relationship": "Child" },
+                      graph["links"])
+        self.assertEqual(len(graph["links"]), 5)
+
+    def test_save(self):
+        crawler = self.crawl()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "net.json")
+            crawler.save(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f), crawler.graph())
+            path = os.path.join(directory, "net.dot")
+            crawler.save(path)
+            with open(path) as f:
+                dot = f.read()
+        self.assertTrue(dot.startswith("digraph network {\n"))
+        self.assertIn('  "00:00:00:00:00:00:00:a0" -> '
+                      '"00:00:00:00:00:00:00:a1" [label="200"];\n', dot)
+
+    def test_command(self):
+        # 0x1002 refuses the request rather than ignoring it
+        def refuse(frame):
+            if frame[4:6] != b'\x02\x10':
+                return respond(frame)
+            return (make_frame(0x65, 0x31, b'\x00') +
+                    make_frame(0x45, 0xb1, b'\x02\x10\x84\x00\x00\x00'))
+        self.fake.respond = refuse
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["crawl"]))
+            self.assertTrue(ui.execute(["crawl", "x.json", "none"]))
+            self.assertEqual(self.fake.written, [])
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "net.json")
+                self.assertTrue(ui.execute(["crawl", path, "2"]))
+                self.assertTrue(os.path.exists(path))
+        self.assertIn("Found 4 nodes, 1 unreachable", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
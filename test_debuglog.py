@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+
+# test_debuglog.py
+#
+# Unit tests for the debug message log
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import time
+import keyboard
+import mtcmds
+import debuglog
+from test_pipeline import FakeDevice, make_frame
+
+
+def debug_msg(text):
+    "A DEBUG_MSG carrying `text`"
+    data = text.encode()
+    return make_frame(0x48, 0x00, bytes((len(data),)) + data)
+
+
+class DebugLogTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(lambda frame: b'')
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "decode"
+
+    def receive(self, *frames):
+        "Have the device send `frames` and read them all in"
+        self.fake.device.sendall(b''.join(frames))
+        self.mtapi.run_until(lambda: False, 0.05)
+
+    def test_text(self):
+        log = debuglog.DebugLog()
+        log.attach(self.mtapi)
+        with support.captured_stdout() as stdout:
+            self.receive(debug_msg("Joined PAN 1a2b\0"))
+        self.assertEqual(stdout.getvalue(), "DEBUG: Joined PAN 1a2b\n")
+        self.assertEqual(len(log), 1)
+        self.assertTrue(str(log.history()[0]).endswith(" Joined PAN 1a2b"))
+        log.detach(self.mtapi)
+        self.assertEqual(self.mtapi.events.subscriptions, [])
+
+    def test_repeats(self):
+        log = debuglog.DebugLog()
+        log.attach(self.mtapi)
+        with support.captured_stdout() as stdout:
+            self.receive(debug_msg("poll"), debug_msg("poll"),
+                         debug_msg("poll"), debug_msg("done"))
+        self.assertEqual(stdout.getvalue(),
+                         "DEBUG: poll\n"
+                         "DEBUG: (last message repeated 3 times)\n"
+                         "DEBUG: done\n")
+        entries = log.history()
+        self.assertEqual([(e.raw, e.count) for e in entries],
+                         [(b'poll', 3), (b'done', 1)])
+        self.assertTrue(str(entries[0]).endswith(" poll (x3)"))
+        self.assertEqual(log.received, 4)
+
+    def test_ring(self):
+        log = debuglog.DebugLog(size=3)
+        log.echo = False
+        for i in range(5):
+            log.add(b'message %d' % i, when=i)
+        self.assertEqual([e.raw for e in log.history()],
+                         [b'message 2', b'message 3', b'message 4'])
+        self.assertEqual([e.raw for e in log.history(2)],
+                         [b'message 3', b'message 4'])
+
+    def test_rate_limit(self):
+        log = debuglog.DebugLog(rate=20, burst=3)
+        with support.captured_stdout() as stdout:
+            for i in range(6):
+                log.add(b'burst %d' % i)
+            time.sleep(0.1)
+            log.add(b'later')
+        self.assertEqual(stdout.getvalue().splitlines(),
+                         ["DEBUG: burst 0", "DEBUG: burst 1",
+                          "DEBUG: burst 2",
+                          "DEBUG: (3 messages not shown)",
+                          "DEBUG: later"])
+        self.assertEqual(len(log), 7)
+
+    def test_display_off(self):
+        log = debuglog.DebugLog()
+        log.attach(self.mtapi)
+        self.mtapi.display = "none"
+        with support.captured_stdout() as stdout:
+            self.receive(debug_msg("quiet"))
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertEqual(len(log), 1)
+
+    def test_command(self):
+        log = debuglog.DebugLog()
+        log.echo = False
+        for i in range(30):
+            log.add(b'line %d' % i)
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["debuglog"]))
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False, debug_log=log)
+            self.assertTrue(ui.execute(["debuglog", "2"]))
+            self.assertTrue(ui.execute(["debuglog", "on"]))
+            self.assertTrue(log.echo)
+            self.assertTrue(ui.execute(["debuglog", "clear"]))
+            self.assertTrue(ui.execute(["debuglog", "x"]))
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], "No debug log is being kept")
+        self.assertTrue(lines[1].endswith(" line 28"))
+        self.assertTrue(lines[2].endswith(" line 29"))
+        self.assertEqual(lines[3], "30 messages received, 30 in the log")
+        self.assertEqual(len(log), 0)
+        self.assertIn("Syntax: debuglog", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+# test_devstate.py
+#
+# Unit tests for the device state tracker
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import threading
+import keyboard
+import mtcmds
+import devstate
+from test_pipeline import FakeDevice, make_frame
+
+
+IEEE = bytes.fromhex("0807060504030201")
+
+
+def state_change(state):
+    "A ZDO_STATE_CHANGE_IND for `state`"
+    return make_frame(0x45, 0xc0, bytes((state,)))
+
+
+def device_info(nwk, state):
+    "A UTIL_GET_DEVICE_INFO response for a coordinator"
+    body = (b'\x00' + IEEE + nwk.to_bytes(2, "little") +
+            bytes((0x01, state, 0)))
+    return make_frame(0x67, 0x00, body)
+
+
+class DeviceStateTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(lambda frame: b'')
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        self.device = devstate.DeviceState()
+        self.device.attach(self.mtapi)
+
+    def receive(self, *frames):
+        "Have the device send `frames` and read them all in"
+        self.fake.device.sendall(b''.join(frames))
+        self.mtapi.run_until(lambda: False, 0.05)
+
+    def test_parse_state(self):
+        self.assertEqual(devstate.parse_state("DEV_ZB_COORD"), 0x09)
+        self.assertEqual(devstate.parse_state("router"), 0x07)
+        self.assertEqual(devstate.parse_state("0x0a"), 0x0a)
+        for token in ("DEV_SLEEPY", "0x100"):
+            with self.assertRaises(ValueError):
+                devstate.parse_state(token)
+
+    def test_updates(self):
+        self.assertEqual(self.device.report(),
+                         ["Nothing heard from the device yet"])
+        self.receive(state_change(0x08), device_info(0x0000, 0x09))
+        self.assertEqual(self.device.state, 0x09)
+        self.assertEqual(self.device.ieee, 0x0102030405060708)
+        self.assertEqual(self.device.nwk, 0x0000)
+        report = self.device.report()
+        self.assertTrue(report[0].startswith(
+            "State: Started as Coordinator for "))
+        self.assertEqual(report[1:4],
+                         ["Device type: 01 (Coordinator)",
+                          "IEEE address: 01:02:03:04:05:06:07:08",
+                          "Network address: 0000"])
+
+    def test_join_and_leave(self):
+        self.receive(device_info(0xfffe, 0x03),
+                     make_frame(0x45, 0xc6, b'\x00\x34\x12\x00\x00'))
+        self.assertEqual((self.device.nwk, self.device.parent),
+                         (0x1234, 0x0000))
+        self.receive(make_frame(0x45, 0xc9,
+                                b'\x34\x12' + IEEE + b'\x00\x00\x01'))
+        self.assertIsNone(self.device.nwk)
+        self.assertEqual(self.device.report()[-1],
+                         "Last leave: 1234 (01:02:03:04:05:06:07:08), "
+                         "rejoining")
+
+    def test_reset(self):
+        self.receive(device_info(0x0000, 0x09),
+                     make_frame(0x41, 0x80, b'\x02\x02\x00\x02\x06\x03'))
+        self.assertIsNone(self.device.state)
+        self.assertIsNone(self.device.nwk)
+        self.assertEqual(self.device.ieee, 0x0102030405060708)
+        self.assertIn("Resets: 1, last Watchdog", self.device.report())
+        self.assertIn("Version: transport 2, product 0, release 2.6, "
+                      "hardware 3", self.device.report())
+
+    def test_wait_for(self):
+        timer = threading.Timer(0.05, self.fake.device.sendall,
+                                (state_change(0x07),))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertTrue(self.device.wait_for(self.mtapi, 0x07, 2))
+        self.assertFalse(self.device.wait_for(self.mtapi, 0x09, 0.05))
+
+    def test_commands(self):
+        self.receive(state_change(0x09))
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False, device=self.device)
+            self.assertTrue(ui.execute(["status"]))
+            self.assertTrue(ui.execute(["waitstate", "dev_zb_coord"]))
+            self.assertTrue(ui.execute(["waitstate", "router", "0.05"]))
+            self.assertTrue(ui.execute(["waitstate", "sleepy"]))
+        self.assertEqual(self.fake.written, [])
+        lines = stdout.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith(
+            "State: Started as Coordinator"))
+        self.assertEqual(lines[1:],
+                         ["Device is Started as Coordinator",
+                          "Timed out waiting for the device to be Routing",
+                          "Error: Unknown device state 'sleepy'"])
+
+
+if __name__ == "__main__":
+    unittest.main()
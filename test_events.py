@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+
+# test_events.py
+#
+# Unit tests for the decoded packet event bus
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import mtcmds
+import events
+from test_pipeline import FakeDevice, make_frame
+
+
+STATE_CHANGE = make_frame(0x45, 0xc0, b'\x09')
+NWK_ADDR_RSP = make_frame(0x45, 0x80, bytes(13))
+PING_RSP = make_frame(0x61, 0x01, b'\x79\x01')
+
+
+class EventBusTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(lambda frame: b'')
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        self.bus = self.mtapi.events
+        self.seen = []
+
+    def handler(self, key, record):
+        self.seen.append((key, record))
+
+    def receive(self, *frames):
+        "Have the device send `frames` and read them all in"
+        self.fake.device.sendall(b''.join(frames))
+        self.mtapi.run_until(lambda: False, 0.05)
+
+    def test_key(self):
+        self.bus.subscribe(self.handler, "AREQ", "ZDO", 0xc0)
+        self.receive(PING_RSP, STATE_CHANGE, NWK_ADDR_RSP)
+        self.assertEqual(self.seen, [(("AREQ", "ZDO", 0xc0),
+                                      {"State": 9})])
+
+    def test_patterns(self):
+        self.bus.subscribe(self.handler, "AREQ", "ZDO", "zdo_*_ind")
+        self.assertEqual(self.bus.handlers(("AREQ", "ZDO", 0xc0)),
+                         (self.handler,))
+        self.assertEqual(self.bus.handlers(("AREQ", "ZDO", 0x80)), ())
+        self.bus.subscribe(self.handler, subsystem_name="SYS")
+        self.assertEqual(self.bus.handlers(("SRSP", "SYS", 0x01)),
+                         (self.handler,))
+        self.receive(PING_RSP, STATE_CHANGE, NWK_ADDR_RSP)
+        self.assertEqual([key for key, _ in self.seen],
+                         [("SRSP", "SYS", 0x01), ("AREQ", "ZDO", 0xc0)])
+
+    def test_unsubscribed(self):
+        # A malformed packet is only noticed if it has to be decoded
+        self.receive(make_frame(0x45, 0xc0))
+        self.assertEqual(self.bus.errors, 0)
+        self.bus.subscribe(self.handler, "AREQ", "ZDO", 0xc0)
+        self.receive(make_frame(0x45, 0xc0))
+        self.assertEqual(self.bus.errors, 1)
+        self.assertEqual(self.seen, [])
+        self.bus.unsubscribe(self.handler)
+        self.assertEqual(self.bus.table, {})
+        self.receive(STATE_CHANGE)
+        self.assertEqual(self.seen, [])
+
+    def test_shared_decode(self):
+        records = []
+        self.bus.subscribe(lambda key, record: records.append(record),
+                           "AREQ", "ZDO", 0xc0)
+        self.bus.subscribe(lambda key, record: records.append(record),
+                           "AREQ")
+        self.receive(STATE_CHANGE)
+        self.assertEqual(len(records), 2)
+        self.assertIs(records[0], records[1])
+
+    def test_claim(self):
+        self.mtapi.display = "hex"
+        self.bus.subscribe(lambda key, record: True, "AREQ", "ZDO", 0xc0)
+        with support.captured_stdout() as stdout:
+            self.receive(STATE_CHANGE, PING_RSP)
+        self.assertEqual(stdout.getvalue(), PING_RSP.hex(" ") + "\n")
+
+    def test_unknown_commands(self):
+        bus = events.EventBus(mtcmds.MT_COMMANDS)
+        bus.subscribe(self.handler)
+        self.assertFalse(bus.publish("AREQ", "ZDO", 0x7f, b''))
+        self.assertEqual(self.seen, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
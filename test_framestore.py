@@ -0,0 +1,234 @@
+#! /usr/bin/env python3
+
+# test_framestore.py
+#
+# Unit tests for the frame store
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+import unittest
+from test import support
+import api
+import keyboard
+import mtapi
+import mtcmds
+import framestore
+from mtapi import ParseField, ParseVariable
+from test_pipeline import FakeDevice, make_frame
+
+
+def incoming(src, lqi, cluster=6, data=b'\x01'):
+    "The body of an AF_INCOMING_MSG from `src`"
+    command = mtcmds.find_command(0x44, 0x81)
+    return bytes(command.encode(dict(SrcAddr=src, LinkQuality=lqi,
+                                     ClusterId=cluster, Data=data)))
+
+
+class FrameStoreTest(unittest.TestCase):
+    def test_columns(self):
+        store = framestore.FrameStore()
+        number = store.add(0x44, 0x81, incoming(0x1234, 200), when=5.0)
+        store.add(0x61, 0x01, b'\x79\x01', when=6.0)
+        # Too short to hold the fields
+        store.add(0x44, 0x81, b'\x00\x00', when=7.0)
+        self.assertEqual(len(store), 3)
+        record = store.frame(number)
+        self.assertEqual(record["name"], "AF_INCOMING_MSG")
+        self.assertEqual((record["cmd0"], record["cmd1"]), (0x44, 0x81))
+        self.assertEqual(record["SrcAddr"], 0x1234)
+        self.assertEqual(record["LinkQuality"], 200)
+        self.assertEqual(record["ClusterId"], 6)
+        self.assertEqual(record["time"], 5.0)
+        self.assertEqual(record["body"], incoming(0x1234, 200))
+        self.assertNotIn("SrcAddr", store.frame(1))
+        self.assertNotIn("SrcAddr", store.frame(2))
+
+    def test_layout(self):
+        command = mtapi.MTAPICmd("TEST", [ParseVariable("Length", "Data"),
+                                          ParseField("After", 1)])
+        fixed, decoded = framestore.column_layout(command, ("After",))
+        self.assertEqual(fixed, [])
+        self.assertEqual(decoded, ["After"])
+        command = mtcmds.find_command(0x44, 0x81)
+        fixed, decoded = framestore.column_layout(
+            command, ("SrcAddr", "LinkQuality"))
+        self.assertEqual(fixed, [("SrcAddr", 4, 2), ("LinkQuality", 9, 1)])
+        self.assertEqual(decoded, [])
+
+    def test_decoded(self):
+        # Eight byte fields are decoded, and kept if they fit
+        store = framestore.FrameStore(columns=("IEEEAddr",))
+        for ieee in (0x0012_4b00_0102_0304, 0xffff_ffff_ffff_ffff):
+            body = bytes(4) + ieee.to_bytes(8, "little") + b'\x8e'
+            store.add(0x45, 0xc1, body)
+        self.assertEqual(store.frame(0)["IEEEAddr"], 0x0012_4b00_0102_0304)
+        self.assertNotIn("IEEEAddr", store.frame(1))
+        # Malformed packets have no values
+        store.add(0x45, 0xc1, b'\x00')
+        self.assertNotIn("IEEEAddr", store.frame(2))
+
+    def test_select(self):
+        store = framestore.FrameStore()
+        for i in range(20):
+            store.add(0x44, 0x81, incoming(i % 4, i), when=float(i))
+            store.add(0x44, 0x82, b'', when=float(i))
+        self.assertEqual(store.select(command="AF_INCOMING_MSG", SrcAddr=1),
+                         [2, 10, 18, 26, 34])
+        self.assertEqual(len(store.select(command="af_incoming_*")), 40)
+        self.assertEqual(store.select(SrcAddr={2, 3}, since=15.0),
+                         [30, 36, 38])
+        self.assertEqual(store.select(LinkQuality=range(3), until=1.0),
+                         [0])
+        # Times are floats, matched by value whether given as an
+        # integer or not
+        self.assertEqual(store.select(time=7), [14, 15])
+        self.assertEqual(store.select(time=7.0, command=0x4482), [15])
+        self.assertEqual(store.select(time=1.5), [])
+        self.assertEqual(store.select(time={2, 3.0}), [4, 5, 6, 7])
+        self.assertEqual(len(store.select()), 40)
+        self.assertRaises(ValueError, store.select, Nonsense=1)
+        self.assertRaises(ValueError, store.select, device="other")
+
+    def test_group(self):
+        store = framestore.FrameStore()
+        for i in range(12):
+            store.add(0x44, 0x81, incoming(i % 3, 100 + i))
+        store.add(0x61, 0x01, b'\x79\x01')
+        groups = store.group("SrcAddr", "LinkQuality",
+                             command="AF_INCOMING_MSG")
+        self.assertEqual(sorted(groups), [0, 1, 2])
+        self.assertEqual(groups[1].count, 4)
+        self.assertEqual(groups[1].mean(), 100 + (1 + 4 + 7 + 10) / 4)
+        self.assertEqual((groups[1].minimum, groups[1].maximum),
+                         (101, 110))
+        counts = store.group("command")
+        self.assertEqual(counts[0x4481].count, 12)
+        self.assertEqual(counts[0x6101].count, 1)
+        self.assertRaises(ValueError, store.group, "Nonsense")
+
+    def test_capacity(self):
+        store = framestore.FrameStore(capacity=5)
+        for i in range(12):
+            store.add(0x44, 0x81, incoming(i, i))
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.first, 7)
+        self.assertEqual(store.select(), [7, 8, 9, 10, 11])
+        self.assertEqual(store.select(SrcAddr=range(9)), [7, 8])
+        self.assertEqual(store.frame(11)["SrcAddr"], 11)
+        self.assertRaises(IndexError, store.frame, 6)
+        self.assertEqual(len(store.times), 5)
+
+    def test_arena(self):
+        # The arena only has room for a few bodies
+        store = framestore.FrameStore(arena_size=600)
+        bodies = [bytes((i,)) * 200 for i in range(10)]
+        for body in bodies:
+            store.add(0x48, 0x00, body)
+            self.assertLessEqual(len(store.arena), 600)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.body(7), bodies[7])
+        self.assertEqual(store.body(9), bodies[9])
+        store.add(0x48, 0x00, bytes(250))
+        self.assertEqual(store.select(), [9, 10])
+        self.assertEqual(store.body(9), bodies[9])
+        self.assertEqual(store.body(10), bytes(250))
+        store.add(0x48, 0x00, b'')
+        self.assertEqual(store.body(11), b'')
+        self.assertEqual(len(store), 3)
+        store.clear()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.select(), [])
+
+    def test_wrap(self):
+        # Every body held must survive others going back to the start
+        # of the arena, whatever their lengths
+        store = framestore.FrameStore(capacity=10,
+                                      arena_size=2 * framestore.MAX_BODY)
+        rng = random.Random(0)
+        bodies = []
+        for i in range(500):
+            body = bytes((i & 0xff,)) * rng.randint(0, framestore.MAX_BODY)
+            bodies.append(body)
+            self.assertEqual(store.add(0x48, 0x00, body), i)
+            for number in store.select():
+                self.assertEqual(store.body(number), bodies[number])
+            self.assertLessEqual(len(store.arena), store.arena_size)
+
+    def test_limits(self):
+        self.assertRaises(ValueError, framestore.FrameStore, capacity=0)
+        self.assertRaises(ValueError, framestore.FrameStore, capacity=-1)
+        self.assertRaises(ValueError, framestore.FrameStore, arena_size=300)
+        store = framestore.FrameStore()
+        self.assertRaises(ValueError, store.add, 0x48, 0x00, bytes(256))
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(lambda frame: b'')
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+
+    def receive(self, *frames):
+        "Have the device send `frames` and read them all in"
+        self.fake.device.sendall(b''.join(frames))
+        self.mtapi.run_until(lambda: False, 0.05)
+
+    def test_attach(self):
+        store = framestore.FrameStore()
+        store.attach(self.mtapi, "coordinator")
+        self.receive(make_frame(0x44, 0x81, incoming(0x55, 9)),
+                     make_frame(0x61, 0x01, b'\x79\x01'))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.frame(0)["device"], "coordinator")
+        self.assertEqual(store.select(device="coordinator", SrcAddr=0x55),
+                         [0])
+        store.detach(self.mtapi)
+        self.assertEqual(self.mtapi.listeners, [])
+
+    def test_command(self):
+        ui = keyboard.UIHandler(self.fake, self.mtapi, interactive=False)
+        with support.captured_stdout() as stdout:
+            self.assertTrue(ui.execute(["capture"]))
+            self.assertTrue(ui.execute(["capture", "on", "100"]))
+            self.receive(make_frame(0x44, 0x81, incoming(0x55, 10)),
+                         make_frame(0x44, 0x81, incoming(0x55, 20)),
+                         make_frame(0x44, 0x81, incoming(0x66, 30)))
+            self.assertTrue(ui.execute(["capture", "group", "srcaddr",
+                                        "linkquality",
+                                        "AF_INCOMING_MSG"]))
+            self.assertTrue(ui.execute(["capture", "group", "command"]))
+            self.assertTrue(ui.execute(["capture", "group", "x"]))
+            self.assertTrue(ui.execute(["capture", "off"]))
+            self.receive(make_frame(0x44, 0x81, incoming(0x55, 10)))
+            self.assertTrue(ui.execute(["capture"]))
+            self.assertTrue(ui.execute(["capture", "x"]))
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], "No packets are being kept")
+        self.assertEqual(lines[1], "0x0055: 2, mean 15.00, min 10, max 20")
+        self.assertEqual(lines[2], "0x0066: 1, mean 30.00, min 30, max 30")
+        self.assertEqual(lines[3], "2 groups")
+        self.assertEqual(lines[4], "AF_INCOMING_MSG: 3")
+        self.assertEqual(lines[6], "Unknown column x")
+        self.assertEqual(lines[7], "3 packets received, 3 kept")
+        self.assertIn("Syntax: capture", stdout.getvalue())
+        self.assertEqual(ui.frame_store.capacity, 100)
+        self.assertIs(api.ScriptAPI(ui).frames, ui.frame_store)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+
+# test_fuzz.py
+#
+# Unit tests for the decoder fuzzer and malformed input
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import io
+import random
+import fuzz
+import mtapi
+import mtcmds
+from test_pipeline import make_frame
+
+
+class Fragile:
+    "A field description that fails the way a buggy one might"
+    name = "Fragile"
+
+    def decode(self, data, offset, record):
+        record[self.name] = data[offset+2]
+        return offset + 3
+
+    def parse(self, data, offset, indent=0):
+        return self.decode(data, offset, {})
+
+    def encode(self, record, out):
+        out += bytes(3)
+
+
+class FuzzTest(unittest.TestCase):
+    def test_mutations(self):
+        bodies = list(fuzz.mutations(b'\x02\x01\x00', random.Random(0), 5))
+        # Every truncation
+        for end in range(3):
+            self.assertIn(b'\x02\x01\x00'[:end], bodies)
+        # Bad counts
+        self.assertIn(b'\xff\x01\x00', bodies)
+        self.assertIn(b'\x02\x01\x80', bodies)
+        self.assertEqual(len(bodies), 3 + 2 + 3 * len(fuzz.EXTREMES) + 5)
+        self.assertTrue(all(len(body) <= fuzz.MAX_BODY for body in bodies))
+
+    def test_failure(self):
+        command = mtapi.MTAPICmd("FRAGILE", [ Fragile() ])
+        report = fuzz.fuzz_command(command, random.Random(0), 5)
+        self.assertGreater(report.cases, 0)
+        self.assertTrue(report.failures)
+        self.assertIsInstance(report.failures[0][1], IndexError)
+
+    def test_slow(self):
+        command = mtapi.MTAPICmd("TEST", [ mtapi.ParseField("A", 1) ])
+        report = fuzz.fuzz_command(command, random.Random(0), 5, limit=0)
+        self.assertEqual(len(report.slow), 2 * report.cases)
+        self.assertEqual(report.failures, [])
+
+    def test_all_commands(self):
+        for report in fuzz.fuzz_commands(seed=1, count=2, limit=1.0):
+            self.assertEqual(report.failures, [], report.command.name)
+            self.assertEqual(report.slow, [], report.command.name)
+
+    def test_stream(self):
+        stream = fuzz.garbage_stream(random.Random(0), 500)
+        packets, malformed, elapsed = fuzz.fuzz_stream(stream)
+        self.assertGreater(packets, 0)
+        self.assertGreater(malformed, 0)
+        packets_none, malformed, elapsed = fuzz.fuzz_stream(stream, "none")
+        self.assertEqual(packets_none, packets)
+        self.assertEqual(malformed, 0)
+
+
+class MalformedTest(unittest.TestCase):
+    def test_work(self):
+        # A SYS_PING SRSP one byte short, then a good one
+        source = io.BytesIO(make_frame(0x61, 0x01, b'\x79') +
+                            make_frame(0x61, 0x01, b'\x79\x01'))
+        receiver = mtcmds.MTAPI(source)
+        with support.captured_stdout() as stdout:
+            while source.tell() < len(source.getvalue()):
+                self.assertTrue(receiver.work())
+        self.assertEqual(receiver.malformed, 1)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[2], "Error: Field Capabilities missing")
+        self.assertEqual(lines[3:5], ["SRSP SYS Cmd = 01", "  SYS_PING"])
+
+    def test_call_raises(self):
+        receiver = mtcmds.MTAPI(io.BytesIO(make_frame(0x61, 0x01, b'\x79')))
+        with support.captured_stdout():
+            with self.assertRaises(mtapi.ParseError):
+                while True:
+                    receiver()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+
+# test_linktest.py
+#
+# Unit tests for the serial link tester
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import time
+import keyboard
+import mtcmds
+import linktest
+from test_pipeline import FakeDevice, make_frame
+
+
+class LinkTestTest(unittest.TestCase):
+    def setUp(self):
+        self.previous = None
+        self.corrupt = set()
+        self.drop = set()
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+
+    def respond(self, frame):
+        "Echo UTIL_LOOPBACK, misbehaving on request"
+        self.assertEqual(frame[2:4], b'\x27\x10')
+        number = len(self.fake.written) - 1
+        payload = frame[4:-1]
+        reply = b''
+        if self.previous is not None:
+            # The late echo of a dropped frame
+            reply = make_frame(0x67, 0x10, self.previous)
+            self.previous = None
+        if number in self.drop:
+            self.previous = payload
+            return reply
+        if number in self.corrupt:
+            payload = payload[:-1] + bytes((payload[-1] ^ 1,))
+        return reply + make_frame(0x67, 0x10, payload)
+
+    def test_clean(self):
+        test = linktest.LinkTest(self.fake, self.mtapi, 100)
+        test.run(50)
+        self.assertEqual((test.sent, test.ok, test.corrupt, test.lost),
+                         (50, 50, 0, 0))
+        self.assertEqual(len(test.latencies), 50)
+        self.assertEqual(test.error_rate(), 0.0)
+        payloads = [frame[4:-1] for frame in self.fake.written]
+        self.assertEqual(len(set(payloads)), 50)
+        self.assertTrue(all(len(p) == 100 for p in payloads))
+        payload, wire = test.throughput()
+        self.assertAlmostEqual(wire / payload, 2 * 105 / 100)
+
+    def test_errors(self):
+        self.corrupt.add(3)
+        self.drop.add(5)
+        test = linktest.LinkTest(self.fake, self.mtapi, 16, timeout=0.05)
+        test.run(10)
+        self.assertEqual((test.sent, test.ok, test.corrupt, test.lost,
+                          test.late), (10, 8, 1, 1, 1))
+        self.assertAlmostEqual(test.error_rate(), 0.2)
+        report = test.report()
+        self.assertTrue(report[0].endswith(
+                         "8 ok, 1 corrupt, 1 lost (20.00% errors)"))
+        self.assertIn("1 late", report[1])
+        self.assertTrue(report[2].startswith("Round trip (ms): min "))
+
+    def test_rate(self):
+        test = linktest.LinkTest(self.fake, self.mtapi, 0, rate=100)
+        start = time.monotonic()
+        test.run(6)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(test.ok, 6)
+
+    def test_limits(self):
+        for size, rate in ((-1, None), (251, None), (10, 0)):
+            with self.assertRaises(ValueError):
+                linktest.LinkTest(self.fake, self.mtapi, size, rate)
+
+    def test_command(self):
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["linktest", "10"]))
+            self.assertTrue(ui.execute(["linktest", "10", "300"]))
+            self.assertEqual(self.fake.written, [])
+            self.assertTrue(ui.execute(["linktest", "10", "32"]))
+        output = stdout.getvalue()
+        self.assertIn("Sent 10 frames of 32 bytes", output)
+        self.assertIn("Throughput:", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -754,6 +754,65 @@ class TestRepeated(unittest.TestCase):
                          "        Test2 : 0xdc 0xba\n")
 
 
+    def test_bad_count(self):
+        field = mtapi.ParseRepeated("Count", "Data",
+                                    (mtapi.ParseField("Test1", 1),
+                                     mtapi.ParseField("Test2", 2)))
+        self.assertEqual(field.entry_length, 3)
+        # Nothing is displayed if the count cannot be right
+        with support.captured_stdout() as stdout:
+            with self.assertRaises(mtapi.ParseError):
+                field.parse(b'\xff\x11\x22\x33', 0)
+        self.assertEqual(stdout.getvalue(), "")
+        with self.assertRaises(mtapi.ParseError):
+            field.decode(b'\x02\x11\x22\x33\x44\x55', 0, {})
+
+    def test_variable_entries(self):
+        field = mtapi.ParseRepeated("Count", "Data",
+                                    (mtapi.ParseVariable("Len", "Bytes"),))
+        self.assertIsNone(field.entry_length)
+        record = {}
+        self.assertEqual(field.decode(b'\x02\x01\xaa\x00', 0, record), 4)
+        self.assertEqual(record["Data"], [ { "Len": 1, "Bytes": b'\xaa' },
+                                           { "Len": 0, "Bytes": b'' } ])
+        with self.assertRaises(mtapi.ParseError):
+            field.decode(b'\x03\x01\xaa\x00', 0, record)
+
+    def test_layout(self):
+        fields = (mtapi.ParseField("Addr", 2),
+                  mtapi.ParseField("Ext", 8),
+                  mtapi.ParseField("Key", 16),
+                  mtapi.ParseBitFields((("Hi", 0xf0), ("Lo", 0x0f))))
+        field = mtapi.ParseRepeated("Count", "Data", fields)
+        self.assertIsNotNone(field.layout)
+        self.assertEqual(field.layout[0].size, field.entry_length)
+        data = b'\x02' + bytes(range(27)) + bytes(range(27, 54))
+        record = {}
+        self.assertEqual(field.decode(data, 0, record), len(data))
+        offset = 1
+        for entry in record["Data"]:
+            expected, offset = mtapi.decode_generic(fields, data, offset)
+            self.assertEqual(entry, expected)
+        self.assertEqual(record["Data"][1]["Hi"], 0x3)
+        self.assertEqual(record["Data"][1]["Lo"], 0x5)
+        # Fields that cannot be unpacked in one go
+        self.assertIsNone(mtapi.entry_layout([mtapi.ParseField("A", 3)]))
+        self.assertIsNone(mtapi.entry_layout(
+            [mtapi.ParseAddress("Mode", "Addr")]))
+        self.assertIsNone(mtapi.entry_layout(
+            [mtapi.ParseField("A", 1), mtapi.ParseField("A", 1)]))
+
+    def test_fixed_length(self):
+        self.assertEqual(mtapi.fixed_length([]), 0)
+        self.assertEqual(mtapi.fixed_length(
+            [ mtapi.ParseField("A", 2),
+              mtapi.ParseBitFields((("Hi", 0xf0), ("Lo", 0x0f))),
+              mtapi.ParseAddress("Mode", "Addr"),
+              mtapi.ParseTime() ]), 23)
+        self.assertIsNone(mtapi.fixed_length(
+            [ mtapi.ParseField("A", 2), mtapi.ParseRemaining("Rest") ]))
+
+
 class TestSecurityKey(unittest.TestCase):
     def test_missing_field(self):
         field = mtapi.ParseKey("Source", "Level", "Id", "Index")
@@ -1004,6 +1063,145 @@ class TestTime(unittest.TestCase):
                          "      Day : 17\n"
                          "      Year : 2001\n")
 
+class TestDecode(unittest.TestCase):
+    def test_field(self):
+        record = {}
+        field = mtapi.ParseField("Test", 2)
+        self.assertEqual(field.decode(b'\x00\x34\x12', 1, record), 3)
+        self.assertEqual(record, { "Test": 0x1234 })
+        field = mtapi.ParseField("Key", 9)
+        self.assertEqual(field.decode(bytes(range(9)), 0, record), 9)
+        self.assertEqual(record["Key"], bytes(range(9)))
+        with self.assertRaises(mtapi.ParseError):
+            field.decode(bytes(8), 0, record)
+
+    def test_lists(self):
+        record = {}
+        field = mtapi.ParseClusterList("Count", "List")
+        self.assertEqual(field.decode(b'\x02\x01\x00\x06\x00', 0,
+                                      record), 5)
+        self.assertEqual(record, { "Count": 2, "List": [0x0001, 0x0006] })
+        self.assertEqual(field.decode(b'\xff\x00\x34\x12\x01', 1,
+                                      record), 2)
+        self.assertEqual(record, { "Count": 0, "List": [] })
+        self.assertEqual(mtapi.read_hwords(b'\x00\x34\x12\xff\xff', 1, 2),
+                         [0x1234, 0xffff])
+        with self.assertRaises(mtapi.ParseError):
+            field.decode(b'\x02\x01\x00\x06', 0, record)
+        field = mtapi.ParseVariable("Len", "Data", 2, limit=4)
+        self.assertEqual(field.decode(b'\x03\x00abcd', 0, record), 5)
+        self.assertEqual(record["Len"], 3)
+        self.assertEqual(record["Data"], b'abc')
+        with self.assertRaises(mtapi.ParseError):
+            field.decode(b'\x05\x00abcde', 0, record)
+        field = mtapi.ParseExtData("Len", "Ext", 2)
+        self.assertEqual(field.decode(b'\x03\x00', 0, record), 2)
+        self.assertIsNone(record["Ext"])
+        field = mtapi.ParseRemaining("Rest")
+        self.assertEqual(field.decode(b'abc', 1, record), 3)
+        self.assertEqual(record["Rest"], b'bc')
+
+    def test_addresses(self):
+        record = {}
+        field = mtapi.ParseAddress("Mode", "Addr")
+        data = b'\x03\x01\x02\x03\x04\x05\x06\x07\x08'
+        self.assertEqual(field.decode(data, 0, record), 9)
+        self.assertEqual(record, { "Mode": 3,
+                                   "Addr": 0x0807060504030201 })
+        field = mtapi.ParseBindAddress("Mode", "Addr", "Ep")
+        record = {}
+        self.assertEqual(field.decode(b'\x02\x34\x12', 0, record), 3)
+        self.assertEqual(record, { "Mode": 2, "Addr": 0x1234 })
+        with self.assertRaises(mtapi.ParseError):
+            field.decode(data, 0, record)
+
+    def test_repeated(self):
+        field = mtapi.ParseRepeated("Count", "Data",
+                                    (mtapi.ParseField("Test1", 1),
+                                     mtapi.ParseBitFields((("Hi", 0xf0),
+                                                           ("Lo", 0x0f)))))
+        record = {}
+        self.assertEqual(field.decode(b'\x02\x11\x2a\x33\x4b', 0,
+                                      record), 5)
+        self.assertEqual(record, { "Count": 2,
+                                   "Data": [ { "Test1": 0x11,
+                                               "Hi": 2, "Lo": 0xa },
+                                             { "Test1": 0x33,
+                                               "Hi": 4, "Lo": 0xb } ] })
+        with self.assertRaises(mtapi.ParseError):
+            field.decode(b'\x02\x11\x2a\x33', 0, record)
+
+    def test_command(self):
+        command = mtapi.MTAPICmd("TEST", [ mtapi.ParseField("A", 1),
+                                           mtapi.ParseTime() ])
+        data = b'\x05\x10\x00\x00\x00\x01\x02\x03\x04\x05\xe0\x07'
+        self.assertEqual(command.decode(data),
+                         { "A": 5, "UTCTime": 16, "Hour": 1, "Minute": 2,
+                           "Second": 3, "Month": 4, "Day": 5,
+                           "Year": 2016 })
+        with self.assertRaises(mtapi.ParseError):
+            command.decode(data + b'\x00')
+
+
+class TestEncode(unittest.TestCase):
+    def round_trip(self, field, data):
+        "Check that `data` decodes and encodes back to itself"
+        record = {}
+        self.assertEqual(field.decode(data, 0, record), len(data))
+        out = bytearray()
+        field.encode(record, out)
+        self.assertEqual(out, data)
+
+    def test_fields(self):
+        self.round_trip(mtapi.ParseField("Test", 2), b'\x34\x12')
+        self.round_trip(mtapi.ParseField("Key", 9), bytes(range(9)))
+        self.round_trip(mtapi.ParseClusterList("Count", "List"),
+                        b'\x02\x01\x00\x06\x00')
+        self.round_trip(mtapi.ParseVariable("Len", "Data", 2),
+                        b'\x03\x00abc')
+        self.round_trip(mtapi.ParseExtData("Len", "Ext", 2), b'\x03\x00')
+        self.round_trip(mtapi.ParseRemaining("Rest"), b'abc')
+        self.round_trip(mtapi.ParseAddress("Mode", "Addr"),
+                        b'\x03\x01\x02\x03\x04\x05\x06\x07\x08')
+        self.round_trip(mtapi.ParseAddress("Mode", "Addr"),
+                        b'\x02\x34\x12' + bytes(6))
+        self.round_trip(mtapi.ParseBindAddress("Mode", "Addr", "Ep"),
+                        b'\x03\x01\x02\x03\x04\x05\x06\x07\x08\x09')
+        self.round_trip(mtapi.ParseInterPan(), b'\x03\x34\x12\x08')
+        self.round_trip(mtapi.ParseKey("Src", "Sec", "Mode", "Index"),
+                        bytes(range(8)) + b'\x05\x01\x02')
+        self.round_trip(mtapi.ParseRepeated(
+            "Count", "Data",
+            (mtapi.ParseField("Test1", 1),
+             mtapi.ParseBitFields((("Hi", 0xf0), ("Lo", 0x0f))))),
+                        b'\x02\x11\x2a\x33\x4b')
+
+    def test_wrong_length(self):
+        field = mtapi.ParseField("Key", 9)
+        with self.assertRaises(mtapi.ParseError):
+            field.encode({ "Key": bytes(8) }, bytearray())
+
+    def test_command(self):
+        command = mtapi.MTAPICmd("TEST", [ mtapi.ParseField("A", 1),
+                                           mtapi.ParseTime() ])
+        self.assertEqual(command.encode({ "A": 5, "UTCTime": 16, "Hour": 1,
+                                          "Minute": 2, "Second": 3,
+                                          "Month": 4, "Day": 5,
+                                          "Year": 2016 }),
+                         b'\x05\x10\x00\x00\x00\x01\x02\x03\x04\x05\xe0\x07')
+        # Missing fields are zero or empty
+        self.assertEqual(command.encode({}), bytes(12))
+
+
+class TestFcs(unittest.TestCase):
+    def test_fcs(self):
+        self.assertEqual(mtapi.calculate_fcs(b''), 0)
+        self.assertEqual(mtapi.calculate_fcs(b'\x00\x21\x01'), 0x20)
+        self.assertEqual(mtapi.calculate_fcs(b'\x02\x61\x01\x79\x01'),
+                         0x1a)
+        self.assertEqual(mtapi.calculate_fcs(bytearray(b'\xff\xff')), 0)
+
+
 class TestParseHword(unittest.TestCase):
     def test_hword(self):
         field = mtapi.ParseField("Test", 2,
@@ -86,6 +86,35 @@ class TestParseInteger(FieldTest, unittest.TestCase):
         self.assertFalse(field.parse_token("StillNaN", buf))
 
 
+class TestParseVariable(FieldTest, unittest.TestCase):
+    def test_byte_list(self):
+        field = mtapi.ParseVariable("Len", "Data")
+        self.field_test_ok(field, "", b'\x00')
+        self.field_test_ok(field, "01", b'\x01\x01')
+        self.field_test_ok(field, "0102ff", b'\x03\x01\x02\xff')
+        self.field_test_ok(field, "01:02:ff", b'\x03\x01\x02\xff')
+
+        buf = bytearray()
+        self.assertFalse(field.parse_token("1", buf))
+        self.assertFalse(field.parse_token("0x01", buf))
+        self.assertFalse(field.parse_token("Wombat", buf))
+
+    def test_wide_length(self):
+        field = mtapi.ParseVariable("Len", "Data", len_bytes=2)
+        self.field_test_ok(field, "", b'\x00\x00')
+        self.field_test_ok(field, "a5:5a", b'\x02\x00\xa5\x5a')
+        self.field_test_ok(field, "00" * 256, b'\x00\x01' + bytes(256))
+
+    def test_limit(self):
+        field = mtapi.ParseVariable("Len", "Data", limit=2)
+        self.field_test_ok(field, "1234", b'\x02\x12\x34')
+
+        buf = bytearray()
+        self.assertFalse(field.parse_token("123456", buf))
+        field = mtapi.ParseVariable("Len", "Data")
+        self.assertFalse(field.parse_token("00" * 256, buf))
+
+
 class DictTest(FieldTest, unittest.TestCase):
     def dictionary_test(self, parser, ok_params, fail_params, width=1):
         field = mtapi.ParseField("Test", width, parser=parser)
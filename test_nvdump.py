@@ -0,0 +1,211 @@
+#! /usr/bin/env python3
+
+# test_nvdump.py
+#
+# Unit tests for NV snapshots
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import os
+import tempfile
+import keyboard
+import mtcmds
+import nvdump
+from test_pipeline import FakeDevice, make_frame
+
+
+# Bytes the fake device returns for each read
+READ_SIZE = 100
+
+
+class NvDumpTest(unittest.TestCase):
+    def setUp(self):
+        self.nv = { 0x0001: bytes(range(8)),
+                    0x0021: bytes(range(120)),
+                    0x0022: bytes(i & 0xff for i in range(600)),
+                    0x0081: b'\x55' * 21 }
+        self.bad = set()
+        self.read_only = set()
+        self.no_room = set()
+        self.writes = []
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def respond(self, frame):
+        "Answer the OSAL NV requests from self.nv"
+        nv_id = frame[4] | (frame[5] << 8)
+        data = self.nv.get(nv_id, b'')
+        if frame[3] == 0x07:
+            length = frame[6] | (frame[7] << 8)
+            if nv_id in self.nv:
+                return make_frame(0x61, 0x07, b'\x00')
+            if nv_id in self.no_room:
+                return make_frame(0x61, 0x07, b'\x0a')
+            self.nv[nv_id] = bytes(length)
+            return make_frame(0x61, 0x07, b'\x09')
+        if frame[3] in (0x09, 0x1d):
+            if frame[3] == 0x09:
+                offset, body = frame[6], frame[8:-1]
+            else:
+                offset, body = frame[6] | (frame[7] << 8), frame[9:-1]
+            if nv_id in self.read_only:
+                return make_frame(0x61, frame[3], b'\x0a')
+            self.writes.append((nv_id, offset, len(body)))
+            self.nv[nv_id] = data[:offset] + body + data[offset+len(body):]
+            return make_frame(0x61, frame[3], b'\x00')
+        if frame[3] == 0x13:
+            return make_frame(0x61, 0x13, len(data).to_bytes(2, "little"))
+        if frame[3] == 0x08:
+            offset = frame[6]
+        else:
+            self.assertEqual(frame[3], 0x1c)
+            offset = frame[6] | (frame[7] << 8)
+            self.assertGreater(offset, 0xff)
+        if nv_id in self.bad:
+            return make_frame(0x61, frame[3], b'\x0a\x00')
+        chunk = data[offset:offset+READ_SIZE]
+        return make_frame(0x61, frame[3], bytes((0, len(chunk))) + chunk)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_dump(self):
+        dump = nvdump.NvDump(self.fake, self.mtapi)
+        self.assertEqual(dump.run(), self.nv)
+        self.assertEqual(dump.failed, [])
+        # One length request per known item, then 1+2+6+1 reads
+        self.assertEqual(len(self.fake.written), len(nvdump.NV_ITEMS) + 10)
+
+    def test_failure(self):
+        self.bad.add(0x0021)
+        dump = nvdump.NvDump(self.fake, self.mtapi, [0x0001, 0x0021],
+                             timeout=0.05, retries=1)
+        self.assertEqual(dump.run(), { 0x0001: self.nv[0x0001] })
+        self.assertEqual(dump.failed, [0x0021])
+
+    def test_snapshot(self):
+        nvdump.save_snapshot(self.path("a.nv"), self.nv)
+        self.assertEqual(nvdump.load_snapshot(self.path("a.nv")), self.nv)
+        with open(self.path("a.nv"), "rb") as f:
+            contents = f.read()
+        self.assertEqual(len(contents),
+                         5 + 4*len(self.nv) + sum(map(len,
+                                                      self.nv.values())))
+        with open(self.path("b.nv"), "wb") as f:
+            f.write(contents[:-1])
+        with self.assertRaises(ValueError):
+            nvdump.load_snapshot(self.path("b.nv"))
+
+    def test_diff(self):
+        after = dict(self.nv)
+        del after[0x0001]
+        after[0x0003] = b'\x02'
+        after[0x0081] = b'\x55' * 4 + b'\xaa\xaa' + b'\x55' * 16
+        self.assertEqual(nvdump.diff_snapshots(self.nv, self.nv), [])
+        self.assertEqual(nvdump.diff_snapshots(self.nv, after),
+                         [ "0x0001 EXTADDR: removed",
+                           "0x0003 STARTUP_OPTION: added, 1 bytes",
+                           "0x0081 NWKKEY: 3 bytes differ from offset 4 "
+                           "(length 21 -> 22)" ])
+
+    def test_changed_windows(self):
+        old = bytes(200)
+        self.assertEqual(nvdump.changed_windows(old, old), [])
+        new = bytearray(old)
+        new[5] = new[40] = new[199] = 1
+        self.assertEqual(nvdump.changed_windows(old, bytes(new)),
+                         [ (0, bytes(new[0:64])),
+                           (192, bytes(new[192:200])) ])
+        self.assertEqual(nvdump.changed_windows(None, b'\x01' * 500),
+                         [ (0, b'\x01' * 224), (224, b'\x01' * 224),
+                           (448, b'\x01' * 52) ])
+
+    def test_restore(self):
+        snapshot = dict(self.nv)
+        snapshot[0x0022] = (snapshot[0x0022][:300] + b'\xff' +
+                            snapshot[0x0022][301:])
+        snapshot[0x0082] = b'\x34\x12'
+        snapshot[0x0081] = b'\x55' * 16
+        restore = nvdump.NvRestore(self.fake, self.mtapi, snapshot)
+        self.assertFalse(restore.run())
+        self.assertEqual(restore.resized, [0x0081])
+        self.assertEqual(restore.created, [0x0082])
+        self.assertEqual(restore.unchanged, 2)
+        self.assertEqual(self.writes, [(0x0022, 288, 32), (0x0082, 0, 2)])
+        self.assertEqual(restore.bytes_written, 34)
+        self.assertEqual(self.nv[0x0022], snapshot[0x0022])
+        self.assertEqual(self.nv[0x0082], b'\x34\x12')
+        # A second restore finds nothing to do
+        self.writes = []
+        del snapshot[0x0081]
+        restore = nvdump.NvRestore(self.fake, self.mtapi, snapshot)
+        self.assertTrue(restore.run())
+        self.assertEqual(self.writes, [])
+        self.assertEqual(restore.unchanged, 4)
+
+    def test_restore_failure(self):
+        snapshot = { 0x0001: b'\xff' * 8, 0x0021: b'' }
+        self.read_only.add(0x0001)
+        self.bad.add(0x0021)
+        restore = nvdump.NvRestore(self.fake, self.mtapi, snapshot,
+                                   timeout=0.05, retries=1)
+        self.assertFalse(restore.run())
+        self.assertEqual(restore.unreadable, [0x0021])
+        self.assertEqual(restore.failed, [(0x0001, 0)])
+        self.assertEqual(restore.bytes_written, 0)
+        # An item that cannot be created is not written
+        self.no_room.add(0x0082)
+        restore = nvdump.NvRestore(self.fake, self.mtapi,
+                                   { 0x0082: b'\x34\x12' },
+                                   timeout=0.05, retries=1)
+        self.assertFalse(restore.run())
+        self.assertEqual(restore.created, [])
+        self.assertEqual(restore.failed, [(0x0082, None)])
+        self.assertEqual(restore.writes, 0)
+        self.assertNotIn(0x0082, self.nv)
+
+    def test_commands(self):
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["nvdump", self.path("a.nv"),
+                                        "1", "0x21", "0x99"]))
+            self.nv[0x0021] = b'\x01' + self.nv[0x0021][1:]
+            self.assertTrue(ui.execute(["nvdump", self.path("b.nv")]))
+            self.assertTrue(ui.execute(["nvdiff", self.path("a.nv"),
+                                        self.path("b.nv")]))
+            self.assertTrue(ui.execute(["nvdiff", self.path("a.nv"),
+                                        self.path("missing.nv")]))
+            self.assertTrue(ui.execute(["nvrestore", self.path("a.nv")]))
+        output = stdout.getvalue()
+        self.assertIn("Saved 2 items (128 bytes)", output)
+        self.assertIn("0x0022 DEVICE_LIST: added, 600 bytes", output)
+        self.assertIn("0x0021 NIB: 1 bytes differ from offset 0", output)
+        self.assertIn("Unable to read", output)
+        self.assertIn("Restored 2 items", output)
+        self.assertIn("1 writes (32 bytes)", output)
+        self.assertEqual(self.nv[0x0021][0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
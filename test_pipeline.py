@@ -0,0 +1,197 @@
+#! /usr/bin/env python3
+
+# test_pipeline.py
+#
+# Unit tests for keeping many requests in flight
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+import unittest.mock
+import time
+import socket
+import mtcmds
+from mtapi import calculate_fcs, ParseError
+import pipeline
+
+
+PING_FRAME = b'\xfe\x00\x21\x01\x20'
+LQI_RSP_KEY = ("AREQ", "ZDO", 0xb1)
+
+
+def make_frame(cmd0, cmd1, body=b''):
+    "Assemble a complete frame around `body`"
+    frame = bytes((0xfe, len(body), cmd0, cmd1)) + body
+    return frame + bytes((calculate_fcs(frame[1:]),))
+
+
+def lqi_rsp(src, status=0, start=0):
+    "An empty ZDO_MGMT_LQI_RSP from `src`"
+    body = src.to_bytes(2, "little") + bytes((status, 0, start, 0))
+    return make_frame(0x45, 0xb1, body)
+
+
+class FakeDevice:
+    """Stands in for the serial port.  Frames written are recorded and
+    passed to `respond`, which returns the bytes the device sends back.
+    """
+    def __init__(self, respond):
+        self.host, self.device = socket.socketpair()
+        self.rx = self.host.makefile("rwb", buffering=0)
+        self.respond = respond
+        self.written = []
+
+    def write(self, frame):
+        self.written.append(bytes(frame))
+        self.device.sendall(self.respond(bytes(frame)))
+
+    def close(self):
+        self.rx.close()
+        self.host.close()
+        self.device.close()
+
+
+class PipelineTest(unittest.TestCase):
+    def make_pipeline(self, respond, **kwargs):
+        self.fake = FakeDevice(respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        return pipeline.Pipeline(self.fake, self.mtapi, **kwargs)
+
+    def test_command_key(self):
+        self.assertEqual(pipeline.command_key("AREQ", "ZDO",
+                                              "ZDO_MGMT_LQI_RSP"),
+                         LQI_RSP_KEY)
+        with self.assertRaises(ParseError):
+            pipeline.command_key("SREQ", "ZDO", "ZDO_MGMT_LQI_RSP")
+
+    def test_srsp(self):
+        pipe = self.make_pipeline(
+            lambda frame: make_frame(0x61, 0x01, b'\x79\x01'))
+        results = []
+        for i in range(3):
+            pipe.submit(pipeline.Request(
+                PING_FRAME, callback=lambda r, rec: results.append(rec)))
+        pipe.run()
+        self.assertEqual(results, [{ "Capabilities": 0x0179 }] * 3)
+        self.assertEqual(len(self.fake.written), 3)
+
+    def test_areq_replies(self):
+        # Replies come back in the reverse order to the requests
+        held = []
+        def respond(frame):
+            held.append(frame[4:6])
+            reply = make_frame(0x65, 0x31, b'\x00')
+            if len(held) == 3:
+                reply += b''.join(lqi_rsp(int.from_bytes(src, "little"))
+                                  for src in reversed(held))
+            return reply
+        pipe = self.make_pipeline(respond, window=4)
+        results = []
+        for dst in (0x1111, 0x2222, 0x3333):
+            frame = make_frame(0x25, 0x31, dst.to_bytes(2, "little") +
+                               b'\x00')
+            match = lambda record, dst=dst: record["SrcAddr"] == dst
+            callback = lambda r, record, dst=dst: results.append(
+                (dst, record["SrcAddr"]))
+            pipe.submit(pipeline.Request(frame, LQI_RSP_KEY, match,
+                                         callback))
+        pipe.run()
+        self.assertEqual(results, [(0x3333, 0x3333), (0x2222, 0x2222),
+                                   (0x1111, 0x1111)])
+        self.assertEqual(pipe.in_flight, 0)
+
+    def test_window(self):
+        in_flight = []
+        pipe = None
+        def respond(frame):
+            in_flight.append(pipe.in_flight)
+            return make_frame(0x65, 0x31, b'\x00') + lqi_rsp(0)
+        pipe = self.make_pipeline(respond, window=2)
+        frame = make_frame(0x25, 0x31, b'\x00\x00\x00')
+        for i in range(5):
+            pipe.submit(pipeline.Request(frame, LQI_RSP_KEY))
+        pipe.run()
+        self.assertEqual(len(in_flight), 5)
+        self.assertLessEqual(max(in_flight), 2)
+
+    def test_rate(self):
+        sent = []
+        def respond(frame):
+            sent.append(time.monotonic())
+            return make_frame(0x61, 0x01, b'\x79\x01')
+        pipe = self.make_pipeline(respond, rate=50)
+        for i in range(6):
+            pipe.submit(pipeline.Request(PING_FRAME))
+        pipe.run()
+        self.assertEqual(len(sent), 6)
+        self.assertGreaterEqual(sent[-1] - sent[0], 0.09)
+
+    def test_rate_stall(self):
+        # After a stall, sending resumes at the rate, not in a burst
+        clock = [100.0]
+        pipe = self.make_pipeline(lambda frame: b'', rate=10)
+        frame = make_frame(0x41, 0x00, b'\x01')
+        for i in range(10):
+            pipe.submit(pipeline.Request(frame))
+        with unittest.mock.patch.object(pipeline.time, "monotonic",
+                                        lambda: clock[0]):
+            pipe.fill()
+            self.assertEqual(pipe.sent, 1)
+            clock[0] += 5.0
+            pipe.fill()
+            self.assertEqual(pipe.sent, 2)
+            clock[0] += 0.05
+            pipe.fill()
+            self.assertEqual(pipe.sent, 2)
+            clock[0] += 0.05
+            pipe.fill()
+            self.assertEqual(pipe.sent, 3)
+
+    def test_retry(self):
+        tries = []
+        def respond(frame):
+            tries.append(frame)
+            if len(tries) < 3:
+                return b''
+            return make_frame(0x61, 0x01, b'\x79\x01')
+        pipe = self.make_pipeline(respond, timeout=0.05, retries=2)
+        results = []
+        pipe.submit(pipeline.Request(
+            PING_FRAME, callback=lambda r, rec: results.append(rec)))
+        pipe.run()
+        self.assertEqual(results, [{ "Capabilities": 0x0179 }])
+        self.assertEqual((pipe.sent, pipe.resent, pipe.failed), (3, 2, 0))
+
+    def test_failure(self):
+        # A failed SRSP status is retried like a timeout
+        pipe = self.make_pipeline(
+            lambda frame: make_frame(0x65, 0x31, b'\x01'),
+            timeout=0.05, retries=1)
+        results = []
+        frame = make_frame(0x25, 0x31, b'\x00\x00\x00')
+        pipe.submit(pipeline.Request(
+            frame, LQI_RSP_KEY,
+            callback=lambda r, rec: results.append((r.tries, rec))))
+        pipe.run()
+        self.assertEqual(results, [(2, None)])
+        self.assertEqual(pipe.failed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
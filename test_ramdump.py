@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+
+# test_ramdump.py
+#
+# Unit tests for reading device memory into a file
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import os
+import random
+import tempfile
+import keyboard
+import mtcmds
+import ramdump
+from test_pipeline import FakeDevice, make_frame
+
+
+MEMORY = bytes(random.Random(2016).randrange(256) for _ in range(0x10000))
+
+
+class RamDumpTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "ram.bin")
+        self.short = set()
+        self.bad = set()
+
+    def respond(self, frame):
+        "Answer SYS_RAM_READ from MEMORY"
+        address = frame[4] | (frame[5] << 8)
+        count = frame[6]
+        if address in self.bad:
+            return make_frame(0x61, 0x05, b'\x01\x00')
+        if address in self.short:
+            self.short.remove(address)
+            count -= 1
+        data = MEMORY[address:address+count]
+        return make_frame(0x61, 0x05, bytes((0, count)) + data)
+
+    def read_file(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_dump(self):
+        dump = ramdump.RamDump(self.fake, self.mtapi, 0x2000, 0x8000,
+                               self.path)
+        self.assertTrue(dump.run())
+        self.assertEqual(self.read_file(), MEMORY[0x2000:0xa000])
+        self.assertEqual(len(self.fake.written), 133)
+        self.assertEqual(dump.bytes_read, 0x8000)
+
+    def test_retry(self):
+        self.short.add(0x0100 + ramdump.RAM_READ_CHUNK)
+        self.bad.add(0x0100)
+        dump = ramdump.RamDump(self.fake, self.mtapi, 0x0100, 600,
+                               self.path, timeout=0.05, retries=1)
+        self.assertFalse(dump.run())
+        self.assertEqual(dump.failed, [(0x0100, ramdump.RAM_READ_CHUNK)])
+        expected = (bytes(ramdump.RAM_READ_CHUNK) +
+                    MEMORY[0x0100 + ramdump.RAM_READ_CHUNK:0x0100 + 600])
+        self.assertEqual(self.read_file(), expected)
+        self.assertEqual(dump.pipeline.resent, 2)
+
+    def test_range(self):
+        for address, length in ((0, 0), (0xff00, 0x101), (-1, 2)):
+            with self.assertRaises(ValueError):
+                ramdump.RamDump(self.fake, self.mtapi, address, length,
+                                self.path)
+
+    def test_command(self):
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["ramdump", "0x100", "10"]))
+            self.assertTrue(ui.execute(["ramdump", "0xff00", "0x200",
+                                        self.path]))
+            self.assertEqual(self.fake.written, [])
+            self.assertTrue(ui.execute(["ramdump", "0x100", "1000",
+                                        self.path]))
+        self.assertEqual(self.read_file(), MEMORY[0x100:0x100+1000])
+        self.assertIn("Read 1000 bytes", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+#! /usr/bin/env python3
+
+# test_raw.py
+#
+# Unit tests for sending and displaying raw frames
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import io
+import keyboard
+import mtcmds
+from mtapi import ParseError
+from mtcmds import MTBuffer
+from base_test import MockSock
+
+
+PING_FRAME = b'\xfe\x00\x21\x01\x20'
+RESET_FRAME = b'\xfe\x01\x41\x00\x01\x41'
+
+
+class TestFromFrame(unittest.TestCase):
+    def test_fcs_added(self):
+        buf = MTBuffer.from_frame(PING_FRAME[:-1])
+        self.assertEqual(buf.cmd.name, "SYS_PING")
+        self.assertEqual(buf.frame(), PING_FRAME)
+
+    def test_fcs_checked(self):
+        buf = MTBuffer.from_frame(RESET_FRAME)
+        self.assertEqual(buf.cmd.name, "SYS_RESET_REQ")
+        self.assertEqual(buf.frame(), RESET_FRAME)
+        with self.assertRaises(ParseError):
+            MTBuffer.from_frame(RESET_FRAME[:-1] + b'\x00')
+
+    def test_unknown_command(self):
+        buf = MTBuffer.from_frame(b'\xfe\x01\x21\xee\x55')
+        self.assertIsNone(buf.cmd)
+        self.assertEqual(buf.frame(), b'\xfe\x01\x21\xee\x55\x9b')
+
+    def test_malformed(self):
+        for data in (b'', b'\xfe\x00\x21', b'\x00\x00\x21\x01',
+                     b'\xfe\x02\x21\x01\x00', b'\xfe\x00\x21\x01\x20\x00'):
+            with self.assertRaises(ParseError, msg=data):
+                MTBuffer.from_frame(data)
+
+
+class TestRawCommand(unittest.TestCase):
+    def setUp(self):
+        self.sock = io.BytesIO()
+        with support.captured_stdout():
+            self.ui = keyboard.UIHandler(self.sock, interactive=False)
+
+    def test_frame(self):
+        with support.captured_stdout():
+            self.assertTrue(self.ui.execute(["raw", "fe", "00", "21", "01"]))
+            self.assertTrue(self.ui.execute(["raw", "fe014100", "01:41"]))
+        self.assertEqual(self.sock.getvalue(), PING_FRAME + RESET_FRAME)
+
+    def test_named(self):
+        with support.captured_stdout():
+            self.assertTrue(self.ui.execute(["raw", "sys_ping"]))
+            self.assertTrue(self.ui.execute(["raw", "reset", "01"]))
+        self.assertEqual(self.sock.getvalue(), PING_FRAME + RESET_FRAME)
+
+    def test_errors(self):
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.ui.execute(["raw"]))
+            self.assertTrue(self.ui.execute(["raw", "fe", "01", "21"]))
+            self.assertTrue(self.ui.execute(["raw", "sys_ping", "xyz"]))
+            self.assertTrue(self.ui.execute(["raw", "fe0021", "0100"]))
+        self.assertEqual(self.sock.getvalue(), b'')
+        self.assertEqual(stdout.getvalue().count("Error:"), 3)
+
+    def test_raw_input(self):
+        self.ui.raw = True
+        with support.captured_stdout(), \
+             support.captured_stdin() as stdin:
+            stdin.write("fe 00 21 01\nsys_ping\nquit\n")
+            stdin.seek(0)
+            self.assertTrue(self.ui())
+            self.assertTrue(self.ui())
+            self.assertFalse(self.ui())
+        self.assertEqual(self.sock.getvalue(), PING_FRAME * 2)
+
+
+class TestDisplay(unittest.TestCase):
+    def receive(self, display, frame):
+        sock = MockSock(bytearray(frame))
+        mtapi = mtcmds.MTAPI(sock)
+        mtapi.display = display
+        with support.captured_stdout() as stdout:
+            while not sock.eof():
+                mtapi()
+        return stdout.getvalue()
+
+    def test_hex(self):
+        self.assertEqual(self.receive("hex", RESET_FRAME),
+                         "fe 01 41 00 01 41\n")
+
+    def test_hex_bad_fcs(self):
+        # The FCS shown is the one received, not a recalculated one
+        self.assertEqual(self.receive("hex", RESET_FRAME[:-1] + b'\x00' +
+                                      RESET_FRAME),
+                         "fe 01 41 00 01 00 (bad FCS)\n"
+                         "fe 01 41 00 01 41\n")
+
+    def test_fcs_like_sof(self):
+        # A frame whose FCS is 0xfe must not lose the next frame
+        first = b'\xfe\x01\x41\x00\xbe\xfe'
+        self.assertEqual(self.receive("hex", first + RESET_FRAME),
+                         "fe 01 41 00 be fe\nfe 01 41 00 01 41\n")
+
+    def test_none(self):
+        self.assertEqual(self.receive("none", RESET_FRAME[:-1]), "")
+
+    def test_output_command(self):
+        mtapi = mtcmds.MTAPI(MockSock())
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(io.BytesIO(), mtapi, interactive=False)
+            self.assertTrue(ui.execute(["output", "hex"]))
+            self.assertEqual(mtapi.display, "hex")
+            self.assertTrue(ui.execute(["output", "binary"]))
+            self.assertTrue(ui.execute(["output"]))
+        self.assertEqual(mtapi.display, "hex")
+        self.assertIn("Output mode: hex", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
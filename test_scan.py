@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+
+# test_scan.py
+#
+# Unit tests for the channel scan summary
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import struct
+import keyboard
+import mtcmds
+import scan
+from test_pipeline import FakeDevice, make_frame
+
+
+def scan_cnf(scan_type, results, unscanned=0, status=0):
+    "A MAC_SCAN_CNF carrying the result list `results`"
+    body = struct.pack("<BBBBIBB", status, 0, scan_type, 0, unscanned,
+                       len(results), len(results)) + bytes(results)
+    return make_frame(0x42, 0x8c, body)
+
+
+def beacon(pan_id, channel):
+    "A MAC_BEACON_NOTIFY_IND from a coordinator of `pan_id`"
+    body = (bytes(5) + bytes((2,)) + bytes(8) +
+            struct.pack("<HHBBBB", pan_id, 0, channel, 0, 0xff, 0) +
+            bytes(11) + bytes(3))
+    return make_frame(0x42, 0x83, body)
+
+
+class ScanTest(unittest.TestCase):
+    def setUp(self):
+        self.sweep = 0
+        self.beacons = []
+        self.drop = set()
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+
+    def respond(self, frame):
+        "Scan the channels asked for, with energy rising each sweep"
+        self.assertEqual(frame[2:4], b'\x22\x0c')
+        record = mtcmds.find_command(0x22, 0x0c).decode(frame[4:-1])
+        channels = record["ScanChannels"]
+        scan_type = record["ScanType"]
+        self.assertEqual(record["MaxResults"], 0xff)
+        self.sweep += 1
+        reply = make_frame(0x62, 0x0c, b'\x00')
+        if self.sweep in self.drop:
+            return reply
+        if scan_type == scan.SCAN_TYPES["ed"]:
+            results = [channel + self.sweep
+                       for channel in scan.channel_list(channels)]
+            return reply + scan_cnf(scan_type, results)
+        for pan_id, channel in self.beacons:
+            reply += beacon(pan_id, channel)
+        return reply + scan_cnf(scan_type, [], status=0xea)
+
+    def test_parse_channels(self):
+        self.assertEqual(scan.parse_channels("all"), scan.ALL_CHANNELS)
+        self.assertEqual(scan.channel_list(scan.parse_channels("11,15-17")),
+                         [11, 15, 16, 17])
+        for token in ("10", "20-27", "x", "15-12"):
+            with self.assertRaises(ValueError):
+                scan.parse_channels(token)
+
+    def test_energy(self):
+        scanner = scan.Scanner(self.fake, self.mtapi,
+                               channels=scan.parse_channels("11-13"))
+        summary = scanner.run(3)
+        self.assertEqual(len(self.fake.written), 3)
+        self.assertEqual(summary.sweeps, 3)
+        self.assertEqual(summary.ed_min[:3], [12, 13, 14])
+        self.assertEqual(summary.ed_max[:3], [14, 15, 16])
+        self.assertEqual(summary.ed_count[:4], [3, 3, 3, 0])
+        self.assertEqual(summary.table(),
+                         ["Chan  ED min  mean   max",
+                          "  11      12  13.0    14",
+                          "  12      13  14.0    15",
+                          "  13      14  15.0    16"])
+        self.assertEqual(self.mtapi.listeners, [])
+        self.assertEqual(self.mtapi.events.subscriptions, [])
+
+    def test_full_list_and_unscanned(self):
+        summary = scan.ScanSummary()
+        record = {"ScanType": 0, "UnscannedChannelList": 0,
+                  "ResultList": bytes(range(100, 127))}
+        summary.add_confirm(record, scan.parse_channels("20"))
+        self.assertEqual(summary.ed_min[20 - 11], 120)
+        record = {"ScanType": 0, "UnscannedChannelList": 1 << 12,
+                  "ResultList": b'\x05\x07'}
+        summary.add_confirm(record, scan.parse_channels("11-13"))
+        self.assertEqual(summary.ed_max[:3], [5, None, 7])
+
+    def test_beacons(self):
+        self.beacons = [(0x1234, 15), (0x1234, 15), (0xbeef, 20),
+                        (0x1234, 40)]
+        scanner = scan.Scanner(self.fake, self.mtapi,
+                               scan.SCAN_TYPES["active"], duration=0)
+        summary = scanner.run(2)
+        self.assertEqual(summary.beacons[0x1234][15 - 11], 4)
+        self.assertEqual(summary.beacons[0xbeef][20 - 11], 2)
+        self.assertEqual(summary.table(),
+                         ["Chan  ED min  mean   max  1234  beef",
+                          "  15       -     -     -     4     0",
+                          "  20       -     -     -     0     2"])
+
+    def test_lost_sweep(self):
+        self.drop.add(2)
+        scanner = scan.Scanner(self.fake, self.mtapi,
+                               channels=scan.parse_channels("11"),
+                               duration=0, retries=0)
+        scanner.pipeline.timeout = 0.05
+        summary = scanner.run(3)
+        self.assertEqual((summary.sweeps, scanner.failed), (2, 1))
+
+    def test_command(self):
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi,
+                                    interactive=False)
+            self.assertTrue(ui.execute(["scan"]))
+            self.assertTrue(ui.execute(["scan", "2", "orphan"]))
+            self.assertTrue(ui.execute(["scan", "2", "ed", "30"]))
+            self.assertEqual(self.fake.written, [])
+            self.assertTrue(ui.execute(["scan", "2", "ed", "26", "1"]))
+        output = stdout.getvalue()
+        self.assertIn("  26      27  27.5    28", output)
+        self.assertIn("2 sweeps, 0 failed", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+#! /usr/bin/env python3
+
+# test_script.py
+#
+# Unit tests for running files of console commands
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import os
+import socket
+import tempfile
+import keyboard
+import mtcmds
+import script
+
+
+PING_FRAME = b'\xfe\x00\x21\x01\x20'
+VERSION_FRAME = b'\xfe\x00\x21\x02\x23'
+RESET_FRAME = b'\xfe\x01\x41\x00\x01\x41'
+PING_SRSP = b'\xfe\x02\x61\x01\x79\x01\x1a'
+
+
+class ScriptTest(unittest.TestCase):
+    "Runs scripts against a socket pair standing in for the device"
+    def setUp(self):
+        self.host, self.device = socket.socketpair()
+        self.sock = self.host.makefile("rwb", buffering=0)
+        self.mtapi = mtcmds.MTAPI(self.sock)
+        with support.captured_stdout():
+            self.ui = keyboard.UIHandler(self.sock, self.mtapi,
+                                         interactive=False)
+        self.runner = script.ScriptRunner(self.ui, timeout=0.1)
+        self.files = []
+
+    def tearDown(self):
+        self.sock.close()
+        self.host.close()
+        self.device.close()
+        for name in self.files:
+            os.unlink(name)
+
+    def write_script(self, text):
+        with tempfile.NamedTemporaryFile("w", suffix=".mt",
+                                         delete=False) as f:
+            f.write(text)
+        self.files.append(f.name)
+        return f.name
+
+    def device_received(self):
+        self.device.setblocking(False)
+        try:
+            return self.device.recv(4096)
+        except BlockingIOError:
+            return b''
+
+    def test_load(self):
+        name = self.write_script("# Commissioning\n"
+                                 "ping\n"
+                                 "\n"
+                                 "vers   # trailing comment\n"
+                                 "reset Software\n"
+                                 "help ping\n")
+        with support.captured_stdout():
+            self.assertTrue(self.runner.load(name))
+        steps = self.runner.steps
+        self.assertEqual(len(steps), 4)
+        self.assertEqual(steps[0].line_number, 2)
+        self.assertEqual(steps[0].frame, PING_FRAME)
+        self.assertEqual(steps[0].response, ("SRSP", "SYS", 0x01))
+        self.assertEqual(steps[1].frame, VERSION_FRAME)
+        self.assertEqual(steps[2].frame, RESET_FRAME)
+        self.assertIsNone(steps[2].response)
+        self.assertIsNone(steps[3].frame)
+        self.assertEqual(steps[3].tokens, ["help", "ping"])
+        # Nothing is sent while loading
+        self.assertEqual(self.device_received(), b'')
+
+    def test_load_errors(self):
+        name = self.write_script("ping\n"
+                                 "wombat\n"
+                                 "reset Wombat\n")
+        with support.captured_stdout() as stdout:
+            self.assertFalse(self.runner.load(name))
+        output = stdout.getvalue()
+        self.assertIn("Error in %s line 2" % name, output)
+        self.assertIn("Error in %s line 3" % name, output)
+        self.assertNotIn("line 1", output)
+
+    def test_run(self):
+        name = self.write_script("ping\nversion\nreset 1\n")
+        with support.captured_stdout():
+            self.assertTrue(self.runner.load(name))
+            self.assertTrue(self.runner.run())
+        self.assertEqual(self.device_received(),
+                         PING_FRAME + VERSION_FRAME + RESET_FRAME)
+
+    def test_run_quit(self):
+        name = self.write_script("ping\nquit\nversion\n")
+        with support.captured_stdout():
+            self.assertTrue(self.runner.load(name))
+            self.assertFalse(self.runner.run())
+        self.assertEqual(self.device_received(), PING_FRAME)
+
+    def test_run_wait(self):
+        name = self.write_script("ping\nreset 1\n")
+        self.device.sendall(PING_SRSP)
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.runner.load(name))
+            self.assertTrue(self.runner.run(wait=True))
+        self.assertEqual(self.device_received(), PING_FRAME + RESET_FRAME)
+        self.assertIn("SYS_PING", stdout.getvalue())
+        self.assertEqual(self.mtapi.listeners, [])
+
+    def test_run_wait_timeout(self):
+        name = self.write_script("ping\nversion\n")
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.runner.load(name))
+            self.assertTrue(self.runner.run(wait=True))
+        self.assertEqual(self.device_received(), PING_FRAME)
+        self.assertIn("No response to line 1", stdout.getvalue())
+
+    def test_source_command(self):
+        name = self.write_script("ping\n")
+        with support.captured_stdout():
+            self.assertTrue(self.ui.execute(["source", name]))
+        self.assertEqual(self.device_received(), PING_FRAME)
+
+    def test_source_recursion(self):
+        name = self.write_script("")
+        with open(name, "w") as f:
+            f.write("ping\nsource %s\n" % name)
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.ui.execute(["source", name]))
+        self.assertEqual(self.device_received(), PING_FRAME)
+        self.assertIn("already being run", stdout.getvalue())
+
+    def test_source_recursion_other_path(self):
+        # The file is recognised however its path is written
+        name = self.write_script("")
+        directory, base = os.path.split(name)
+        other = os.path.join(directory, ".", base)
+        with open(name, "w") as f:
+            f.write("ping\nsource %s\n" % other)
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.ui.execute(["source", name]))
+        self.assertEqual(self.device_received(), PING_FRAME)
+        self.assertIn("already being run", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,264 @@
+#! /usr/bin/env python3
+
+# test_server.py
+#
+# Unit tests for sharing the device through sockets
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+import os
+import socket
+import selectors
+import tempfile
+import time
+import mtcmds
+import server
+from test_pipeline import FakeDevice, make_frame
+
+
+PING_FRAME = make_frame(0x21, 0x01)
+PING_SRSP = make_frame(0x61, 0x01, b'\x79\x01')
+STATE_IND = make_frame(0x45, 0xc0, b'\x09')
+LQI_RSP = make_frame(0x45, 0xb1, b'\x00\x00\x00\x00\x00\x00')
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDevice(lambda frame: b'')
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        self.selector = selectors.DefaultSelector()
+        self.addCleanup(self.selector.close)
+        self.selector.register(self.fake.rx, selectors.EVENT_READ,
+                               self.mtapi)
+
+    def make_server(self, **kwargs):
+        self.server = server.MTServer(self.fake, self.mtapi, self.selector,
+                                      **kwargs)
+        self.addCleanup(self.server.close)
+        return self.server
+
+    def connect(self):
+        "Return the far end of a new client's connection"
+        ours, theirs = socket.socketpair()
+        self.addCleanup(theirs.close)
+        theirs.settimeout(1.0)
+        self.server.add_client(ours)
+        return theirs
+
+    def pump(self, duration=0.05):
+        "Run the main loop for `duration` seconds"
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for key, _ in self.selector.select(0.01):
+                key.data()
+            self.server.tick()
+
+    def received(self, sock):
+        "Return everything waiting to be read from `sock`"
+        sock.setblocking(False)
+        data = b''
+        try:
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        except BlockingIOError:
+            pass
+        return data
+
+    def test_listen_address(self):
+        with self.assertRaises(ValueError):
+            server.listen("serial:/dev/ttyUSB0")
+        with self.assertRaises(ValueError):
+            server.listen("tcp:localhost:http")
+        with self.assertRaises(ValueError):
+            server.listen("unix:")
+
+    def test_unix_listen(self):
+        self.make_server()
+        path = os.path.join(tempfile.mkdtemp(), "mt.sock")
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        self.server.listen("unix:" + path)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(path)
+        self.pump()
+        self.assertEqual(len(self.server.clients), 1)
+        client.sendall(make_frame(0x45, 0x80))
+        self.pump()
+        self.assertEqual(self.fake.written, [make_frame(0x45, 0x80)])
+        self.server.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_unix_socket_removed(self):
+        self.make_server()
+        path = os.path.join(tempfile.mkdtemp(), "mt.sock")
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        self.server.listen("unix:" + path)
+        os.unlink(path)
+        self.server.close()
+        self.assertEqual(self.server.listening, [])
+
+    def test_unix_path_taken(self):
+        # A file in the way is left alone rather than replaced
+        self.make_server()
+        path = os.path.join(tempfile.mkdtemp(), "notes.txt")
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        self.addCleanup(os.unlink, path)
+        with open(path, "w") as f:
+            f.write("notes")
+        with self.assertRaises(OSError):
+            self.server.listen("unix:" + path)
+        with open(path) as f:
+            self.assertEqual(f.read(), "notes")
+
+    def test_unix_stale_socket(self):
+        # A socket left behind by an earlier server is replaced
+        path = os.path.join(tempfile.mkdtemp(), "mt.sock")
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        server.listen("unix:" + path).close()
+        self.assertTrue(os.path.exists(path))
+        self.make_server()
+        self.server.listen("unix:" + path)
+        self.server.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_fan_out(self):
+        self.make_server()
+        first = self.connect()
+        second = self.connect()
+        self.fake.device.sendall(STATE_IND + LQI_RSP)
+        self.pump()
+        self.assertEqual(self.received(first), STATE_IND + LQI_RSP)
+        self.assertEqual(self.received(second), STATE_IND + LQI_RSP)
+
+    def test_fan_out_drop(self):
+        # A client found to have gone while frames are passed out does
+        # not stop the next client getting them
+        self.make_server()
+        first = self.connect()
+        second = self.connect()
+        first.close()
+        done = []
+        self.mtapi.add_listener(lambda *packet: done.append(packet))
+        self.fake.device.sendall(STATE_IND)
+        self.assertTrue(self.mtapi.run_until(lambda: done, 1.0))
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(self.received(second), STATE_IND)
+
+    def test_filter(self):
+        self.make_server()
+        first = self.connect()
+        second = self.connect()
+        # Only ZDO AREQs numbered 0xc0 to 0xcf
+        first.sendall(bytes((server.FILTER_SOF, 3, 0x45, 0xc0, 0xf0)))
+        # Nothing at all
+        second.sendall(bytes((server.FILTER_SOF, 0)))
+        self.pump()
+        self.fake.device.sendall(LQI_RSP + STATE_IND)
+        self.pump()
+        self.assertEqual(self.received(first), STATE_IND)
+        self.assertEqual(self.received(second), b'')
+
+    def test_sreq_arbitration(self):
+        self.make_server()
+        first = self.connect()
+        second = self.connect()
+        first.sendall(PING_FRAME)
+        self.pump()
+        second.sendall(PING_FRAME)
+        self.pump()
+        # The second SREQ waits for the first's SRSP
+        self.assertEqual(self.fake.written, [PING_FRAME])
+        self.fake.device.sendall(PING_SRSP)
+        self.pump()
+        self.assertEqual(self.fake.written, [PING_FRAME, PING_FRAME])
+        self.assertEqual(self.received(first), PING_SRSP)
+        self.assertEqual(self.received(second), b'')
+        self.fake.device.sendall(PING_SRSP)
+        self.pump()
+        self.assertEqual(self.received(first), b'')
+        self.assertEqual(self.received(second), PING_SRSP)
+        self.assertIsNone(self.server.owner)
+
+    def test_srsp_timeout(self):
+        self.make_server(timeout=0.05)
+        first = self.connect()
+        second = self.connect()
+        first.sendall(PING_FRAME)
+        second.sendall(PING_FRAME)
+        self.pump(0.02)
+        self.assertEqual(len(self.fake.written), 1)
+        self.pump(0.1)
+        self.assertEqual(len(self.fake.written), 2)
+        self.assertEqual(len(self.server.pending), 0)
+
+    def test_bad_input(self):
+        self.make_server()
+        first = self.connect()
+        bad = bytearray(PING_FRAME)
+        bad[-1] ^= 0xff
+        first.sendall(b'\x00\x01' + bad + bytes((server.FILTER_SOF, 2, 0, 0)))
+        self.pump()
+        self.assertEqual(self.fake.written, [])
+        self.assertEqual(self.server.clients[0].rejected, 2)
+        first.sendall(PING_FRAME)
+        self.pump()
+        self.assertEqual(self.fake.written, [PING_FRAME])
+
+    def test_queue_limit(self):
+        self.make_server(limit=2)
+        first = self.connect()
+        client = self.server.clients[0]
+        # Fill the connection so that nothing more can be sent
+        try:
+            while True:
+                client.sock.send(bytes(65536))
+        except BlockingIOError:
+            pass
+        # The first frame is taken from the queue to be sent
+        for _ in range(4):
+            client.enqueue(STATE_IND)
+        self.assertEqual(len(client.queue), 2)
+        self.assertEqual(client.dropped, 1)
+        self.assertTrue(client.writing)
+        client.enqueue(PING_SRSP, force=True)
+        self.assertEqual(len(client.queue), 3)
+
+    def test_disconnect(self):
+        self.make_server()
+        first = self.connect()
+        second = self.connect()
+        first.sendall(PING_FRAME)
+        self.pump()
+        second.sendall(PING_FRAME)
+        self.pump()
+        second.close()
+        self.pump()
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(len(self.server.pending), 0)
+        self.fake.device.sendall(PING_SRSP + STATE_IND)
+        self.pump()
+        self.assertEqual(self.received(first), PING_SRSP + STATE_IND)
+        self.assertEqual(self.fake.written, [PING_FRAME])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+#! /usr/bin/env python3
+
+# test_simulator.py
+#
+# Unit tests for the simulated device
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+import selectors
+import time
+import mtcmds
+import simulator
+import transport
+from mtcmds import MT_COMMANDS
+from test_pipeline import make_frame
+
+
+PING_FRAME = make_frame(0x21, 0x01)
+
+
+class SimulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.host, self.device = transport.loopback()
+        self.addCleanup(self.host.close)
+        self.addCleanup(self.device.close)
+        self.mtapi = mtcmds.MTAPI(self.host)
+        self.mtapi.display = "none"
+        self.received = []
+        self.mtapi.add_listener(self.listener)
+        self.selector = selectors.DefaultSelector()
+        self.addCleanup(self.selector.close)
+        self.selector.register(self.host, selectors.EVENT_READ, self.mtapi)
+
+    def listener(self, type_name, subsystem_name, cmd, data):
+        self.received.append((type_name, subsystem_name, cmd, data))
+        return True
+
+    def make_simulator(self, **kwargs):
+        self.sim = simulator.Simulator(self.device, **kwargs)
+        self.selector.register(self.device, selectors.EVENT_READ, self.sim)
+
+    def pump(self, done, timeout=1.0):
+        "Run the simulator and the receiver until `done()` returns True"
+        deadline = time.monotonic() + timeout
+        while not done() and time.monotonic() < deadline:
+            wait = self.sim.wait_time()
+            if wait is None or wait > 0.01:
+                wait = 0.01
+            for key, _ in self.selector.select(wait):
+                key.data()
+            self.sim.tick()
+        return done()
+
+    def decoded(self, index):
+        "Return the name and record of the `index`th packet received"
+        type_name, subsystem_name, cmd, data = self.received[index]
+        command = MT_COMMANDS[(type_name, subsystem_name)][cmd]
+        return command.name, command.decode(data)
+
+    def test_every_sreq(self):
+        self.make_simulator()
+        self.sim.followups = {}
+        count = 0
+        for (type_name, subsystem_name), table in MT_COMMANDS.items():
+            if type_name != "SREQ":
+                continue
+            for cmd, command in table.items():
+                self.received = []
+                self.host.write(simulator.make_frame(
+                    (type_name, subsystem_name, cmd), command.encode({})))
+                self.assertTrue(self.pump(lambda: self.received))
+                self.assertEqual(self.received[0][:3],
+                                 ("SRSP", subsystem_name, cmd))
+                name, record = self.decoded(0)
+                self.assertEqual(name, command.name)
+                count += 1
+        self.assertEqual(self.sim.requests, count)
+        self.assertEqual(self.sim.unknown, 0)
+
+    def test_responses(self):
+        self.make_simulator()
+        self.host.write(PING_FRAME)
+        self.assertTrue(self.pump(lambda: self.received))
+        self.assertEqual(self.decoded(0), ("SYS_PING",
+                                           { "Capabilities": 0x0179 }))
+        self.sim.respond("sys_ping", Capabilities=0x0001)
+        self.host.write(PING_FRAME)
+        self.assertTrue(self.pump(lambda: len(self.received) == 2))
+        self.assertEqual(self.decoded(1), ("SYS_PING",
+                                           { "Capabilities": 0x0001 }))
+
+    def test_followup(self):
+        self.make_simulator()
+        request = MT_COMMANDS[("SREQ", "AF")][0x01]
+        self.host.write(simulator.make_frame(
+            ("SREQ", "AF", 0x01),
+            request.encode({ "DstAddr": 0x1234, "DstEndpoint": 1,
+                             "SrcEndpoint": 2, "ClusterId": 6,
+                             "TransId": 0x42, "Data": b'\x01' })))
+        self.assertTrue(self.pump(lambda: len(self.received) == 2))
+        self.assertEqual(self.decoded(0), ("AF_DATA_REQUEST",
+                                           { "Status": 0 }))
+        self.assertEqual(self.decoded(1), ("AF_DATA_CONFIRM",
+                                           { "Status": 0, "Endpoint": 2,
+                                             "TransId": 0x42 }))
+
+    def test_unknown(self):
+        self.make_simulator()
+        self.host.write(make_frame(0x21, 0x7f))
+        self.assertTrue(self.pump(lambda: self.received))
+        self.assertEqual(self.received[0],
+                         ("SRSP", "Reserved(0x00)", 0x00, b'\x02\x21\x7f'))
+        self.assertEqual(self.sim.unknown, 1)
+
+    def test_storm(self):
+        self.make_simulator()
+        self.sim.storm("af_incoming_msg", 1000, count=5)
+        self.assertTrue(self.pump(lambda: len(self.received) == 5))
+        for i in range(5):
+            name, record = self.decoded(i)
+            self.assertEqual(name, "AF_INCOMING_MSG")
+            self.assertEqual(record["TransSeqNumber"], i)
+            self.assertEqual(record["SrcAddr"], 0x1234)
+        self.assertEqual(self.sim.storms, [])
+        self.sim.storm("ZDO_SRC_RTG_IND", 1000, count=1, DstAddr=0x5678)
+        self.assertTrue(self.pump(lambda: len(self.received) == 6))
+        self.assertEqual(self.decoded(5),
+                         ("ZDO_SRC_RTG_IND", { "DstAddr": 0x5678,
+                                               "RelayCount": 0,
+                                               "RelayList": [] }))
+
+    def test_pacing(self):
+        # 7 byte SRSPs at 1000 baud take 70ms each
+        self.make_simulator(baud=1000, latency=0.05)
+        start = time.monotonic()
+        self.host.write(PING_FRAME * 3)
+        self.assertTrue(self.pump(lambda: len(self.received) == 3))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05 + 0.14)
+
+    def test_parse_storm(self):
+        self.assertEqual(simulator.parse_storm("MAC_DATA_IND:50"),
+                         ("MAC_DATA_IND", 50.0, None))
+        self.assertEqual(simulator.parse_storm("MAC_DATA_IND:50:10"),
+                         ("MAC_DATA_IND", 50.0, 10))
+        for text in ("MAC_DATA_IND", "MAC_DATA_IND:0", "MAC_DATA_IND:-5",
+                     "MAC_DATA_IND:inf", "MAC_DATA_IND:nan",
+                     "MAC_DATA_IND:50:-1"):
+            with self.assertRaises(ValueError):
+                simulator.parse_storm(text)
+        with self.assertRaises(ValueError):
+            simulator.Storm("MAC_DATA_IND", 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+
+# test_stats.py
+#
+# Unit tests for the measurement statistics
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+import stats
+
+
+class TestPercentile(unittest.TestCase):
+    def test_empty(self):
+        self.assertIsNone(stats.percentile([], 50))
+        self.assertEqual(stats.summarise([]), [])
+
+    def test_percentile(self):
+        values = [1, 2, 3, 4, 5]
+        self.assertEqual(stats.percentile(values, 0), 1)
+        self.assertEqual(stats.percentile(values, 50), 3)
+        self.assertEqual(stats.percentile(values, 100), 5)
+        self.assertAlmostEqual(stats.percentile(values, 90), 4.6)
+        self.assertEqual(stats.percentile([7], 99), 7)
+
+    def test_summarise(self):
+        values = list(range(100, 0, -1))
+        summary = stats.summarise(values)
+        self.assertEqual([name for name, _ in summary],
+                         ["min", "50%", "90%", "99%", "max"])
+        self.assertEqual(summary[0], ("min", 1))
+        self.assertAlmostEqual(summary[1][1], 50.5)
+        self.assertAlmostEqual(summary[3][1], 99.01)
+        self.assertEqual(summary[-1], ("max", 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
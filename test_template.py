@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+
+# test_template.py
+#
+# Unit tests for precompiled frame templates
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from test import support
+import io
+import keyboard
+import mtapi
+from mtcmds import MTBuffer
+from template import FrameTemplate
+
+
+AF_TOKENS = ["af_data_request", "0x1234", "1", "2", "6", "{}",
+             "0", "30", "01:02:03"]
+
+
+def build_frame(subsystem, mtype, command, tokens):
+    "Build a frame the slow way, for comparison"
+    buf = MTBuffer(subsystem, mtype, command)
+    buf.cmd.parse_tokens(tokens, buf)
+    return buf.frame()
+
+
+class TestFrameTemplate(unittest.TestCase):
+    def af_frame(self, dst, trans_id):
+        tokens = list(AF_TOKENS)
+        tokens[1] = str(dst)
+        tokens[5] = str(trans_id)
+        return build_frame("AF", "SREQ", "AF_DATA_REQUEST", tokens)
+
+    def test_no_slots(self):
+        template = FrameTemplate("SYS", "SREQ", "SYS_PING", ["ping"])
+        self.assertEqual(template.slots, {})
+        self.assertEqual(template.frame(), b'\xfe\x00\x21\x01\x20')
+
+    def test_byte_slot(self):
+        template = FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST",
+                                 AF_TOKENS)
+        self.assertEqual(template.slots, { "TransId": (10, 1) })
+        self.assertEqual(template["TransId"], 0)
+        self.assertEqual(template.frame(), self.af_frame(0x1234, 0))
+        for trans_id in (1, 0x80, 0xff):
+            self.assertEqual(template.frame(TransId=trans_id),
+                             self.af_frame(0x1234, trans_id))
+        template["TransId"] = 0x102
+        self.assertEqual(template["TransId"], 0x02)
+        self.assertEqual(template.frame(), self.af_frame(0x1234, 2))
+
+    def test_wide_slot(self):
+        tokens = list(AF_TOKENS)
+        tokens[1] = "{0x55aa}"
+        tokens[5] = "{7}"
+        template = FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST", tokens)
+        self.assertEqual(template.slots, { "DstAddr": (4, 2),
+                                           "TransId": (10, 1) })
+        self.assertEqual(template.frame(), self.af_frame(0x55aa, 7))
+        for dst in (0x0000, 0x00ff, 0xff00, 0xfffe, 0x12345):
+            self.assertEqual(template.frame(DstAddr=dst, TransId=dst),
+                             self.af_frame(dst & 0xffff, dst & 0xff))
+
+    def test_frames(self):
+        template = FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST",
+                                 AF_TOKENS)
+        frames = list(template.frames("TransId", range(250, 260)))
+        self.assertEqual(len(frames), 10)
+        for i, frame in enumerate(frames):
+            self.assertEqual(frame, self.af_frame(0x1234, (250+i) & 0xff))
+
+        tokens = list(AF_TOKENS)
+        tokens[1] = "{}"
+        tokens[5] = "9"
+        template = FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST", tokens)
+        frames = list(template.frames("DstAddr", (1, 0x100, 0xfffe)))
+        self.assertEqual(frames, [ self.af_frame(1, 9),
+                                   self.af_frame(0x100, 9),
+                                   self.af_frame(0xfffe, 9) ])
+
+    def test_errors(self):
+        with self.assertRaises(mtapi.ParseError):
+            FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST", AF_TOKENS[:-1])
+        tokens = list(AF_TOKENS)
+        tokens[2] = "Wombat"
+        with self.assertRaises(mtapi.ParseError):
+            FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST", tokens)
+        tokens = list(AF_TOKENS)
+        tokens[8] = "{}"
+        with self.assertRaises(mtapi.ParseError):
+            FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST", tokens)
+        tokens = list(AF_TOKENS)
+        tokens[5] = "{Wombat}"
+        with self.assertRaises(mtapi.ParseError):
+            FrameTemplate("AF", "SREQ", "AF_DATA_REQUEST", tokens)
+
+    def test_from_record(self):
+        record = dict(DstAddr=0x1234, DstEndpoint=1, SrcEndpoint=2,
+                      ClusterId=6, TransId=0, Options=0, Radius=30,
+                      Data=b'\x01\x02\x03')
+        template = FrameTemplate.from_record("AF", "SREQ",
+                                             "AF_DATA_REQUEST", record,
+                                             ("DstAddr", "TransId"))
+        self.assertEqual(template.slots,
+                         { "DstAddr": (4, 2), "TransId": (10, 1) })
+        self.assertEqual(template.frame(), self.af_frame(0x1234, 0))
+        self.assertEqual(template.frame(DstAddr=0x55aa, TransId=7),
+                         self.af_frame(0x55aa, 7))
+        # A field after the variable length data, or inside a compound
+        # field, cannot be a slot
+        record = dict(DstAddrMode=2, DstAddr=0x1234, Data=b'\x01')
+        with self.assertRaises(mtapi.ParseError):
+            FrameTemplate.from_record("AF", "SREQ", "AF_DATA_REQUEST_EXT",
+                                      record, ("DstAddr",))
+        with self.assertRaises(mtapi.ParseError):
+            FrameTemplate.from_record("AF", "SREQ", "AF_DATA_REQUEST",
+                                      record, ("Wombat",))
+        template = FrameTemplate.from_record("AF", "SREQ",
+                                             "AF_DATA_REQUEST_EXT",
+                                             record, ("TransId",))
+        self.assertEqual(template.slots, { "TransId": (19, 1) })
+        with self.assertRaises(mtapi.ParseError):
+            FrameTemplate.from_record("AF", "SREQ", "AF_DATA_REQUEST",
+                                      dict(Data=bytes(250)))
+
+
+class TestRepeatCommand(unittest.TestCase):
+    def setUp(self):
+        self.sock = io.BytesIO()
+        with support.captured_stdout():
+            self.ui = keyboard.UIHandler(self.sock, interactive=False)
+
+    def test_repeat(self):
+        with support.captured_stdout():
+            self.assertTrue(self.ui.execute(["repeat", "300"] + AF_TOKENS))
+        expected = b''.join(
+            build_frame("AF", "SREQ", "AF_DATA_REQUEST",
+                        AF_TOKENS[:5] + [str(i & 0xff)] + AF_TOKENS[6:])
+            for i in range(300))
+        self.assertEqual(self.sock.getvalue(), expected)
+
+    def test_repeat_errors(self):
+        with support.captured_stdout() as stdout:
+            self.assertTrue(self.ui.execute(["repeat", "many", "ping"]))
+            self.assertTrue(self.ui.execute(["repeat", "2", "help"]))
+            self.assertTrue(self.ui.execute(["repeat", "2", "ping", "1"]))
+        self.assertEqual(self.sock.getvalue(), b'')
+        self.assertIn("Only MTAPI commands", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+
+# test_tokenizer.py
+#
+# Unit tests for splitting console command lines into tokens
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+import random
+import shlex
+import mtapi
+from tokenizer import tokenize
+
+
+class TestTokenize(unittest.TestCase):
+    def test_simple(self):
+        self.assertEqual(tokenize(""), [])
+        self.assertEqual(tokenize("  \t\n"), [])
+        self.assertEqual(tokenize("ping\n"), ["ping"])
+        self.assertEqual(tokenize("af_data_request 0x1234 1 1 6 5 0 30"
+                                  " 01:02:03\n"),
+                         ["af_data_request", "0x1234", "1", "1", "6",
+                          "5", "0", "30", "01:02:03"])
+
+    def test_quotes(self):
+        self.assertEqual(tokenize('x "Started as Coordinator" 1'),
+                         ["x", "Started as Coordinator", "1"])
+        self.assertEqual(tokenize("x 'Nothing to join'"),
+                         ["x", "Nothing to join"])
+        self.assertEqual(tokenize('x "" \'\''), ["x", "", ""])
+        self.assertEqual(tokenize('a"b c"d'), ["ab cd"])
+        self.assertEqual(tokenize(r'"a\"b\\c\d"'), [r'a"b\c\d'])
+        self.assertEqual(tokenize(r"'a\b'"), [r"a\b"])
+        self.assertEqual(tokenize(r"a\ b c"), ["a b", "c"])
+
+    def test_comments(self):
+        self.assertEqual(tokenize("ping # comment"),
+                         ["ping", "#", "comment"])
+        self.assertEqual(tokenize("ping # comment", comments=True),
+                         ["ping"])
+        self.assertEqual(tokenize("# comment", comments=True), [])
+        self.assertEqual(tokenize("a#b c", comments=True), ["a"])
+        self.assertEqual(tokenize('"a#b" c#d', comments=True), ["a#b", "c"])
+
+    def test_errors(self):
+        for line in ('"abc', "'abc", 'x "a\\"', "abc\\"):
+            with self.assertRaises(ValueError):
+                tokenize(line)
+
+    def test_shlex_compatible(self):
+        rng = random.Random(2016)
+        alphabet = "ab1# \t\\\"'\n"
+        for _ in range(20000):
+            line = "".join(rng.choice(alphabet)
+                           for _ in range(rng.randint(0, 12)))
+            for comments in (False, True):
+                try:
+                    expected = shlex.split(line, comments=comments)
+                except ValueError:
+                    with self.assertRaises(ValueError, msg=repr(line)):
+                        tokenize(line, comments=comments)
+                    continue
+                self.assertEqual(tokenize(line, comments=comments),
+                                 expected, msg=repr(line))
+
+    def test_field_tokens(self):
+        # Tokens must still be acceptable to the field parsers
+        tokens = tokenize('0x1ff "Started as Coordinator" 01:02:ff')
+        buf = bytearray()
+        self.assertTrue(mtapi.ParseField("Test", 2).parse_token(tokens[0],
+                                                                buf))
+        field = mtapi.ParseField("State", 1, mtapi.field_parse_device_state)
+        self.assertTrue(field.parse_token(tokens[1], buf))
+        field = mtapi.ParseVariable("Len", "Data")
+        self.assertTrue(field.parse_token(tokens[2], buf))
+        self.assertEqual(buf, b'\xff\x01\x09\x03\x01\x02\xff')
+
+
+if __name__ == "__main__":
+    unittest.main()
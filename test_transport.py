@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+
+# test_transport.py
+#
+# Unit tests for the connections to devices
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import mtcmds
+import transport
+from test_pipeline import make_frame
+
+
+PING_SRSP = make_frame(0x61, 0x01, b'\x79\x01')
+
+
+class TransportTest(unittest.TestCase):
+    def receive(self, host):
+        "Return the first packet received from `host`"
+        mtapi = mtcmds.MTAPI(host)
+        mtapi.display = "none"
+        received = []
+        mtapi.add_listener(lambda *packet: received.append(packet))
+        self.assertTrue(mtapi.run_until(lambda: received, 1.0))
+        return received[0]
+
+    def test_socket_address(self):
+        self.assertEqual(transport.socket_address("tcp:2000"),
+                         (socket.AF_INET, ("127.0.0.1", 2000)))
+        self.assertEqual(transport.socket_address("tcp:bridge:2000"),
+                         (socket.AF_INET, ("bridge", 2000)))
+        self.assertEqual(transport.socket_address("unix:/tmp/mt"),
+                         (socket.AF_UNIX, "/tmp/mt"))
+        self.assertIsNone(transport.socket_address("/dev/ttyUSB0"))
+        self.assertIsNone(transport.socket_address("pty:"))
+        with self.assertRaises(ValueError):
+            transport.socket_address("tcp:bridge")
+
+    def test_loopback(self):
+        host, device = transport.loopback()
+        self.addCleanup(host.close)
+        self.addCleanup(device.close)
+        self.assertEqual(host.read(4), b'')
+        device.write(PING_SRSP)
+        self.assertEqual(self.receive(host),
+                         ("SRSP", "SYS", 0x01, b'\x79\x01'))
+        host.write(b'\xfe')
+        self.assertEqual(device.read(4), b'\xfe')
+
+    def test_eof(self):
+        host, device = transport.loopback()
+        self.addCleanup(host.close)
+        device.close()
+        with self.assertRaises(EOFError):
+            host.read(1)
+        with self.assertRaises(EOFError):
+            host.write(PING_SRSP)
+
+    def test_peer_closed(self):
+        # The receiver passes the end of the connection on rather than
+        # waiting for more forever
+        host, device = transport.loopback()
+        self.addCleanup(host.close)
+        mtapi = mtcmds.MTAPI(host)
+        mtapi.display = "none"
+        device.write(PING_SRSP)
+        device.close()
+        with self.assertRaises(EOFError):
+            mtapi.run_until(lambda: False, 1.0)
+
+    def run_console(self, *args):
+        """Run the console connected to a socket of its own, close the
+        connection once it is made and return the console's exit status
+        and what it wrote to stderr."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "mt.sock")
+        listener = socket.socket(socket.AF_UNIX)
+        self.addCleanup(listener.close)
+        listener.bind(path)
+        listener.listen()
+        listener.settimeout(10)
+        console = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "MTConsole.py")
+        process = subprocess.Popen(
+            [sys.executable, console, "-s", "unix:" + path] + list(args),
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE)
+        self.addCleanup(process.kill)
+        device, _ = listener.accept()
+        device.close()
+        _, stderr = process.communicate(timeout=10)
+        process.stdin.close()
+        return process.returncode, stderr.decode()
+
+    def test_console_peer_closed(self):
+        status, stderr = self.run_console()
+        self.assertNotEqual(status, 0)
+        self.assertIn("Connection to ", stderr)
+        self.assertIn(" closed", stderr)
+        self.assertNotIn("Traceback", stderr)
+
+    def test_script_peer_closed(self):
+        script = tempfile.NamedTemporaryFile("w", suffix=".mt")
+        self.addCleanup(script.close)
+        script.write("ping\n")
+        script.flush()
+        status, stderr = self.run_console("--script", script.name,
+                                          "--linger", "5")
+        self.assertNotEqual(status, 0)
+        self.assertIn(" closed", stderr)
+        self.assertNotIn("Traceback", stderr)
+
+    def test_tcp(self):
+        listener = socket.socket()
+        self.addCleanup(listener.close)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        host = transport.open_transport("tcp:%d" % port)
+        self.addCleanup(host.close)
+        device, _ = listener.accept()
+        self.addCleanup(device.close)
+        self.assertEqual(host.name, "127.0.0.1:%d" % port)
+        device.sendall(PING_SRSP)
+        self.assertEqual(self.receive(host)[:3],
+                         ("SRSP", "SYS", 0x01))
+
+    def test_pty(self):
+        host = transport.open_transport("pty:")
+        self.addCleanup(host.close)
+        self.assertIsInstance(host, transport.PtyTransport)
+        device = os.open(host.name, os.O_RDWR | os.O_NOCTTY)
+        self.addCleanup(os.close, device)
+        os.write(device, PING_SRSP)
+        self.assertEqual(self.receive(host)[:3],
+                         ("SRSP", "SYS", 0x01))
+        # Bytes that a terminal would otherwise translate
+        host.write(b'\r\n\x03')
+        self.assertEqual(os.read(device, 3), b'\r\n\x03')
+
+    def test_unconnected(self):
+        with self.assertRaises(OSError):
+            transport.open_transport("unix:/nonexistent/mt.sock")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+#! /usr/bin/env python3
+
+# test_zdiags.py
+#
+# Unit tests for the ZDIAGS statistics poller
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+from test import support
+import csv
+import os
+import tempfile
+import time
+import keyboard
+import mtcmds
+import zdiags
+from test_pipeline import FakeDevice, make_frame
+
+
+class ZDiagsTest(unittest.TestCase):
+    def setUp(self):
+        self.counts = {}
+        self.drop = set()
+        self.reset_at = None
+        self.fake = FakeDevice(self.respond)
+        self.addCleanup(self.fake.close)
+        self.mtapi = mtcmds.MTAPI(self.fake.rx)
+        self.mtapi.display = "none"
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "stats.csv")
+
+    def respond(self, frame):
+        "Answer SYS_ZDIAGS_GET_STATS with a counter per attribute"
+        self.assertEqual(frame[2:4], b'\x21\x19')
+        attribute = int.from_bytes(frame[4:6], "little")
+        if len(self.fake.written) == self.reset_at:
+            self.counts.clear()
+        if attribute in self.drop:
+            return b''
+        value = self.counts.get(attribute, 100) + 5
+        self.counts[attribute] = value
+        return make_frame(0x61, 0x19, value.to_bytes(4, "little"))
+
+    def run_poller(self, poller, rounds):
+        "Drive `poller` as the console would until `rounds` are done"
+        poller.start()
+        limit = time.monotonic() + 5
+        while True:
+            self.assertLess(time.monotonic(), limit)
+            if poller.current is None:
+                time.sleep(poller.wait_time())
+            else:
+                self.mtapi.run_until(lambda: poller.current is None,
+                                     poller.wait_time())
+            if (poller.rounds >= rounds and not poller.queue and
+                    poller.current is None):
+                break
+            poller.tick()
+        poller.stop()
+        with open(self.path, newline="") as f:
+            return list(csv.reader(f))
+
+    def test_attribute_id(self):
+        self.assertEqual(zdiags.attribute_id("mac_tx_ucast_retry"),
+                         0x006a)
+        self.assertEqual(zdiags.attribute_id("0x130"), 0x0130)
+        self.assertEqual(zdiags.attribute_name(0x0130),
+                         "APS_TX_UCAST_RETRY")
+        self.assertEqual(zdiags.attribute_name(0x1234), "0x1234")
+        for token in ("nonsense", "0x10000", "-1"):
+            with self.assertRaises(ValueError):
+                zdiags.attribute_id(token)
+
+    def test_poll(self):
+        poller = zdiags.ZDiagsPoller(self.fake, self.mtapi, self.path,
+                                     0.05, [0x0069, 0x006a])
+        rows = self.run_poller(poller, 3)
+        self.assertEqual(rows[0], list(zdiags.CSV_HEADER))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual([row[1] for row in rows[1:3]],
+                         ["MAC_TX_UCAST", "MAC_TX_UCAST_RETRY"])
+        self.assertEqual([row[2] for row in rows[1:]],
+                         ["105", "105", "110", "110", "115", "115"])
+        self.assertEqual([row[3] for row in rows[1:3]], ["", ""])
+        for row in rows[3:]:
+            # 5 counts in about 0.05s
+            self.assertGreater(float(row[3]), 10)
+            self.assertLess(float(row[3]), 200)
+        self.assertEqual((poller.samples, poller.missed), (6, 0))
+        self.assertEqual(self.mtapi.listeners, [])
+        self.assertEqual(self.mtapi.events.subscriptions, [])
+
+    def test_interleaved(self):
+        # One request at a time, each sent once the last is answered
+        poller = zdiags.ZDiagsPoller(self.fake, self.mtapi, self.path,
+                                     10, list(range(20)))
+        start = time.monotonic()
+        self.run_poller(poller, 1)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(self.fake.written), 20)
+        self.assertEqual(poller.samples, 20)
+
+    def test_missed_and_reset(self):
+        self.drop.add(0x0001)
+        self.counts[0x0064] = 1000
+        # The device resets before the third round's second request
+        self.reset_at = 6
+        poller = zdiags.ZDiagsPoller(self.fake, self.mtapi, self.path,
+                                     0.01, [0x0001, 0x0064],
+                                     timeout=0.02)
+        rows = self.run_poller(poller, 3)
+        self.assertEqual(poller.missed, 3)
+        self.assertEqual([row[2] for row in rows[1:]],
+                         ["1005", "1010", "105"])
+        self.assertEqual(rows[1][3], "")
+        self.assertNotEqual(rows[2][3], "")
+        self.assertEqual(rows[3][3], "")
+
+    def test_late_reply(self):
+        self.drop.add(0x0001)
+        self.counts[0x0064] = 1000
+        poller = zdiags.ZDiagsPoller(self.fake, self.mtapi, self.path,
+                                     10, [0x0001, 0x0064],
+                                     timeout=0.05)
+        poller.start()
+        self.addCleanup(poller.stop)
+        poller.tick()
+        self.assertEqual(poller.current, 0x0001)
+        time.sleep(poller.wait_time())
+        poller.tick()
+        # Nothing is sent while a late reply may still arrive
+        self.assertIsNone(poller.current)
+        self.assertEqual(len(self.fake.written), 1)
+        self.assertGreater(poller.wait_time(), 0)
+        self.fake.device.sendall(make_frame(0x61, 0x19,
+                                            (7).to_bytes(4, "little")))
+        self.mtapi.run_until(lambda: poller.late, 1.0)
+        self.assertEqual((poller.late, poller.samples), (1, 0))
+        time.sleep(poller.wait_time())
+        poller.tick()
+        self.assertEqual(poller.current, 0x0064)
+        self.mtapi.run_until(lambda: poller.current is None, 1.0)
+        self.assertEqual(poller.samples, 1)
+        self.assertEqual(poller.last[0x0064][1], 1005)
+        self.assertNotIn(0x0001, poller.last)
+
+    def test_not_displayed(self):
+        self.mtapi.display = "decode"
+        poller = zdiags.ZDiagsPoller(self.fake, self.mtapi, self.path,
+                                     1, [0x0000])
+        with support.captured_stdout() as stdout:
+            self.run_poller(poller, 1)
+            self.fake.write(make_frame(0x21, 0x19, b'\x00\x00'))
+            self.mtapi.run_until(lambda: False, 0.05)
+        # Only the reply to a request of our own is shown
+        self.assertEqual(stdout.getvalue().count("SYS_ZDIAGS_GET_STATS"),
+                         1)
+
+    def test_limits(self):
+        with self.assertRaises(ValueError):
+            zdiags.ZDiagsPoller(self.fake, self.mtapi, self.path, 0)
+        with self.assertRaises(ValueError):
+            zdiags.ZDiagsPoller(self.fake, self.mtapi, self.path, 1, [])
+
+    def test_command(self):
+        with support.captured_stdout() as stdout:
+            ui = keyboard.UIHandler(self.fake, self.mtapi)
+            self.assertIsNone(ui.timeout())
+            self.assertTrue(ui.execute(["zdiags", self.path]))
+            self.assertTrue(ui.execute(["zdiags", self.path, "1",
+                                        "nonsense"]))
+            self.assertIsNone(ui.poller)
+            self.assertTrue(ui.execute(["zdiags", self.path, "1",
+                                        "aps_tx_ucast_fail"]))
+            self.assertEqual(ui.timeout(), 0)
+            ui.tick()
+            self.mtapi.run_until(lambda: ui.poller.samples == 1, 1)
+            self.assertTrue(ui.execute(["zdiags"]))
+            self.assertTrue(ui.execute(["zdiags", "stop"]))
+            self.assertIsNone(ui.poller)
+            self.assertTrue(ui.execute(["zdiags", "stop"]))
+            script = keyboard.UIHandler(self.fake, self.mtapi,
+                                        interactive=False)
+            self.assertTrue(script.execute(["zdiags", self.path, "1"]))
+        output = stdout.getvalue()
+        self.assertIn("Polling 1 attributes into %s: 1 rounds, "
+                      "1 samples, 0 missed, 0 late" % self.path, output)
+        self.assertIn("Unknown attribute 'nonsense'", output)
+        self.assertIn("Wrote 1 samples", output)
+        self.assertIn("Not polling statistics", output)
+        self.assertIn("Cannot poll statistics from a script", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -390,7 +390,11 @@ class TestZdoStateChangeInd(BaseZdoAReq):
     COMMAND_NAME = "ZDO_STATE_CHANGE_IND"
 
     def test_state_change(self):
-        self.add_byte("State", "0x01")
+        self.add_byte("State", "Not connected", 1)
+        self.run_test()
+
+    def test_unknown_state(self):
+        self.add_byte("State", "Unknown(0x42)", 0x42)
         self.run_test()
 
 
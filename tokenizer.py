@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+
+# tokenizer.py
+#
+# Splitting console command lines into tokens
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import re
+
+
+# Characters that mean a line needs more than splitting on whitespace
+SPECIAL = re.compile(r"""['"\\]""")
+
+# The pieces that make up a line.  Adjacent pieces with no whitespace
+# between them form a single token, so 'a"b c"' is the token "ab c".
+PIECE = r"""
+    (?P<space>\s+)
+  | (?P<word>[^\s'"\\%s]+)
+  | "(?P<dquoted>(?:[^"\\]|\\.)*)"
+  | '(?P<squoted>[^']*)'
+  | \\(?P<escaped>.)
+  %s
+  | (?P<error>.)
+"""
+PIECE_NO_COMMENTS = re.compile(PIECE % ("", ""), re.VERBOSE | re.DOTALL)
+PIECE_COMMENTS = re.compile(PIECE % (r"\#", r"| (?P<comment>\#[^\n]*)"),
+                            re.VERBOSE | re.DOTALL)
+
+# Comments run from a '#' to the end of the line
+COMMENT = re.compile(r"#[^\n]*")
+
+# Within double quotes only a double quote or a backslash is escaped
+DQUOTE_ESCAPE = re.compile(r"""\\(["\\])""")
+
+
+def tokenize(line, comments=False):
+    """Split a command line into a list of tokens.  Tokens are
+    separated by whitespace, and may be quoted with single or double
+    quotes to include whitespace (e.g. for dictionary values such as
+    "Started as Coordinator").  A backslash escapes the following
+    character outside quotes, or a double quote or backslash within
+    double quotes.  If `comments` is True, a '#' outside quotes starts
+    a comment that runs to the end of the line.
+
+    The results are the same as shlex.split() would give, but the
+    common case of a line of numbers, names and hex byte lists is
+    simply split on whitespace.  A ValueError is raised if a quote is
+    unterminated or the line ends with a backslash."""
+    if SPECIAL.search(line) is None:
+        if comments:
+            line = COMMENT.sub("", line)
+        return line.split()
+
+    pattern = PIECE_COMMENTS if comments else PIECE_NO_COMMENTS
+    tokens = []
+    token = None
+    for match in pattern.finditer(line):
+        kind = match.lastgroup
+        if kind == "space":
+            if token is not None:
+                tokens.append(token)
+                token = None
+            continue
+        if kind == "comment":
+            continue
+        if kind == "error":
+            if match.group(kind) == "\\":
+                raise ValueError("No escaped character")
+            raise ValueError("No closing quotation")
+        text = match.group(kind)
+        if kind == "dquoted":
+            text = DQUOTE_ESCAPE.sub(r"\1", text)
+        if token is None:
+            token = text
+        else:
+            token += text
+    if token is not None:
+        tokens.append(token)
+    return tokens
@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+
+# transport.py
+#
+# The ways of connecting to a device, real or simulated
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import select
+import socket
+import tty
+
+
+def socket_address(address):
+    """Return the socket family and address given by `address`, which
+    is "unix:PATH" or "tcp:[HOST:]PORT", or None if `address` is not
+    in either form.  TCP addresses are on the loopback interface unless
+    a host is given.  Raises a ValueError if the port is not a number.
+    """
+    kind, _, where = address.partition(":")
+    if kind == "unix" and where:
+        return socket.AF_UNIX, where
+    if kind == "tcp" and where:
+        host, _, port = where.rpartition(":")
+        try:
+            port = int(port)
+        except ValueError:
+            raise ValueError("'%s' is not a port number" % port) from None
+        return socket.AF_INET, (host or "127.0.0.1", port)
+    return None
+
+
+class SocketTransport:
+    """A connection to a device through a stream socket, looking like a
+    pyserial port opened with `timeout=0` to the rest of the program:
+    reads return whatever bytes have arrived, or none, without waiting.
+    Writes wait until everything has been sent."""
+    def __init__(self, sock):
+        self.sock = sock
+        peer = sock.getpeername()
+        if isinstance(peer, tuple):
+            peer = "%s:%d" % peer[:2]
+        self.name = peer or "socket"
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self, size=1):
+        """Return up to `size` bytes received.  Raises an EOFError if the
+        other end has closed the connection."""
+        try:
+            data = self.sock.recv(size, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return b''
+        except ConnectionResetError:
+            data = b''
+        if not data:
+            raise EOFError("Connection to %s closed" % self.name)
+        return data
+
+    def write(self, data):
+        """Send all of `data`.  Raises an EOFError, as read() does, if
+        the other end has closed the connection."""
+        try:
+            self.sock.sendall(data)
+        except (BrokenPipeError, ConnectionResetError):
+            raise EOFError("Connection to %s closed" % self.name) from None
+        return len(data)
+
+    def close(self):
+        self.sock.close()
+
+
+class PtyTransport:
+    """A connection to a device through a new pseudo-terminal, for a
+    simulator or serial bridge to open as if it were a serial port.
+    `name` is the path of the terminal that is to be opened.  The
+    terminal is held open here as well, so that the device going away
+    and coming back does not end the connection."""
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.name = os.ttyname(self.slave)
+
+    def fileno(self):
+        return self.master
+
+    def read(self, size=1):
+        "Return up to `size` bytes received."
+        try:
+            return os.read(self.master, size)
+        except BlockingIOError:
+            return b''
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.master, view):]
+            except BlockingIOError:
+                select.select([], [self.master], [])
+        return len(data)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def loopback():
+    """Return a pair of transports connected to each other, one for the
+    console and one for a device running in the same process."""
+    host, device = socket.socketpair()
+    return SocketTransport(host), SocketTransport(device)
+
+
+def open_transport(spec, baud=115200):
+    """Return a transport connected as `spec` describes:
+
+        tcp:[HOST:]PORT  a serial bridge or simulator listening on TCP
+        unix:PATH        a serial bridge or simulator on a Unix socket
+        pty:             a new pseudo-terminal for a device to open
+        anything else    a serial port, opened at `baud` baud
+
+    Raises an OSError if the connection cannot be made, a ValueError if
+    `spec` is not valid, or an ImportError if a serial port is wanted
+    but pyserial is not installed."""
+    address = socket_address(spec)
+    if address is not None:
+        family, where = address
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(where)
+        except OSError:
+            sock.close()
+            raise
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return SocketTransport(sock)
+    if spec == "pty:":
+        return PtyTransport()
+    # Only real hardware needs pyserial
+    import serial
+    return serial.Serial(spec, baud, timeout=0)
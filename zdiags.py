@@ -0,0 +1,242 @@
+#! /usr/bin/env python3
+
+# zdiags.py
+#
+# Polling the device's ZDIAGS statistics into a time series
+#
+# Copyright 2016 Kynesim Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import csv
+import time
+from collections import deque
+from template import FrameTemplate
+
+
+# The diagnostic attributes kept by Z-Stack (ZDiags.h)
+ZDIAGS_ATTRIBUTES = {
+    0x0000: "SYSTEM_CLOCK",
+    0x0001: "NUMBER_OF_RESETS",
+    0x0002: "PERSISTENT_MEMORY_WRITES",
+    0x0064: "MAC_RX_CRC_PASS",
+    0x0065: "MAC_RX_CRC_FAIL",
+    0x0066: "MAC_RX_BCAST",
+    0x0067: "MAC_TX_BCAST",
+    0x0068: "MAC_RX_UCAST",
+    0x0069: "MAC_TX_UCAST",
+    0x006a: "MAC_TX_UCAST_RETRY",
+    0x006b: "MAC_TX_UCAST_FAIL",
+    0x00c8: "ROUTE_DISC_INITIATED",
+    0x00c9: "NEIGHBOR_ADDED",
+    0x00ca: "NEIGHBOR_REMOVED",
+    0x00cb: "NEIGHBOR_STALE",
+    0x00cc: "JOIN_INDICATION",
+    0x00cd: "CHILD_MOVED",
+    0x00ce: "NWK_FC_FAILURE",
+    0x00cf: "NWK_DECRYPT_FAILURES",
+    0x00d0: "PACKET_BUFFER_ALLOCATE_FAILURES",
+    0x00d1: "RELAYED_UCAST",
+    0x00d2: "PHY_TO_MAC_QUEUE_LIMIT_REACHED",
+    0x00d3: "PACKET_VALIDATE_DROP_COUNT",
+    0x012c: "APS_RX_BCAST",
+    0x012d: "APS_TX_BCAST",
+    0x012e: "APS_RX_UCAST",
+    0x012f: "APS_TX_UCAST_SUCCESS",
+    0x0130: "APS_TX_UCAST_RETRY",
+    0x0131: "APS_TX_UCAST_FAIL",
+    0x0132: "APS_FC_FAILURE",
+    0x0133: "APS_UNAUTHORIZED_KEY",
+    0x0134: "APS_DECRYPT_FAILURES",
+    0x0135: "APS_INVALID_PACKETS",
+    0x0136: "MAC_RETRIES_PER_APS_TX_SUCCESS"
+}
+
+# Seconds to wait for each SRSP before skipping the attribute
+ZDIAGS_TIMEOUT = 1.0
+
+# The key of the SRSP to SYS_ZDIAGS_GET_STATS
+ZDIAGS_SRSP = ("SRSP", "SYS", 0x19)
+
+# The columns of the time series
+CSV_HEADER = ("time", "attribute", "value", "rate")
+
+
+def attribute_name(attribute):
+    "Return the name of the diagnostic attribute ID `attribute`."
+    return ZDIAGS_ATTRIBUTES.get(attribute, "0x%04x" % attribute)
+
+
+def attribute_id(token):
+    """Return the diagnostic attribute ID given by `token`, which is
+    either a number or an attribute name such as "mac_tx_ucast_retry".
+    Raises a ValueError if it is neither."""
+    name = token.upper()
+    for attribute, known in ZDIAGS_ATTRIBUTES.items():
+        if known == name:
+            return attribute
+    try:
+        attribute = int(token, 0)
+    except ValueError:
+        raise ValueError("Unknown attribute '%s'" % token) from None
+    if not 0 <= attribute <= 0xffff:
+        raise ValueError("Attribute ID %s out of range" % token)
+    return attribute
+
+
+class ZDiagsPoller:
+    """Reads a set of ZDIAGS attributes every `interval` seconds and
+    writes each value to the CSV file `path` as it arrives, along with
+    the rate at which it has changed per second since the previous
+    sample.  A rate is not given for the first sample of an attribute,
+    or if the value has gone down (as counters do when the device
+    resets).
+
+    The poller does not block.  Instead `tick()` must be called
+    whenever `wait_time()` says there is work to do, and it sends the
+    next request as soon as the previous one has been answered.  This
+    keeps the device busy with requests during each round while
+    letting the caller handle other input, such as console commands,
+    between them.  Rounds start every `interval` seconds, or as soon
+    as the previous round finishes if that takes longer.
+
+    The SRSP does not say which attribute it is for, so a reply is
+    taken to be for the request outstanding.  When a request times
+    out, nothing more is sent for another `timeout` seconds, and a
+    reply arriving meanwhile is counted as late and thrown away rather
+    than being credited to the next attribute."""
+    def __init__(self, sock, mtapi, path, interval, attributes=None,
+                 timeout=ZDIAGS_TIMEOUT):
+        """Create a poller sending requests to the serial comms socket
+        `sock` and reading the replies through the MTAPI receiver
+        `mtapi`.  By default every known attribute is read.  Raises a
+        ValueError if there is nothing to poll."""
+        if interval <= 0:
+            raise ValueError("Interval must be positive")
+        if attributes is None:
+            attributes = sorted(ZDIAGS_ATTRIBUTES)
+        if not attributes:
+            raise ValueError("No attributes to poll")
+        self.sock = sock
+        self.mtapi = mtapi
+        self.path = path
+        self.interval = interval
+        self.timeout = timeout
+        self.attributes = list(attributes)
+        # The requests never change, so build them all up front
+        template = FrameTemplate("SYS", "SREQ", "SYS_ZDIAGS_GET_STATS",
+                                 ["sys_zdiags_get_stats", "{}"])
+        self.frames = dict(zip(self.attributes,
+                               template.frames("AttributeId",
+                                               self.attributes)))
+        self.queue = deque()
+        self.current = None
+        self.deadline = None
+        self.abandoned = None
+        self.quiet_until = None
+        self.next_round = None
+        self.last = {}
+        self.output = None
+        self.writer = None
+        self.rounds = 0
+        self.samples = 0
+        self.missed = 0
+        self.late = 0
+
+    def start(self):
+        """Create the output file and start polling.  Raises an OSError
+        if the file cannot be written."""
+        self.output = open(self.path, "w", newline="")
+        self.writer = csv.writer(self.output, lineterminator="\n")
+        self.writer.writerow(CSV_HEADER)
+        self.mtapi.events.subscribe(self.handler, *ZDIAGS_SRSP)
+        self.next_round = time.monotonic()
+
+    def stop(self):
+        "Stop polling and close the output file."
+        self.mtapi.events.unsubscribe(self.handler)
+        self.output.close()
+        self.queue.clear()
+        self.current = None
+        self.abandoned = None
+
+    def handler(self, key, record):
+        """Record the reply to the outstanding request.  The reply is
+        not displayed, so as not to swamp the console.  A reply that
+        cannot be decoded is left for the request to time out."""
+        if self.current is None:
+            if self.abandoned is None:
+                return False
+            # The reply to the request that timed out, which must not
+            # be taken for the reply to the next one
+            self.abandoned = None
+            self.late += 1
+            return True
+        attribute = self.current
+        self.current = None
+        self.record(attribute, record["AttributeValue"])
+        return True
+
+    def record(self, attribute, value):
+        "Write a sample of `attribute` to the time series."
+        now = time.monotonic()
+        rate = ""
+        previous = self.last.get(attribute)
+        if previous is not None and value >= previous[1] and \
+           now > previous[0]:
+            rate = "%.3f" % ((value - previous[1]) / (now - previous[0]))
+        self.last[attribute] = (now, value)
+        self.writer.writerow(("%.3f" % time.time(),
+                              attribute_name(attribute), value, rate))
+        self.samples += 1
+
+    def wait_time(self):
+        "Return the seconds until `tick()` next has anything to do."
+        now = time.monotonic()
+        if self.current is not None:
+            return max(self.deadline - now, 0)
+        if self.abandoned is not None:
+            return max(self.quiet_until - now, 0)
+        if self.queue:
+            return 0
+        return max(self.next_round - now, 0)
+
+    def tick(self):
+        """Give up on a request that has not been answered in time,
+        start a new round if one is due, and send the next request if
+        none is outstanding."""
+        now = time.monotonic()
+        if self.current is not None:
+            if self.deadline > now:
+                return
+            self.abandoned = self.current
+            self.quiet_until = now + self.timeout
+            self.current = None
+            self.missed += 1
+        if self.abandoned is not None:
+            if self.quiet_until > now:
+                return
+            # No reply after all
+            self.abandoned = None
+        if not self.queue:
+            if now < self.next_round:
+                return
+            # Each round's samples are on disk before the next starts
+            self.output.flush()
+            self.queue.extend(self.attributes)
+            self.next_round = max(self.next_round + self.interval, now)
+            self.rounds += 1
+        self.current = self.queue.popleft()
+        self.deadline = now + self.timeout
+        self.sock.write(self.frames[self.current])